@@ -0,0 +1,887 @@
+"""Create zip files with a thread pool
+
+Files are split into blocks which are deflated by a thread pool (zlib
+releases the GIL), and the blocks are written to the archive in order. Each
+block is deflated independently and ends with a sync flush, so the
+concatenated blocks are one valid deflate stream, and the crc32 of blocks
+are combined. Deflated members are written with data descriptors, so the
+output need not to be seekable. Stored members have their crc32 and sizes in
+the local headers which some streaming readers require, so their files are
+read twice.
+
+Directories can also be archived as tar.gz, tar.xz and tar.zst, gzip is
+compressed by the same thread pool and zstd uses its own threads.
+
+Zip files are extracted by threads which share one file descriptor.
+"""
+import collections
+import fnmatch
+import functools
+import lzma
+import os
+import shutil
+import stat
+import struct
+import subprocess
+import sys
+import tarfile
+import time
+import zipfile
+import zlib
+from concurrent import futures
+
+from anycode.common import log
+
+LOG = log.getLogger(__name__)
+
+FORMAT_ZIP = 'zip'
+FORMAT_TAR_GZ = 'tar.gz'
+FORMAT_TAR_XZ = 'tar.xz'
+FORMAT_TAR_ZST = 'tar.zst'
+FORMATS = [FORMAT_ZIP, FORMAT_TAR_GZ, FORMAT_TAR_XZ, FORMAT_TAR_ZST]
+DEFAULT_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 3
+# the valid compress levels of formats, (min, max)
+LEVEL_RANGES = {
+    FORMAT_ZIP: (0, 9),
+    FORMAT_TAR_GZ: (0, 9),
+    FORMAT_TAR_XZ: (0, 9),
+    FORMAT_TAR_ZST: (1, 19),
+}
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# members with these extensions are stored without compression
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv',
+    '.gz', '.tgz', '.bz2', '.xz', '.txz', '.zst', '.lz4', '.7z', '.rar',
+    '.zip', '.jar', '.war', '.whl', '.egg', '.rpm', '.deb', '.apk',
+}
+# use zip64 extra fields if the size of member may exceed 4GB
+ZIP64_LIMIT = 0xFFFFFFFF - 64 * 1024 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+# made by unix, so the external attributes hold the mode of file
+VERSION_MADE_BY = (3 << 8) | VERSION_ZIP64
+
+STRUCT_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+STRUCT_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+STRUCT_DESCRIPTOR = struct.Struct('<IIII')
+STRUCT_DESCRIPTOR64 = struct.Struct('<IIQQ')
+STRUCT_END = struct.Struct('<IHHHHIIH')
+STRUCT_END64 = struct.Struct('<IQHHIIQQQQ')
+STRUCT_END64_LOCATOR = struct.Struct('<IIQI')
+SIGNATURE_LOCAL_HEADER = 0x04034b50
+SIGNATURE_CENTRAL_HEADER = 0x02014b50
+SIGNATURE_DESCRIPTOR = 0x08074b50
+SIGNATURE_END = 0x06054b50
+SIGNATURE_END64 = 0x06064b50
+SIGNATURE_END64_LOCATOR = 0x07064b50
+EXTRA_ZIP64 = 0x0001
+EXTRA_TIMESTAMP = 0x5455
+
+
+def _gf2_times(matrix, vector):
+    total, index = 0, 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return total
+
+
+def _gf2_multiply(matrix1, matrix2):
+    return [_gf2_times(matrix1, column) for column in matrix2]
+
+
+@functools.lru_cache(maxsize=64)
+def _crc32_zeros_operator(length):
+    """The matrix which appends length zero bytes to a crc32"""
+    operator = [0xedb88320] + [1 << n for n in range(31)]
+    for _ in range(3):
+        operator = _gf2_multiply(operator, operator)
+    result = [1 << n for n in range(32)]
+    while length:
+        if length & 1:
+            result = _gf2_multiply(operator, result)
+        length >>= 1
+        if length:
+            operator = _gf2_multiply(operator, operator)
+    return result
+
+
+def crc32_combine(crc1, crc2, length2):
+    """Return the crc32 of data1 + data2
+
+    Param:
+        crc1, crc2: the crc32 of data1 and data2
+        length2: the length of data2
+    """
+    return _gf2_times(_crc32_zeros_operator(length2), crc1) ^ crc2
+
+
+def to_dos_time(mtime):
+    """Return (dos time, dos date) of timestamp"""
+    tm = time.localtime(mtime)
+    if tm.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return ((tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2),
+            ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday)
+
+
+class ZipEntry(object):
+
+    def __init__(self, name, mtime, mode, method=ZIP_DEFLATED, zip64=False):
+        self.name = name
+        self.mtime = mtime
+        self.mode = mode
+        self.method = method
+        self.zip64 = zip64
+        self.flags = FLAG_DATA_DESCRIPTOR
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+        self.offset = 0
+
+    @property
+    def is_dir(self):
+        return self.name.endswith('/')
+
+    @property
+    def encoded_name(self):
+        try:
+            return self.name.encode('ascii')
+        except UnicodeEncodeError:
+            return self.name.encode('utf-8')
+
+    @property
+    def name_flags(self):
+        try:
+            self.name.encode('ascii')
+            return 0
+        except UnicodeEncodeError:
+            return FLAG_UTF8
+
+    @property
+    def external_attr(self):
+        attr = (self.mode & 0xFFFF) << 16
+        if self.is_dir:
+            # MS-DOS directory flag
+            attr |= 0x10
+        return attr
+
+    def timestamp_extra(self):
+        mtime = min(max(int(self.mtime), 0), 0xFFFFFFFF)
+        return struct.pack('<HHBI', EXTRA_TIMESTAMP, 5, 1, mtime)
+
+
+class ZipWriter(object):
+    """Write zip file sequentially
+
+    The output need not to be seekable, e.g. stdout.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.entries = []
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def start_entry(self, entry):
+        """Write the local header of entry
+
+        If entry.flags has FLAG_DATA_DESCRIPTOR, crc and sizes are written
+        by end_entry, otherwise they must be set before.
+        """
+        entry.offset = self.offset
+        extra = entry.timestamp_extra()
+        crc, compress_size, file_size = 0, 0, 0
+        if not entry.flags & FLAG_DATA_DESCRIPTOR:
+            crc = entry.crc
+            compress_size, file_size = entry.compress_size, entry.file_size
+        if entry.zip64:
+            extra += struct.pack('<HHQQ', EXTRA_ZIP64, 16,
+                                 file_size, compress_size)
+            compress_size = file_size = 0xFFFFFFFF
+        dos_time, dos_date = to_dos_time(entry.mtime)
+        name = entry.encoded_name
+        self._write(STRUCT_LOCAL_HEADER.pack(
+            SIGNATURE_LOCAL_HEADER,
+            entry.zip64 and VERSION_ZIP64 or VERSION_DEFAULT,
+            entry.flags | entry.name_flags, entry.method, dos_time, dos_date,
+            crc, compress_size, file_size, len(name), len(extra)))
+        self._write(name)
+        self._write(extra)
+
+    def write(self, data):
+        self._write(data)
+
+    def end_entry(self, entry):
+        if entry.flags & FLAG_DATA_DESCRIPTOR:
+            if entry.zip64:
+                self._write(STRUCT_DESCRIPTOR64.pack(
+                    SIGNATURE_DESCRIPTOR, entry.crc, entry.compress_size,
+                    entry.file_size))
+            else:
+                self._write(STRUCT_DESCRIPTOR.pack(
+                    SIGNATURE_DESCRIPTOR, entry.crc, entry.compress_size,
+                    entry.file_size))
+        self.entries.append(entry)
+
+    def add_dir(self, name, mtime, mode):
+        entry = ZipEntry(name.rstrip('/') + '/', mtime, mode,
+                         method=ZIP_STORED)
+        entry.flags = 0
+        self.start_entry(entry)
+        self.end_entry(entry)
+
+    def _write_central_header(self, entry):
+        extra = entry.timestamp_extra()
+        zip64_values = []
+        file_size, compress_size = entry.file_size, entry.compress_size
+        offset = entry.offset
+        if entry.zip64 or file_size >= 0xFFFFFFFF or \
+           compress_size >= 0xFFFFFFFF:
+            zip64_values.extend([file_size, compress_size])
+            file_size = compress_size = 0xFFFFFFFF
+        if offset >= 0xFFFFFFFF:
+            zip64_values.append(offset)
+            offset = 0xFFFFFFFF
+        if zip64_values:
+            extra += struct.pack('<HH', EXTRA_ZIP64, 8 * len(zip64_values))
+            extra += struct.pack('<{}Q'.format(len(zip64_values)),
+                                 *zip64_values)
+        dos_time, dos_date = to_dos_time(entry.mtime)
+        name = entry.encoded_name
+        self._write(STRUCT_CENTRAL_HEADER.pack(
+            SIGNATURE_CENTRAL_HEADER, VERSION_MADE_BY,
+            zip64_values and VERSION_ZIP64 or VERSION_DEFAULT,
+            entry.flags | entry.name_flags, entry.method, dos_time, dos_date,
+            entry.crc, compress_size, file_size, len(name), len(extra), 0,
+            0, 0, entry.external_attr, offset))
+        self._write(name)
+        self._write(extra)
+
+    def close(self):
+        """Write the central directory"""
+        start = self.offset
+        for entry in self.entries:
+            self._write_central_header(entry)
+        size = self.offset - start
+        count = len(self.entries)
+        if count >= 0xFFFF or start >= 0xFFFFFFFF or size >= 0xFFFFFFFF:
+            end64_offset = self.offset
+            self._write(STRUCT_END64.pack(
+                SIGNATURE_END64, STRUCT_END64.size - 12, VERSION_MADE_BY,
+                VERSION_ZIP64, 0, 0, count, count, size, start))
+            self._write(STRUCT_END64_LOCATOR.pack(
+                SIGNATURE_END64_LOCATOR, 0, end64_offset, 1))
+            count = min(count, 0xFFFF)
+            start, size = min(start, 0xFFFFFFFF), min(size, 0xFFFFFFFF)
+        self._write(STRUCT_END.pack(SIGNATURE_END, 0, 0, count, count,
+                                    size, start, 0))
+        self.fileobj.flush()
+
+
+def iter_members(src, zip_root=True, zip_path=True, all_dirs=False):
+    """Yield (path, arcname, stat) of files and empty dirs in src
+
+    Param:
+        zip_root: the name of src is the root of arcnames
+        zip_path: keep the relative path in arcnames, otherwise only the
+                  file name
+        all_dirs: yield all dirs rather than only the empty ones, so that
+                  their modes and mtimes are kept
+    """
+    src = os.path.abspath(src)
+    base = os.path.dirname(src) if zip_root else src
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        if (all_dirs or not dirs and not files) and zip_path and \
+           root != base:
+            yield root, os.path.relpath(root, base).replace(os.sep, '/') + \
+                '/', os.stat(root)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not os.path.isfile(path):
+                continue
+            arcname = os.path.relpath(path, base) if zip_path else name
+            yield path, arcname.replace(os.sep, '/'), os.stat(path)
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+
+
+def get_method(path, level):
+    if not level or is_compressed(path):
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
+def get_zip_mtime(info):
+    """Return the mtime of ZipInfo
+
+    The mtime in the extended timestamp extra field is used if it exists,
+    otherwise the dos time which is accurate to 2 seconds.
+    """
+    extra, offset = info.extra, 0
+    while offset + 4 <= len(extra):
+        tag, size = struct.unpack_from('<HH', extra, offset)
+        if tag == EXTRA_TIMESTAMP and size >= 5 and extra[offset + 4] & 1:
+            return struct.unpack_from('<I', extra, offset + 5)[0]
+        offset += 4 + size
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+def find_unchanged(zip_file, members, level=None):
+    """Find members which are not changed since the zip file was created
+
+    A member is unchanged if its size and mtime are the same as the
+    previous one, and it would be compressed by the same method.
+    Return:
+        dict of {arcname: ZipInfo}
+    """
+    level = DEFAULT_LEVEL if level is None else level
+    infos = {info.filename: info for info in zip_file.infolist()}
+    unchanged = {}
+    for path, arcname, file_stat in members:
+        info = infos.get(arcname)
+        if not info or arcname.endswith('/') or info.flag_bits & 0x01:
+            continue
+        if info.file_size != file_stat.st_size or \
+           info.compress_type != get_method(path, level):
+            continue
+        mtime = get_zip_mtime(info)
+        if isinstance(mtime, int):
+            changed = mtime != int(file_stat.st_mtime)
+        else:
+            changed = abs(mtime - file_stat.st_mtime) >= 2
+        if not changed:
+            unchanged[arcname] = info
+    return unchanged
+
+
+def copy_raw(writer, zip_fp, info, file_stat):
+    """Copy the compressed data of ZipInfo to writer without decompression"""
+    zip_fp.seek(info.header_offset)
+    header = STRUCT_LOCAL_HEADER.unpack(zip_fp.read(STRUCT_LOCAL_HEADER.size))
+    if header[0] != SIGNATURE_LOCAL_HEADER:
+        raise zipfile.BadZipFile('bad local header of {}'.format(
+            info.filename))
+    zip_fp.seek(header[-2] + header[-1], os.SEEK_CUR)
+    entry = ZipEntry(info.filename, file_stat.st_mtime, file_stat.st_mode,
+                     method=info.compress_type,
+                     zip64=info.file_size >= ZIP64_LIMIT or
+                     info.compress_size >= ZIP64_LIMIT)
+    entry.flags = 0
+    entry.crc = info.CRC
+    entry.file_size, entry.compress_size = info.file_size, info.compress_size
+    writer.start_entry(entry)
+    remain = info.compress_size
+    while remain > 0:
+        data = zip_fp.read(min(remain, DEFAULT_BLOCK_SIZE))
+        if not data:
+            raise zipfile.BadZipFile('{} is truncated'.format(info.filename))
+        writer.write(data)
+        remain -= len(data)
+    writer.end_entry(entry)
+
+
+def _deflate_block(data, level, last):
+    """Return (crc32, length, raw deflate data) of block
+
+    The blocks which are not the last end with a sync flush, so that the
+    compressed blocks can be concatenated.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return zlib.crc32(data), len(data), compressed
+
+
+def _compress_block(path, offset, length, method, level, last):
+    """Return (crc32, the num of bytes read, compressed data) of block"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    if method == ZIP_STORED:
+        return zlib.crc32(data), len(data), data
+    return _deflate_block(data, level, last)
+
+
+def _file_crc32(path, length):
+    """Return crc32 of the first length bytes of file"""
+    crc = 0
+    with open(path, 'rb') as f:
+        while length > 0:
+            data = f.read(min(length, DEFAULT_BLOCK_SIZE))
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            length -= len(data)
+    return crc
+
+
+def _iter_blocks(members, block_size, unchanged):
+    for path, arcname, file_stat in members:
+        if arcname.endswith('/') or arcname in unchanged:
+            yield path, arcname, file_stat, None, 0, True
+            continue
+        num = max(1, (file_stat.st_size + block_size - 1) // block_size)
+        for index in range(num):
+            yield (path, arcname, file_stat, index * block_size,
+                   block_size, index == num - 1)
+
+
+def write_zip(fileobj, members, level=None, workers=None, block_size=None,
+              verbose=False, previous=None):
+    """Write members to fileobj as a zip file
+
+    Param:
+        members: list of (path, arcname, stat)
+        level: compress level 0-9, members are stored if level is 0
+        previous: the path of previous zip file, the compressed data of
+                  unchanged members are copied from it
+    """
+    level = DEFAULT_LEVEL if level is None else level
+    block_size = block_size or DEFAULT_BLOCK_SIZE
+    workers = workers or os.cpu_count() or 1
+    writer = ZipWriter(fileobj)
+    pending = collections.deque()
+    entry, written_crc, written_size = None, 0, 0
+    unchanged, zip_fp = {}, None
+
+    def _handle(item, future, crc_future):
+        nonlocal entry, written_crc, written_size
+        path, arcname, file_stat, offset, _, last = item
+        if arcname in unchanged:
+            copy_raw(writer, zip_fp, unchanged[arcname], file_stat)
+            return
+        if offset is None:
+            writer.add_dir(arcname, file_stat.st_mtime,
+                           stat.S_IMODE(file_stat.st_mode) | stat.S_IFDIR)
+            return
+        if offset == 0:
+            if verbose:
+                print(arcname, file=sys.stderr)
+            entry = ZipEntry(arcname, file_stat.st_mtime, file_stat.st_mode,
+                             method=get_method(path, level),
+                             zip64=file_stat.st_size >= ZIP64_LIMIT)
+            if crc_future:
+                entry.flags = 0
+                entry.crc = crc_future.result()
+                entry.file_size = entry.compress_size = file_stat.st_size
+            writer.start_entry(entry)
+            written_crc, written_size = 0, 0
+        crc, size, data = future.result()
+        written_crc = crc32_combine(written_crc, crc, size) if offset else crc
+        written_size += size
+        writer.write(data)
+        if entry.flags & FLAG_DATA_DESCRIPTOR:
+            entry.crc, entry.file_size = written_crc, written_size
+            entry.compress_size += len(data)
+        elif last and (written_crc, written_size) != (entry.crc,
+                                                      entry.file_size):
+            # the local header is written, it can not be fixed
+            raise OSError('{} is changed while archiving'.format(path))
+        if last:
+            writer.end_entry(entry)
+
+    try:
+        if previous:
+            zip_fp = open(previous, 'rb')
+            with zipfile.ZipFile(zip_fp) as zip_file:
+                unchanged = find_unchanged(zip_file, members, level=level)
+            LOG.info('%s of %s members are unchanged', len(unchanged),
+                     len(members))
+        with futures.ThreadPoolExecutor(workers) as executor:
+            for item in _iter_blocks(members, block_size, unchanged):
+                path, arcname, file_stat, offset, length, last = item
+                future = crc_future = None
+                if offset is not None:
+                    method = get_method(path, level)
+                    if offset == 0 and method == ZIP_STORED:
+                        crc_future = executor.submit(
+                            _file_crc32, path, file_stat.st_size)
+                    future = executor.submit(
+                        _compress_block, path, offset, length, method,
+                        level, last)
+                pending.append((item, future, crc_future))
+                # NOTE: limit the compressed blocks in memory
+                if len(pending) >= workers * 4:
+                    _handle(*pending.popleft())
+            while pending:
+                _handle(*pending.popleft())
+    finally:
+        if zip_fp:
+            zip_fp.close()
+    writer.close()
+    return writer.entries
+
+
+class ParallelGzipWriter(object):
+    """A writable file object which compresses data to gzip with threads"""
+
+    def __init__(self, fileobj, level=None, workers=None, block_size=None):
+        self.fileobj = fileobj
+        self.level = DEFAULT_LEVEL if level is None else level
+        self.workers = workers or os.cpu_count() or 1
+        self.block_size = block_size or DEFAULT_BLOCK_SIZE
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._executor = futures.ThreadPoolExecutor(self.workers)
+        self.crc = 0
+        self.size = 0
+        # magic, deflate, no flags, no mtime, no extra flags, unknown os
+        self.fileobj.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+
+    def _submit(self, data, last=False):
+        self._pending.append(self._executor.submit(
+            _deflate_block, data, self.level, last))
+        while self._pending and (
+                last or len(self._pending) >= self.workers * 4):
+            crc, size, compressed = self._pending.popleft().result()
+            self.crc = crc32_combine(self.crc, crc, size)
+            self.size += size
+            self.fileobj.write(compressed)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        if self._executor is None:
+            return
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self.fileobj.write(struct.pack('<II', self.crc,
+                                           self.size & 0xFFFFFFFF))
+            self.fileobj.flush()
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class ProcessWriter(object):
+    """A writable file object which pipes data to a compress command"""
+
+    def __init__(self, cmd, fileobj):
+        fileobj.flush()
+        self.cmd = cmd
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                         stdout=fileobj.fileno())
+
+    def write(self, data):
+        self._process.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        self._process.stdin.close()
+        if self._process.wait() != 0:
+            raise OSError('{} exit with {}'.format(self.cmd[0],
+                                                   self._process.returncode))
+
+
+def open_compressor(fileobj, fmt, level=None, workers=None):
+    """Return a writable file object which compresses data to fileobj
+
+    Raise ValueError if the format is unknown or not available.
+    """
+    workers = workers or os.cpu_count() or 1
+    if fmt == FORMAT_TAR_GZ:
+        return ParallelGzipWriter(fileobj, level=level, workers=workers)
+    if fmt == FORMAT_TAR_XZ:
+        return lzma.LZMAFile(fileobj, 'w',
+                             preset=DEFAULT_LEVEL if level is None else level)
+    if fmt != FORMAT_TAR_ZST:
+        raise ValueError('unknown format {}'.format(fmt))
+    level = DEFAULT_ZSTD_LEVEL if level is None else level
+    try:
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=level, threads=workers)
+        return compressor.stream_writer(fileobj, closefd=False)
+    except ImportError:
+        LOG.debug('zstandard is not installed, try zstd command')
+    if not shutil.which('zstd'):
+        raise ValueError('zstandard or zstd command is required for '
+                         '{}'.format(fmt))
+    return ProcessWriter(['zstd', '-q', '-c', '-{}'.format(level),
+                          '-T{}'.format(workers)], fileobj)
+
+
+def write_tar(fileobj, members, fmt=FORMAT_TAR_GZ, level=None, workers=None,
+              verbose=False):
+    """Write members to fileobj as a compressed tar file"""
+    compressor = open_compressor(fileobj, fmt, level=level, workers=workers)
+    try:
+        with tarfile.open(fileobj=compressor, mode='w|',
+                          format=tarfile.PAX_FORMAT) as tar:
+            for path, arcname, _ in members:
+                if verbose:
+                    print(arcname, file=sys.stderr)
+                tar.add(path, arcname=arcname.rstrip('/'), recursive=False)
+    finally:
+        compressor.close()
+    fileobj.flush()
+
+
+def check_level(fmt, level):
+    """Raise ValueError if level is not valid for the format"""
+    if level is None:
+        return
+    low, high = LEVEL_RANGES[fmt]
+    if not low <= level <= high:
+        raise ValueError('the level of {} must be {}-{}, got {}'.format(
+            fmt, low, high, level))
+
+
+def guess_format(path):
+    """Return the format by the suffix of path, None if it is unknown"""
+    for fmt in FORMATS:
+        if path.endswith('.' + fmt):
+            return fmt
+    if path.endswith('.tgz'):
+        return FORMAT_TAR_GZ
+    return None
+
+
+def archive_dir(src, output=None, fmt=None, zip_root=True, zip_path=True,
+                level=None, workers=None, verbose=False, update=None):
+    """Archive the dir src
+
+    Param:
+        output: the path of archive, default is <src>.<fmt>, write to stdout
+                if it is -
+        fmt: zip, tar.gz, tar.xz or tar.zst, guess by output if it is None
+        update: the path of previous zip file to update, it is replaced if
+                output is None
+    Return:
+        the path of archive
+    """
+    if not os.path.isdir(src):
+        raise FileNotFoundError('{} is not a directory'.format(src))
+    fmt = fmt or (output and output != '-' and guess_format(output)) or \
+        FORMAT_ZIP
+    if fmt not in FORMATS:
+        raise ValueError('unknown format {}'.format(fmt))
+    check_level(fmt, level)
+    if update and fmt != FORMAT_ZIP:
+        raise ValueError('only zip file can be updated')
+    if update and not os.path.isfile(update):
+        raise FileNotFoundError('{} is not a file'.format(update))
+    output = output or update
+    output = output or '{}.{}'.format(os.path.abspath(src).rstrip(os.sep), fmt)
+    # NOTE: tar has entries of all dirs, zip only has empty dirs like
+    # zip_files
+    members = list(iter_members(src, zip_root=zip_root, zip_path=zip_path,
+                                all_dirs=fmt != FORMAT_ZIP))
+    LOG.debug('archive %s members to %s, format is %s, workers is %s',
+              len(members), output, fmt, workers)
+
+    def _write(fileobj):
+        if fmt == FORMAT_ZIP:
+            write_zip(fileobj, members, level=level, workers=workers,
+                      verbose=verbose, previous=update)
+        else:
+            write_tar(fileobj, members, fmt=fmt, level=level,
+                      workers=workers, verbose=verbose)
+
+    if output == '-':
+        _write(sys.stdout.buffer)
+        return output
+    tmp_output = output + '.tmp'
+    try:
+        with open(tmp_output, 'wb') as f:
+            _write(f)
+        os.replace(tmp_output, output)
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+    return output
+
+
+def zip_dir(src, output=None, zip_root=True, zip_path=True, level=None,
+            workers=None, verbose=False):
+    """Compress the dir src to a zip file
+
+    Param:
+        output: the path of zip file, default is <src>.zip
+    Return:
+        the path of zip file
+    """
+    return archive_dir(src, output=output, fmt=FORMAT_ZIP, zip_root=zip_root,
+                       zip_path=zip_path, level=level, workers=workers,
+                       verbose=verbose)
+
+
+def select_members(infos, includes=None, excludes=None):
+    """Filter ZipInfo list by glob patterns of names"""
+    selected = []
+    for info in infos:
+        name = info.filename
+        if includes and not any(fnmatch.fnmatch(name, pattern)
+                                for pattern in includes):
+            continue
+        if excludes and any(fnmatch.fnmatch(name, pattern)
+                            for pattern in excludes):
+            continue
+        selected.append(info)
+    return selected
+
+
+def get_target(dest, name):
+    """Return the extract path of member name under dest
+
+    Raise ValueError if the name is outside of dest, e.g. ../a or /a
+    """
+    parts = [part for part in name.replace('\\', '/').split('/')
+             if part not in ('', '.')]
+    if not parts or '..' in parts or name.startswith('/') or \
+       ':' in parts[0]:
+        raise ValueError('unsafe member name {}'.format(name))
+    return os.path.join(dest, *parts)
+
+
+def _read_raw(fd, info):
+    """Yield the compressed data of member from fd by pread"""
+    header = os.pread(fd, STRUCT_LOCAL_HEADER.size, info.header_offset)
+    header = STRUCT_LOCAL_HEADER.unpack(header)
+    if header[0] != SIGNATURE_LOCAL_HEADER:
+        raise zipfile.BadZipFile('bad local header of {}'.format(
+            info.filename))
+    offset = info.header_offset + STRUCT_LOCAL_HEADER.size + \
+        header[-2] + header[-1]
+    remain = info.compress_size
+    while remain > 0:
+        data = os.pread(fd, min(remain, DEFAULT_BLOCK_SIZE), offset)
+        if not data:
+            raise zipfile.BadZipFile('{} is truncated'.format(info.filename))
+        offset += len(data)
+        remain -= len(data)
+        yield data
+
+
+def _iter_decompressed(fd, zip_file, info):
+    if info.compress_type == ZIP_STORED:
+        for data in _read_raw(fd, info):
+            yield data
+        return
+    if info.compress_type != ZIP_DEFLATED:
+        # NOTE: zipfile reads the shared file object with a lock
+        with zip_file.open(info) as f:
+            for data in iter(lambda: f.read(DEFAULT_BLOCK_SIZE), b''):
+                yield data
+        return
+    decompressor = zlib.decompressobj(-15)
+    for data in _read_raw(fd, info):
+        # limit the size of output, data may be highly compressed
+        yield decompressor.decompress(data, DEFAULT_BLOCK_SIZE)
+        while decompressor.unconsumed_tail:
+            yield decompressor.decompress(decompressor.unconsumed_tail,
+                                          DEFAULT_BLOCK_SIZE)
+    yield decompressor.flush()
+
+
+def extract_member(fd, zip_file, info, target):
+    """Extract member to target, the output file is preallocated
+
+    Raise zipfile.BadZipFile if the crc32 or size is not matched.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    crc, size = 0, 0
+    with open(target, 'wb') as f:
+        if info.file_size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, info.file_size)
+            except OSError as e:
+                LOG.debug('fallocate %s failed: %s', target, e)
+        for data in _iter_decompressed(fd, zip_file, info):
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            f.write(data)
+        f.truncate(size)
+    if crc != info.CRC or size != info.file_size:
+        raise zipfile.BadZipFile('bad crc32 or size of {}'.format(
+            info.filename))
+    _set_attributes(target, info)
+
+
+def _set_attributes(target, info):
+    if info.create_system == 3 and info.external_attr >> 16:
+        # NOTE: never create setuid, setgid or sticky files from untrusted
+        # archives, like unzip
+        os.chmod(target, (info.external_attr >> 16) & 0o777)
+    mtime = get_zip_mtime(info)
+    os.utime(target, (mtime, mtime))
+
+
+def list_zip(path, includes=None, excludes=None):
+    """Return the list of ZipInfo, only the central directory is read"""
+    with zipfile.ZipFile(path) as zip_file:
+        return select_members(zip_file.infolist(), includes=includes,
+                              excludes=excludes)
+
+
+def extract_zip(path, dest='.', includes=None, excludes=None, workers=None,
+                verbose=False):
+    """Extract members of zip file with threads
+
+    The central directory is read only once, members are read by pread, so
+    threads share the same file descriptor.
+    Return:
+        list of (member name, error message) of failed members
+    """
+    workers = workers or os.cpu_count() or 1
+    errors = []
+    with zipfile.ZipFile(path) as zip_file:
+        infos = select_members(zip_file.infolist(), includes=includes,
+                               excludes=excludes)
+        LOG.debug('extract %s of %s members', len(infos),
+                  len(zip_file.infolist()))
+        files, dirs = [], []
+        for info in infos:
+            try:
+                target = get_target(dest, info.filename)
+            except ValueError as e:
+                errors.append((info.filename, str(e)))
+                continue
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                dirs.append((target, info))
+            else:
+                files.append((target, info))
+        fd = os.open(path, os.O_RDONLY)
+
+        def _extract(item):
+            target, info = item
+            if verbose:
+                print(info.filename, file=sys.stderr)
+            try:
+                extract_member(fd, zip_file, info, target)
+            except (OSError, zipfile.BadZipFile, zlib.error,
+                    NotImplementedError) as e:
+                return info.filename, str(e)
+
+        try:
+            with futures.ThreadPoolExecutor(workers) as executor:
+                # NOTE: the biggest members first, to balance the workers
+                files.sort(key=lambda item: item[1].file_size, reverse=True)
+                errors.extend(error for error in executor.map(_extract, files)
+                              if error)
+        finally:
+            os.close(fd)
+    # set the mtime of dirs after their files are created
+    for target, info in dirs:
+        _set_attributes(target, info)
+    return errors
@@ -0,0 +1,353 @@
+"""Checksum helpers for the md5sum command
+
+Every buffer read from a file feeds all of the requested digests, so a file
+is read only once whatever the number of algorithms. Many files are hashed
+in parallel with a process pool, large files are memory mapped and hashed
+without copying.
+
+In tree mode a file is split into chunks, the digests of chunks are hashed
+again to the digest of file. Chunks of one file can be hashed in parallel
+and the digests of chunks can be saved to a checkpoint, so hashing can be
+resumed after it is interrupted.
+"""
+import glob
+import hashlib
+import io
+import json
+import mmap
+import os
+import time
+from concurrent import futures
+
+from anycode.common import log
+from anyutils import utils
+
+LOG = log.getLogger(__name__)
+
+ALGORITHMS = ['md5', 'sha1', 'sha256', 'blake2b']
+# The tag used by BSD style lines, e.g. MD5 (file) = <digest>
+ALGORITHM_TAGS = {
+    'md5': 'MD5',
+    'sha1': 'SHA1',
+    'sha256': 'SHA256',
+    'blake2b': 'BLAKE2b',
+}
+MIN_BUFFER_SIZE = 64 * 1024
+MAX_BUFFER_SIZE = 16 * 1024 * 1024
+# files larger than this are memory mapped
+MMAP_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+# seconds between two saves of checkpoint
+CHECKPOINT_INTERVAL = 10
+
+
+def parse_algorithms(value):
+    """Parse string like md5,sha256 to a list of algorithms"""
+    algorithms = []
+    for name in value.split(','):
+        name = name.strip().lower()
+        if name == 'blake2':
+            name = 'blake2b'
+        if name not in ALGORITHMS:
+            raise ValueError(name)
+        if name not in algorithms:
+            algorithms.append(name)
+    return algorithms
+
+
+def has_magic(pattern):
+    return any(c in pattern for c in '*?[')
+
+
+def find_files(patterns):
+    """Expand files, globs and directories to a sorted list of files
+
+    Return:
+        files, missing: the files found and the patterns matched nothing
+    """
+    files, missing = set(), []
+    for pattern in patterns:
+        # NOTE: names like a[1].txt are files rather than globs if exist
+        paths = sorted(glob.glob(pattern)) if has_magic(pattern) and \
+            not os.path.exists(pattern) else [pattern]
+        if not paths or not all(os.path.exists(p) for p in paths):
+            missing.append(pattern)
+            continue
+        for path in paths:
+            if not os.path.isdir(path):
+                files.add(path)
+                continue
+            for root, _, names in os.walk(path):
+                for name in names:
+                    file_path = os.path.join(root, name)
+                    if os.path.isfile(file_path):
+                        files.add(file_path)
+    return sorted(files), missing
+
+
+def choose_buffer_size(size, blksize=None):
+    """Choose the buffer size by file size and block size of the device
+
+    About 64 reads per file, between MIN_BUFFER_SIZE and MAX_BUFFER_SIZE,
+    and rounded up to a multiple of blksize.
+    """
+    blksize = blksize or io.DEFAULT_BUFFER_SIZE
+    buffer_size = min(max(size // 64, MIN_BUFFER_SIZE), MAX_BUFFER_SIZE)
+    return (buffer_size + blksize - 1) // blksize * blksize
+
+
+def _hash_buffered(f, hashers, buffer_size, callback=None):
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        size = f.readinto(buffer)
+        if not size:
+            break
+        chunk = view[:size]
+        for hasher in hashers:
+            hasher.update(chunk)
+        if callback:
+            callback(size)
+
+
+def _hash_mmap(f, size, hashers, buffer_size, callback=None):
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, 'madvise'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        # NOTE: slices of memoryview are passed to hashlib without copy
+        view = memoryview(mapped)
+        try:
+            for offset in range(0, size, buffer_size):
+                chunk = view[offset:offset + buffer_size]
+                for hasher in hashers:
+                    hasher.update(chunk)
+                chunk.release()
+                if callback:
+                    callback(min(buffer_size, size - offset))
+        finally:
+            view.release()
+
+
+def hash_file(path, algorithms=None, buffer_size=None, use_mmap=None,
+              callback=None):
+    """Calculate digests of one file with a single read pass
+
+    Param:
+        buffer_size: chosen by file size and st_blksize if not set
+        use_mmap: if None, map files larger than MMAP_THRESHOLD
+        callback: called with the num of bytes hashed after each read
+    Return:
+        dict, e.g. {'md5': '...', 'sha1': '...'}
+    """
+    algorithms = algorithms or ['md5']
+    hashers = [hashlib.new(name) for name in algorithms]
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        buffer_size = buffer_size or choose_buffer_size(
+            size, getattr(stat, 'st_blksize', None))
+        if use_mmap is None:
+            use_mmap = size >= MMAP_THRESHOLD
+        # NOTE: files like /proc/* report size 0 and can not be mapped
+        if use_mmap and size > 0:
+            _hash_mmap(f, size, hashers, buffer_size, callback=callback)
+        else:
+            _hash_buffered(f, hashers, buffer_size, callback=callback)
+    return {name: hasher.hexdigest()
+            for name, hasher in zip(algorithms, hashers)}
+
+
+def _hash_file_safe(path, algorithms, buffer_size, use_mmap):
+    try:
+        return path, hash_file(path, algorithms=algorithms,
+                               buffer_size=buffer_size,
+                               use_mmap=use_mmap), None
+    except (IOError, OSError, ValueError) as e:
+        return path, None, str(e)
+
+
+def hash_files(paths, algorithms=None, workers=None, buffer_size=None,
+               use_mmap=None):
+    """Calculate digests of files in parallel
+
+    Results are yielded in the order of paths as (path, digests, error).
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(paths))
+    LOG.debug('hash %s files, workers is %s', len(paths), workers)
+    if workers <= 1:
+        for path in paths:
+            yield _hash_file_safe(path, algorithms, buffer_size, use_mmap)
+        return
+    chunksize = max(1, min(64, len(paths) // (workers * 4)))
+    with futures.ProcessPoolExecutor(workers) as executor:
+        for result in executor.map(_hash_file_safe, paths,
+                                   [algorithms] * len(paths),
+                                   [buffer_size] * len(paths),
+                                   [use_mmap] * len(paths),
+                                   chunksize=chunksize):
+            yield result
+
+
+def benchmark_file(path, algorithms=None, buffer_size=None):
+    """Compare the speed of buffered and mmap read of one file
+
+    The file is read once before timing, so both paths read from page
+    cache.
+    Return:
+        dict, e.g. {'size': 1024, 'buffered': <MB/s>, 'mmap': <MB/s>}
+    """
+    size = os.path.getsize(path)
+    hash_file(path, algorithms=['md5'], use_mmap=False)
+    result = {'size': size}
+    for name, use_mmap in [('buffered', False), ('mmap', True)]:
+        start_time = time.time()
+        hash_file(path, algorithms=algorithms, buffer_size=buffer_size,
+                  use_mmap=use_mmap)
+        spend = max(time.time() - start_time, 1e-9)
+        result[name] = size / 1024.0 / 1024.0 / spend
+    return result
+
+
+def hash_chunk(path, offset, length, algorithms=None, buffer_size=None):
+    """Calculate digests of the range [offset, offset + length) of file"""
+    algorithms = algorithms or ['md5']
+    hashers = [hashlib.new(name) for name in algorithms]
+    buffer_size = buffer_size or choose_buffer_size(length)
+    buffer = bytearray(min(buffer_size, max(length, 1)))
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            size = f.readinto(view[:min(length, len(buffer))])
+            if not size:
+                break
+            for hasher in hashers:
+                hasher.update(view[:size])
+            length -= size
+    return {name: hasher.hexdigest()
+            for name, hasher in zip(algorithms, hashers)}
+
+
+class Checkpoint(object):
+    """The digests of chunks which have been hashed
+
+    The checkpoint is saved in the cache dir and keyed by the path, inode,
+    size and mtime of file, so it will not be used if the file is changed.
+    """
+
+    def __init__(self, path, stat, algorithms, chunk_size):
+        key = ':'.join([os.path.abspath(path), str(stat.st_dev),
+                        str(stat.st_ino), str(stat.st_size),
+                        str(stat.st_mtime_ns), str(chunk_size),
+                        ','.join(algorithms)])
+        self.path = os.path.join(
+            utils.get_cache_dir('checkpoints'),
+            hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+        self.chunks = {}
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.chunks = {int(index): digests
+                               for index, digests in json.load(f).items()}
+        return self.chunks
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.chunks, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def hash_file_tree(path, algorithms=None, chunk_size=None, workers=None,
+                   buffer_size=None, checkpoint=False, callback=None):
+    """Calculate tree digests of file
+
+    The digest of file is the digest of the concatenated raw digests of
+    chunks, so it depends on chunk_size.
+    Param:
+        checkpoint: save the digests of chunks periodically and resume from
+                    the saved checkpoint
+        callback: called with the num of bytes hashed after each chunk
+    Return:
+        dict, e.g. {'md5': '...', 'sha1': '...'}
+    """
+    algorithms = algorithms or ['md5']
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    stat = os.stat(path)
+    num = max(1, (stat.st_size + chunk_size - 1) // chunk_size)
+    # NOTE: the cache dir is not used without checkpoint
+    state = None
+    if checkpoint:
+        try:
+            state = Checkpoint(path, stat, algorithms, chunk_size)
+        except OSError as e:
+            LOG.warning('cache dir is not usable, checkpoint disabled: %s',
+                        e)
+    chunks = state.load() if state else {}
+    if chunks:
+        LOG.info('resume %s from checkpoint, %s of %s chunks are hashed',
+                 path, len(chunks), num)
+    pending = [index for index in range(num) if index not in chunks]
+    workers = min(workers or os.cpu_count() or 1, max(len(pending), 1))
+    executor = futures.ProcessPoolExecutor(workers)
+    last_saved = time.time()
+    try:
+        tasks = {executor.submit(hash_chunk, path, index * chunk_size,
+                                 chunk_size, algorithms,
+                                 buffer_size): index
+                 for index in pending}
+        for task in futures.as_completed(tasks):
+            index = tasks[task]
+            chunks[index] = task.result()
+            if callback:
+                callback(min(chunk_size, stat.st_size - index * chunk_size))
+            if state and time.time() - last_saved > CHECKPOINT_INTERVAL:
+                state.save()
+                last_saved = time.time()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if state and len(chunks) < num:
+            LOG.info('save checkpoint of %s, %s of %s chunks are hashed',
+                     path, len(chunks), num)
+            state.save()
+    if state:
+        state.remove()
+    digests = {}
+    for name in algorithms:
+        hasher = hashlib.new(name)
+        for index in range(num):
+            hasher.update(bytes.fromhex(chunks[index][name]))
+        digests[name] = hasher.hexdigest()
+    return digests
+
+
+def _escape_path(path):
+    """Escape path the same way as GNU coreutils
+
+    Return:
+        prefix, path: prefix is '\\' if path is escaped, otherwise ''
+    """
+    if '\\' not in path and '\n' not in path:
+        return '', path
+    return '\\', path.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def format_line(path, algorithm, digest, tag=False, tree=False):
+    """Format a line which can be checked by md5sum -c, sha1sum -c ...
+
+    If tag is True, format as BSD style, e.g. MD5 (file) = <digest>
+    If tree is True, format as BSD style with tag like MD5-TREE, the line
+    can not be checked by md5sum -c.
+    """
+    prefix, path = _escape_path(path)
+    if tag or tree:
+        return '{}{}{} ({}) = {}'.format(prefix, ALGORITHM_TAGS[algorithm],
+                                         tree and '-TREE' or '', path,
+                                         digest)
+    return '{}{}  {}'.format(prefix, digest, path)
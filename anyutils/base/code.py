@@ -3,13 +3,13 @@ import argparse
 import json
 import os
 import sys
-import io
 
 from anycode.common import cliparser
 from anycode.common import log
 from anycode.common import jsonobj
 from anycode import code as code_function
 from anycode.common import progressbar
+from anyutils import utils
 
 LOG = log.getLogger(__name__)
 
@@ -19,73 +19,382 @@ def print_error(message):
     return 1
 
 
-class Md5Sum(cliparser.CliBase):
-    NAME = 'md5sum'
-    ARGUMENTS = [
-        cliparser.Argument('file', help='The path of file'),
+def _md5sum_arguments():
+    from anyutils.base import checksum
+    from anyutils.base import hashcache
+    return [
+        cliparser.Argument('files', nargs='+', metavar='file',
+                           help='The path of file, glob or directory. '
+                                'Print lines which can be checked by '
+                                '"md5sum -c" if more than one file'),
         cliparser.Argument('-s', '--sha1', action='store_true',
                            help='Calculte sha1 too'),
+        cliparser.Argument('-a', '--algorithms',
+                           help='Comma separated algorithms to calculate '
+                                'with one read, choices: {}'.format(
+                                    ','.join(checksum.ALGORITHMS))),
+        cliparser.Argument('-w', '--workers', type=int,
+                           help='Hash workers, default is the num of cpu'),
         cliparser.Argument('--silence', action='store_true',
                            help='DO not show progress'),
         cliparser.Argument('-b', '--buffer', type=int,
-                           help='Buffer size, default is {}'.format(
-                               io.DEFAULT_BUFFER_SIZE)),
+                           help='Buffer size, default is chosen by file size '
+                                'and block size, at least {}'.format(
+                                    checksum.MIN_BUFFER_SIZE)),
+        cliparser.Argument('--no-mmap', action='store_true',
+                           help='Do not map files larger than {}MB to '
+                                'memory'.format(
+                                    checksum.MMAP_THRESHOLD // 1024 // 1024)),
+        cliparser.Argument('--bench', action='store_true',
+                           help='Show the speed(MB/s) of buffered and mmap '
+                                'read'),
+        cliparser.Argument('--no-cache', action='store_true',
+                           help='Do not use the cache of digests, files '
+                                'are cached by inode, size and mtime'),
+        cliparser.Argument('--cache-size', type=int,
+                           help='The max entries of cache, default is '
+                                '{}'.format(hashcache.DEFAULT_MAX_ENTRIES)),
+        cliparser.Argument('--verify-cache', type=float, default=0,
+                           metavar='FRACTION',
+                           help='Hash a random fraction of cached files '
+                                'again to find corrupted files, e.g. 0.01'),
+        cliparser.Argument('--tree', action='store_true',
+                           help='Calculate tree digests, a file is split to '
+                                'chunks which are hashed in parallel, and '
+                                'the digests of chunks are hashed again. '
+                                'The digest depends on --chunk-size'),
+        cliparser.Argument('--chunk-size', type=int,
+                           help='The chunk size of tree digests, default is '
+                                '{}'.format(checksum.DEFAULT_CHUNK_SIZE)),
+        cliparser.Argument('--checkpoint', action='store_true',
+                           help='Save the hashed chunks periodically and '
+                                'resume from them if interrupted, '
+                                'implies --tree'),
     ]
 
+
+class Md5Sum(cliparser.CliBase):
+    NAME = 'md5sum'
+    ARGUMENTS = utils.LazyArguments(_md5sum_arguments)
+
     def __call__(self, args):
+        import sqlite3
+        from anyutils.base import checksum
+        from anyutils.base import hashcache
+        if args.bench:
+            return self.bench(args)
+        if args.algorithms:
+            try:
+                algorithms = checksum.parse_algorithms(args.algorithms)
+            except ValueError as e:
+                return print_error('Invalid algorithm {}'.format(e))
+        else:
+            algorithms = args.sha1 and ['md5', 'sha1'] or ['md5']
+        if args.tree or args.checkpoint:
+            return self.md5sum_tree(args, algorithms)
+        # the cached digests of files which are sampled to verify
+        self._verifying = {}
+        cache = None
+        if not args.no_cache:
+            try:
+                cache = hashcache.HashCache(max_entries=args.cache_size)
+            except (sqlite3.Error, OSError) as e:
+                LOG.warning('open cache failed, cache disabled: %s', e)
+        try:
+            single = args.files[0]
+            if len(args.files) == 1 and not args.algorithms and \
+               not os.path.isdir(single) and \
+               (os.path.exists(single) or not checksum.has_magic(single)):
+                return self.md5sum_file(args, single, algorithms,
+                                        cache=cache)
+            return self.md5sum_files(args, algorithms, cache=cache)
+        finally:
+            if cache:
+                cache.close()
+
+    def _get_cached(self, args, path, algorithms, cache):
+        """Get digests from cache
+
+        Return:
+            stat, digests: digests is None if not cached or if the file is
+            sampled to verify
+        """
+        import random
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None, None
+        if not cache:
+            return stat, None
+        digests = cache.get(stat, algorithms)
+        if digests and random.random() < args.verify_cache:
+            LOG.debug('verify cached digests of %s', path)
+            self._verifying[path] = digests
+            return stat, None
+        return stat, digests
+
+    def _update_cache(self, path, stat, digests, cache):
+        """Save digests to cache
+
+        Return:
+            False if the cached digests of a sampled file mismatch
+        """
+        if not cache or not stat:
+            return True
+        cached = self._verifying.pop(path, None)
+        cache.put(stat, digests)
+        if cached and cached != digests:
+            LOG.error('Cached digests of %s mismatch, the file is changed '
+                      'or corrupted: %s != %s', path, cached, digests)
+            return False
+        return True
+
+    def md5sum_files(self, args, algorithms, cache=None):
+        from anyutils.base import checksum
+        files, missing = checksum.find_files(args.files)
+        failed = len(missing)
+        for pattern in missing:
+            LOG.error('File %s not exists', pattern)
+        stats, cached = {}, {}
+        for path in files:
+            stats[path], digests = self._get_cached(args, path, algorithms,
+                                                    cache)
+            if digests:
+                cached[path] = digests
+        LOG.debug('%s of %s files are cached', len(cached), len(files))
+        results = checksum.hash_files(
+            [path for path in files if path not in cached],
+            algorithms=algorithms, workers=args.workers,
+            buffer_size=args.buffer,
+            use_mmap=False if args.no_mmap else None)
+        for path in files:
+            if path in cached:
+                digests, error = cached[path], None
+            else:
+                # NOTE: results are in the same order of files
+                _, digests, error = next(results)
+            if error:
+                LOG.error('Hash %s failed: %s', path, error)
+                failed += 1
+                continue
+            if path not in cached and \
+               not self._update_cache(path, stats[path], digests, cache):
+                failed += 1
+            for algorithm in algorithms:
+                print(checksum.format_line(path, algorithm,
+                                           digests[algorithm],
+                                           tag=len(algorithms) > 1))
+        return 1 if failed else 0
+
+    def md5sum_file(self, args, file_path, algorithms, cache=None):
+        from anyutils.base import checksum
         progress = not args.silence
         if progress and not progressbar.is_support_tqdm:
             LOG.warn('module tpdm is not installed, set progress False')
             progress = False
-        if not os.path.exists(args.file):
-            print_error('File {} not exists'.format(args.file))
+        if not os.path.exists(file_path):
+            print_error('File {} not exists'.format(file_path))
             return 1
-        _md5sum, _sha1 = code_function.md5sum_file(args.file,
-                                                   sha1=args.sha1,
-                                                   read_bytes=args.buffer,
-                                                   progress=progress)
-        print('md5sum', _md5sum)
+        stat, digests = self._get_cached(args, file_path, algorithms, cache)
+        if not digests:
+            pbar = None
+            if progress:
+                from tqdm import tqdm
+                pbar = tqdm(total=os.path.getsize(file_path), unit='B',
+                            unit_scale=True)
+            digests = checksum.hash_file(
+                file_path, algorithms=algorithms, buffer_size=args.buffer,
+                use_mmap=False if args.no_mmap else None,
+                callback=pbar.update if pbar is not None else None)
+            if pbar is not None:
+                pbar.close()
+            if not self._update_cache(file_path, stat, digests, cache):
+                return 1
+        print('md5sum', digests['md5'])
         if args.sha1:
-            print('sha1  ', _sha1)
+            print('sha1  ', digests['sha1'])
 
+    def md5sum_tree(self, args, algorithms):
+        from anyutils.base import checksum
+        files, missing = checksum.find_files(args.files)
+        failed = len(missing)
+        for pattern in missing:
+            LOG.error('File %s not exists', pattern)
+        for path in files:
+            try:
+                digests = checksum.hash_file_tree(
+                    path, algorithms=algorithms, chunk_size=args.chunk_size,
+                    workers=args.workers, buffer_size=args.buffer,
+                    checkpoint=args.checkpoint)
+            except (IOError, OSError) as e:
+                LOG.error('Hash %s failed: %s', path, e)
+                failed += 1
+                continue
+            for algorithm in algorithms:
+                print(checksum.format_line(path, algorithm,
+                                           digests[algorithm], tree=True))
+        return 1 if failed else 0
 
-class JsonGet(cliparser.CliBase):
-    NAME = 'json-get'
-    ARGUMENTS = [
+    def bench(self, args):
+        from anyutils.base import checksum
+        try:
+            algorithms = checksum.parse_algorithms(args.algorithms or 'md5')
+        except ValueError as e:
+            return print_error('Invalid algorithm {}'.format(e))
+        files, missing = checksum.find_files(args.files)
+        for pattern in missing:
+            LOG.error('File %s not exists', pattern)
+        print('{:>12} {:>16} {:>12}  {}'.format(
+            'size(MB)', 'buffered(MB/s)', 'mmap(MB/s)', 'file'))
+        for path in files:
+            result = checksum.benchmark_file(path, algorithms=algorithms,
+                                             buffer_size=args.buffer)
+            print('{:>12.2f} {:>16.2f} {:>12.2f}  {}'.format(
+                result['size'] / 1024.0 / 1024.0, result['buffered'],
+                result['mmap'], path))
+
+
+def _json_get_arguments():
+    from anyutils.base import jsonbackend
+    from anyutils.base import jsonpath
+    return [
         cliparser.Argument('infile', nargs='?', type=argparse.FileType(),
                            help='A JSON file to be validated'),
-        cliparser.Argument('-k', '--keys',
-                           help='A string of keys, e.g. key1.key2.1'),
+        cliparser.Argument('-k', '--keys', action='append',
+                           help='A string of keys, e.g. key1.key2.1. '
+                                'Can be specified multiple times'),
         cliparser.Argument('-l', '--lines', action='store_true',
                            help='print as lines'),
         cliparser.Argument('-p', '--pretty', action='store_true',
                            help='Print pretty json'),
+        cliparser.Argument('-s', '--stream', action='store_true',
+                           help='Read the file incrementally and stop when '
+                                'the keys are found, only the found value '
+                                'is kept in memory'),
+        cliparser.Argument('-n', '--ndjson', action='store_true',
+                           help='The input is JSON lines, print the values '
+                                'of keys of each line'),
+        cliparser.Argument('-f', '--format', choices=jsonpath.FORMATS,
+                           default=jsonpath.FORMAT_TSV,
+                           help='The output format of --ndjson, default is '
+                                '{}'.format(jsonpath.FORMAT_TSV)),
+        cliparser.Argument('-w', '--workers', type=int,
+                           help='The workers to parse JSON lines, default '
+                                'is the num of cpu'),
+        cliparser.Argument('--batch', type=int,
+                           default=jsonpath.DEFAULT_BATCH_LINES,
+                           help='The num of JSON lines parsed by a worker '
+                                'each time, default is {}'.format(
+                                    jsonpath.DEFAULT_BATCH_LINES)),
+        cliparser.Argument('--backend', choices=jsonbackend.BACKEND_NAMES,
+                           default=jsonbackend.BACKEND_AUTO,
+                           help='The backend to parse JSON, default is '
+                                '{}, the fastest installed one of '
+                                '{}'.format(jsonbackend.BACKEND_AUTO,
+                                            jsonbackend.BACKEND_NAMES[1:])),
     ]
 
+
+class JsonGet(cliparser.CliBase):
+    NAME = 'json-get'
+    ARGUMENTS = utils.LazyArguments(_json_get_arguments)
+
     def __call__(self, args):
+        from anyutils.base import jsonbackend
+        from anyutils.base import jsonpath
         infile = args.infile or sys.stdin
-        json_obj = None
+        LOG.debug('keys is %s, pretty is %s', args.keys, args.pretty)
+        try:
+            backend = jsonbackend.get_backend(args.backend)
+        except ImportError:
+            return print_error('{} is not installed'.format(args.backend))
+        if args.ndjson:
+            with infile:
+                return self.extract_lines(args, infile)
+        if args.stream and args.keys and len(args.keys) > 1:
+            return print_error('Only one key is supported with --stream')
+        results = []
         with infile:
             try:
-                json_obj = jsonobj.read(infile)
+                if args.stream:
+                    results.append(jsonpath.stream_get(
+                        infile, args.keys and args.keys[0]))
+                elif backend.NAME == jsonbackend.BACKEND_JSON:
+                    json_obj = jsonobj.read(infile)
+                    for keys in args.keys or [None]:
+                        results.append(json_obj.get(keys) if keys else
+                                       json_obj._value)
+                else:
+                    value = backend.loads(infile.read())
+                    for keys in args.keys or [None]:
+                        results.append(jsonpath.get_value(
+                            value, jsonpath.split_keys(keys)))
             except json.decoder.JSONDecodeError as e:
                 print_error(e)
                 return 0
-        LOG.debug('keys is %s, pretty is %s', args.keys, args.pretty)
-        result = None
-        try:
-            result = json_obj.get(args.keys) if args.keys else json_obj._value
-        except KeyError as e:
-            return print_error("Invalid key {}".format(e))
-        except ValueError as e:
-            return print_error("Invalid index {}".format(e))
-        if args.lines and isinstance(result, dict):
-            # print as lines
-            for key in result:
-                print('{} = {}'.format(key, result.get(key)))
-        else:
-            # print as json
-            print(json.dumps(result, indent=args.pretty and '    ' or None))
+            except KeyError as e:
+                return print_error("Invalid key {}".format(e))
+            except ValueError as e:
+                return print_error("Invalid index {}".format(e))
+        for result in results:
+            if args.lines and isinstance(result, dict):
+                # print as lines
+                for key in result:
+                    print('{} = {}'.format(key, result.get(key)))
+            else:
+                # print as json
+                print(json.dumps(result,
+                                 indent=args.pretty and '    ' or None))
+
+    def extract_lines(self, args, infile):
+        from anyutils.base import jsonpath
+        if not args.keys:
+            return print_error('Keys are required with --ndjson')
+        errors = 0
+        for text, line_errors in jsonpath.extract_lines(
+                infile, args.keys, output_format=args.format,
+                workers=args.workers, batch=args.batch,
+                backend=args.backend):
+            sys.stdout.write(text)
+            for lineno, error in line_errors:
+                LOG.warning('Invalid JSON at line %s: %s', lineno, error)
+            errors += len(line_errors)
+        return 1 if errors else 0
+
+
+class JsonBench(cliparser.CliBase):
+    NAME = 'json-bench'
+    ARGUMENTS = [
+        cliparser.Argument('files', nargs='*', metavar='file',
+                           help='JSON lines files used as corpus to compare '
+                                'the parse speed of backends, generated '
+                                'documents are used if not set. Output is '
+                                'always dumped by the stdlib json'),
+        cliparser.Argument('-r', '--repeat', type=int, default=3,
+                           help='Repeat times, the best is used, default '
+                                'is 3'),
+    ]
+
+    def __call__(self, args):
+        from anyutils.base import jsonbackend
+        docs = []
+        for file_path in args.files:
+            with open(file_path) as f:
+                for lineno, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        json.loads(line)
+                    except ValueError as e:
+                        LOG.warning('skip invalid JSON at %s:%s: %s',
+                                    file_path, lineno, e)
+                        continue
+                    docs.append(line)
+        docs = docs or jsonbackend.make_corpus()
+        print('{:<10} {:>14}'.format('backend', 'parse(MB/s)'))
+        for result in jsonbackend.benchmark(docs, repeat=args.repeat):
+            print('{:<10} {:>14.2f}'.format(result['backend'],
+                                            result['loads']))
 
 
 class GeneratePassword(cliparser.CliBase):
@@ -101,11 +410,55 @@ class GeneratePassword(cliparser.CliBase):
                            help='The num of number char'),
         cliparser.Argument('-s', '--special', type=int,
                            help='The num of special char'),
+        cliparser.Argument('-c', '--count', type=int, default=1,
+                           help='The num of passwords, default is 1'),
+        cliparser.Argument('-f', '--format', choices=['text', 'csv', 'json'],
+                           default='text',
+                           help='The output format, default is text'),
+        cliparser.Argument('-w', '--workers', type=int,
+                           help='Generate passwords with multiple processes'),
+        cliparser.Argument('--bench', action='store_true',
+                           help='Show passwords per second instead of '
+                                'passwords, default count is 100000'),
     ]
 
     def __call__(self, args):
-        password = code_function.random_password(lower=args.lower,
-                                                 upper=args.upper,
-                                                 number=args.number,
-                                                 special=args.special)
-        print(password)
+        if args.count < 1:
+            return print_error('the num of passwords must >= 1')
+        if args.count == 1 and args.format == 'text' and not args.bench:
+            password = code_function.random_password(lower=args.lower,
+                                                     upper=args.upper,
+                                                     number=args.number,
+                                                     special=args.special)
+            print(password)
+            return
+        import csv
+        from anyutils.base import passwords
+        kwargs = {'lower': args.lower, 'upper': args.upper,
+                  'number': args.number, 'special': args.special}
+        try:
+            passwords.PasswordGenerator(**kwargs)
+        except ValueError as e:
+            return print_error(e)
+        if args.bench:
+            count = args.count if args.count > 1 else 100000
+            speed = passwords.benchmark(count, workers=args.workers, **kwargs)
+            print('{:.2f} passwords/s'.format(speed))
+            return
+        batches = passwords.generate_passwords(args.count,
+                                               workers=args.workers,
+                                               **kwargs)
+        if args.format == 'csv':
+            writer = csv.writer(sys.stdout, lineterminator='\n')
+            writer.writerow(['password'])
+            for batch in batches:
+                writer.writerows([password] for password in batch)
+        elif args.format == 'json':
+            sys.stdout.write('[')
+            for i, batch in enumerate(batches):
+                sys.stdout.write((i and ', ' or '') +
+                                 ', '.join(json.dumps(p) for p in batch))
+            sys.stdout.write(']\n')
+        else:
+            for batch in batches:
+                sys.stdout.write('\n'.join(batch) + '\n')
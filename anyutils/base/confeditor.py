@@ -1,9 +1,15 @@
 from __future__ import print_function
 import argparse
+import configparser
+import io
+import os
+import sys
 
 from anycode.common import cliparser
 from anycode.common import log
 from anycode.common import confparser
+from anyutils.base import confindex
+from anyutils.base import inifile
 
 LOG = log.getLogger(__name__)
 
@@ -19,6 +25,15 @@ class ConfigList(cliparser.CliBase):
 
     def __call__(self, args):
         LOG.debug(args)
+        if args.section and is_indexable(args.file):
+            parser = read_sections(args.file.name, args.section)
+            if not parser:
+                LOG.error('No section: %s', args.section)
+                return 1
+            for opt, val in parser.options(args.section,
+                                           ignore_default=True).items():
+                print(opt, '=', val)
+            return
         parser = confparser.ConfigParserWrapper()
         parser.read(args.file)
         if args.section:
@@ -36,3 +51,131 @@ class ConfigList(cliparser.CliBase):
                                             ignore_default=True).items():
                     print(opt, '=', val)
                 print()
+
+
+def is_indexable(fp):
+    """Only the regular files can be indexed, not stdin or pipes"""
+    return fp.name != '<stdin>' and os.path.isfile(fp.name)
+
+
+def read_sections(path, section):
+    """Parse only DEFAULT and the section of file by the index
+
+    Return:
+        the parser, None if the section is not found
+    """
+    index = confindex.ConfigIndex(path)
+    if section != confindex.DEFAULT_SECTION and \
+       not index.has_section(section):
+        return None
+    parser = confparser.ConfigParserWrapper()
+    parser.read(io.StringIO(index.read_sections(confindex.DEFAULT_SECTION,
+                                                section)))
+    return parser
+
+
+class ConfigGet(cliparser.CliBase):
+    NAME = 'conf-get'
+    ARGUMENTS = [
+        cliparser.Argument('file', type=argparse.FileType(),
+                           help='The path of file'),
+        cliparser.Argument('section', help='Section name'),
+        cliparser.Argument('option', help='Option name'),
+    ]
+
+    def __call__(self, args):
+        LOG.debug(args)
+        if is_indexable(args.file):
+            index = confindex.ConfigIndex(args.file.name)
+            try:
+                value = index.get_raw(args.section, args.option)
+            except configparser.NoSectionError:
+                LOG.error('No section: %s', args.section)
+                return 1
+            except KeyError:
+                LOG.error('No option %s in section: %s', args.option,
+                          args.section)
+                return 1
+            # NOTE: the value may be interpolated by other options, and
+            # %% is unescaped by interpolation
+            if value is None or '%' not in value:
+                print(value)
+                return
+            parser = read_sections(args.file.name, args.section)
+        else:
+            parser = confparser.ConfigParserWrapper()
+            parser.read(args.file)
+        try:
+            options = parser.options(args.section)
+        except configparser.NoSectionError:
+            LOG.error('No section: %s', args.section)
+            return 1
+        if args.option.lower() not in options:
+            LOG.error('No option %s in section: %s', args.option,
+                      args.section)
+            return 1
+        print(options[args.option.lower()])
+
+
+class ConfigSet(cliparser.CliBase):
+    NAME = 'conf-set'
+    ARGUMENTS = [
+        cliparser.Argument('file', help='The path of file'),
+        cliparser.Argument('edits', nargs='*', metavar='section.option=value',
+                           help='The options to set, read from stdin if '
+                                'it is empty or -'),
+    ]
+
+    def __call__(self, args):
+        LOG.debug(args)
+        lines = [edit for edit in args.edits if edit != '-']
+        if not args.edits or '-' in args.edits:
+            lines.extend(sys.stdin)
+        try:
+            edits = inifile.parse_edits(lines)
+        except ValueError as e:
+            LOG.error(e)
+            return 1
+        if not edits:
+            LOG.warning('nothing to set')
+            return
+        try:
+            inifile.set_options(args.file, edits)
+        except (IOError, OSError) as e:
+            LOG.error(e)
+            return 1
+        LOG.debug('set %s options', sum(len(options)
+                                        for options in edits.values()))
+
+
+class ConfigDiff(cliparser.CliBase):
+    NAME = 'conf-diff'
+    ARGUMENTS = [
+        cliparser.Argument('file1', type=argparse.FileType(),
+                           help='The path of file'),
+        cliparser.Argument('file2', type=argparse.FileType(),
+                           help='The path of file to compare with'),
+    ]
+
+    def _read(self, fp):
+        parser = confparser.ConfigParserWrapper()
+        parser.read(fp)
+        sections = {confindex.DEFAULT_SECTION:
+                    parser.options(confindex.DEFAULT_SECTION)}
+        for section in parser.sections():
+            sections[section] = parser.options(section, ignore_default=True)
+        return sections
+
+    def __call__(self, args):
+        LOG.debug(args)
+        diffs = inifile.diff_sections(self._read(args.file1),
+                                      self._read(args.file2))
+        for section, changes in diffs:
+            print('[{}]'.format(section))
+            for option, value1, value2 in changes:
+                if value1 is not None:
+                    print('-', option, '=', value1)
+                if value2 is not None:
+                    print('+', option, '=', value2)
+            print()
+        return diffs and 1 or 0
@@ -0,0 +1,224 @@
+"""Byte offset index of INI files
+
+The index holds the byte ranges of sections and the offsets of options, it
+is built by reading the file once and cached next to the file (or in the
+cache dir if the dir of file is not writable), keyed by the mtime and size
+of file. A section is read by seeking to its ranges, and an option is read
+by seeking to its offset.
+"""
+import configparser
+import hashlib
+import json
+import os
+import re
+
+from anycode.common import log
+from anyutils import utils
+
+LOG = log.getLogger(__name__)
+
+INDEX_VERSION = 1
+DEFAULT_SECTION = 'DEFAULT'
+COMMENT_PREFIXES = ('#', ';')
+# the same as the patterns of configparser
+RE_SECTION = re.compile(r'\[(?P<header>.+)\]')
+RE_OPTION = re.compile(r'(?P<option>.*?)\s*(?P<vi>[=:])\s*(?P<value>.*)$')
+
+
+def decode_line(raw_line):
+    """Decode line of file, the index and reads must decode the same way"""
+    return raw_line.decode('utf-8', errors='replace')
+
+
+def is_comment(line):
+    """Return True if the line is a comment, it may be indented
+
+    Comment lines are skipped by configparser, they do not end values.
+    """
+    return line.strip().startswith(COMMENT_PREFIXES)
+
+
+def is_continuation(line):
+    """Return True if the line is a continuation of the previous value"""
+    return line[:1].isspace() and bool(line.strip()) and not is_comment(line)
+
+
+def parse_option(line):
+    """Return (option, value) of option line, None if it is not an option
+
+    The option name is lower case like configparser.
+    """
+    stripped = line.strip()
+    if not stripped or stripped.startswith(COMMENT_PREFIXES) or \
+       line[:1].isspace():
+        return None
+    matched = RE_OPTION.match(stripped)
+    if not matched:
+        return stripped.lower(), None
+    return matched.group('option').rstrip().lower(), matched.group('value')
+
+
+def parse_section(line):
+    """Return the section name of header line, None if it is not a header"""
+    if line[:1] != '[':
+        return None
+    matched = RE_SECTION.match(line.strip())
+    return matched.group('header') if matched else None
+
+
+def get_index_path(path):
+    dir_path, name = os.path.split(os.path.abspath(path))
+    return os.path.join(dir_path, '.{}.anyidx'.format(name))
+
+
+def get_cached_index_path(path):
+    """Return the index path in the cache dir, None if it is not usable"""
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    try:
+        cache_dir = utils.get_cache_dir('confindex')
+    except OSError as e:
+        LOG.debug('cache dir is not usable: %s', e)
+        return None
+    return os.path.join(cache_dir, '{}.json'.format(key))
+
+
+def build_index(path):
+    """Read the file once and return its index
+
+    Return:
+        dict like {section: {'ranges': [[start, end]],
+                             'options': {option: offset}}}
+    """
+    sections = {}
+    current, offset = None, 0
+    with open(path, 'rb') as f:
+        for raw_line in f:
+            line = decode_line(raw_line)
+            name = parse_section(line)
+            if name is not None:
+                if current:
+                    current['ranges'][-1][1] = offset
+                current = sections.setdefault(name, {'ranges': [],
+                                                     'options': {}})
+                current['ranges'].append([offset, None])
+            elif current is not None:
+                option = parse_option(line)
+                if option:
+                    current['options'][option[0]] = offset
+            offset += len(raw_line)
+    if current:
+        current['ranges'][-1][1] = offset
+    return sections
+
+
+class ConfigIndex(object):
+
+    def __init__(self, path, cache=True):
+        self.path = path
+        self.cache = cache
+        self.sections = None
+
+    def _stat_key(self):
+        file_stat = os.stat(self.path)
+        return [INDEX_VERSION, file_stat.st_ino, file_stat.st_size,
+                file_stat.st_mtime_ns]
+
+    def _index_paths(self):
+        return [index_path for index_path in [
+            get_index_path(self.path), get_cached_index_path(self.path)]
+            if index_path]
+
+    def _load_cache(self, key):
+        for index_path in self._index_paths():
+            try:
+                with open(index_path) as f:
+                    cached = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue
+            if cached.get('key') == key:
+                LOG.debug('load index from %s', index_path)
+                return cached['sections']
+        return None
+
+    def _save_cache(self, key, sections):
+        data = json.dumps({'key': key, 'sections': sections})
+        for index_path in self._index_paths():
+            tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(data)
+                os.replace(tmp_path, index_path)
+                LOG.debug('save index to %s', index_path)
+                return
+            except (IOError, OSError) as e:
+                LOG.debug('save index to %s failed: %s', index_path, e)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def load(self):
+        """Load the index from cache, build it if the file is changed"""
+        if self.sections is not None:
+            return self
+        key = self._stat_key()
+        self.sections = self._load_cache(key) if self.cache else None
+        if self.sections is None:
+            self.sections = build_index(self.path)
+            if self.cache:
+                self._save_cache(key, self.sections)
+        return self
+
+    def has_section(self, section):
+        return section in self.load().sections
+
+    def read_sections(self, *sections):
+        """Return the text of sections, missing sections are ignored"""
+        ranges = []
+        for section in sorted(set(sections), key=sections.index):
+            ranges.extend(self.load().sections.get(section, {}).get(
+                'ranges', []))
+        blocks = []
+        with open(self.path, 'rb') as f:
+            for start, end in ranges:
+                f.seek(start)
+                blocks.append(decode_line(f.read(end - start)))
+                if not blocks[-1].endswith('\n'):
+                    blocks[-1] += '\n'
+        return ''.join(blocks)
+
+    def get_raw(self, section, option):
+        """Get the raw value of option, without interpolation
+
+        The option is looked up in DEFAULT if it is not in the section.
+        Raise configparser.NoSectionError if the section is not found like
+        configparser, and KeyError if the option is not found.
+        """
+        if section != DEFAULT_SECTION and not self.has_section(section):
+            raise configparser.NoSectionError(section)
+        option = option.lower()
+        offset = None
+        for name in [section, DEFAULT_SECTION]:
+            offset = self.load().sections.get(name, {}).get(
+                'options', {}).get(option)
+            if offset is not None:
+                break
+        if offset is None:
+            raise KeyError(option)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            value = parse_option(decode_line(f.readline()))[1]
+            if value is None:
+                return None
+            values = [value.strip()]
+            for raw_line in f:
+                line = decode_line(raw_line)
+                if is_continuation(line):
+                    values.append(line.strip())
+                elif not line.strip():
+                    # NOTE: empty lines are a part of value if they are
+                    # followed by continuations, like configparser
+                    values.append('')
+                elif not is_comment(line):
+                    break
+        while values[-1] == '' and len(values) > 1:
+            values.pop()
+        return '\n'.join(values)
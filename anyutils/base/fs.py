@@ -1,10 +1,14 @@
 from __future__ import print_function
+import sys
 import time
 import os
+import zipfile
 
 from anycode.common import cliparser
 from anycode.common import log
 from anycode import fs
+from anyutils.base import archive
+from anyutils.base import tail
 
 LOG = log.getLogger(__name__)
 
@@ -14,7 +18,8 @@ class PyTac(cliparser.CliBase):
     ARGUMENTS = [
         cliparser.Argument('file', help='file'),
         cliparser.Argument('-c', '--chunk', type=int, default=None,
-                           help='The chunk size to read, default is None'),
+                           help='The chunk size to read, default is '
+                                '{}'.format(tail.DEFAULT_WINDOW)),
         cliparser.Argument('-n', '--nums', type=int, default=None,
                            help='Print Last N lines')]
 
@@ -24,6 +29,17 @@ class PyTac(cliparser.CliBase):
         if nums is not None and nums <= 0:
             LOG.error('The value of --nums NUM must >= 1')
             return
+        if args.chunk is not None and args.chunk <= 0:
+            LOG.error('The value of --chunk CHUNK must >= 1')
+            return
+        try:
+            tail.write_reversed(args.file, sys.stdout.buffer,
+                                window=args.chunk, nums=nums)
+            sys.stdout.flush()
+            LOG.debug('Used Time: %.2f seconds', time.time() - start_time)
+            return
+        except ValueError as e:
+            LOG.debug('%s, read with open_backwards', e)
         with fs.open_backwards(args.file, chunk_size=args.chunk) as fp:
             for line in fp:
                 print(line, end='')
@@ -35,6 +51,37 @@ class PyTac(cliparser.CliBase):
         LOG.debug('Used Time: %.2f seconds', time.time() - start_time)
 
 
+class PyTail(cliparser.CliBase):
+    NAME = 'py-tail'
+    ARGUMENTS = [
+        cliparser.Argument('files', nargs='+', metavar='file', help='file'),
+        cliparser.Argument('-n', '--nums', type=int, default=10,
+                           help='Print Last N lines, default is 10'),
+        cliparser.Argument('-f', '--follow', action='store_true',
+                           help='Print appended lines, and follow the file '
+                                'by name if it is rotated or truncated'),
+        cliparser.Argument('-c', '--chunk', type=int, default=None,
+                           help='The chunk size to read, default is '
+                                '{}'.format(tail.DEFAULT_WINDOW)),
+        cliparser.Argument('-s', '--sleep-interval', type=float, default=1.0,
+                           help='The interval to poll files if inotify is '
+                                'not supported, default is 1.0 seconds'),
+    ]
+
+    def __call__(self, args):
+        if args.nums < 0:
+            LOG.error('The value of --nums NUM must >= 0')
+            return 1
+        if args.chunk is not None and args.chunk <= 0:
+            LOG.error('The value of --chunk CHUNK must >= 1')
+            return 1
+        follower = tail.Follower(args.files, sys.stdout.buffer,
+                                 interval=args.sleep_interval)
+        follower.print_tail(nums=args.nums, window=args.chunk)
+        if args.follow:
+            follower.follow()
+
+
 class PyZip(cliparser.CliBase):
     NAME = 'zip'
     ARGUMENTS = [
@@ -43,14 +90,99 @@ class PyZip(cliparser.CliBase):
                            help='zip the child of dir'),
         cliparser.Argument('--no-path', action='store_true',
                            help='save path to zip file'),
+        cliparser.Argument('-o', '--output', default=None,
+                           help='The path of archive, default is '
+                                '<dir>.<format>, write to stdout if it is -'),
+        cliparser.Argument('-f', '--format', default=None,
+                           choices=archive.FORMATS,
+                           help='The format of archive, default is guessed '
+                                'by the output or zip'),
+        cliparser.Argument('-l', '--level', type=int, default=None,
+                           help='The compress level 0-9 or 1-19 for '
+                                'tar.zst, default is {} and {} for '
+                                'tar.zst'.format(archive.DEFAULT_LEVEL,
+                                                 archive.DEFAULT_ZSTD_LEVEL)),
+        cliparser.Argument('-w', '--workers', type=int, default=None,
+                           help='Compress with WORKERS threads, default is '
+                                'the num of cpus'),
+        cliparser.Argument('-u', '--update', metavar='ARCHIVE', default=None,
+                           help='Update the zip file ARCHIVE, the members '
+                                'whose size and mtime are not changed are '
+                                'copied without recompression'),
     ]
 
     def __call__(self, args):
+        if args.output == '-' and sys.stdout.isatty():
+            LOG.error('refuse to write archive to terminal')
+            return 1
         try:
-            fs.zip_files(args.dir, zip_root=not args.no_root,
-                         zip_path=not args.no_path,
-                         verbose=args.verbose)
+            if all(value is None for value in [
+                    args.level, args.workers, args.output, args.format,
+                    args.update]):
+                fs.zip_files(args.dir, zip_root=not args.no_root,
+                             zip_path=not args.no_path,
+                             verbose=args.verbose)
+                return
+            start_time = time.time()
+            output = archive.archive_dir(
+                args.dir, output=args.output, fmt=args.format,
+                zip_root=not args.no_root, zip_path=not args.no_path,
+                level=args.level, workers=args.workers, verbose=args.verbose,
+                update=args.update)
+            LOG.info('saved to %s, used time: %.2f seconds', output,
+                     time.time() - start_time)
         except FileExistsError:
             LOG.error('%s is not exists', args.dir)
         except Exception as e:
             LOG.error(e)
+
+
+class PyUnzip(cliparser.CliBase):
+    NAME = 'unzip'
+    ARGUMENTS = [
+        cliparser.Argument('file', help='the path of zip file'),
+        cliparser.Argument('-d', '--dir', default='.',
+                           help='Extract to DIR, default is current dir'),
+        cliparser.Argument('-i', '--include', action='append',
+                           metavar='GLOB',
+                           help='Only the members match GLOB, can be '
+                                'specified multiple times'),
+        cliparser.Argument('-x', '--exclude', action='append',
+                           metavar='GLOB',
+                           help='Skip the members match GLOB, can be '
+                                'specified multiple times'),
+        cliparser.Argument('-l', '--list', action='store_true',
+                           help='List members'),
+        cliparser.Argument('-w', '--workers', type=int, default=None,
+                           help='Extract with WORKERS threads, default is '
+                                'the num of cpus'),
+    ]
+
+    def __call__(self, args):
+        try:
+            if args.list:
+                self.list(args)
+                return
+            start_time = time.time()
+            errors = archive.extract_zip(args.file, dest=args.dir,
+                                         includes=args.include,
+                                         excludes=args.exclude,
+                                         workers=args.workers,
+                                         verbose=args.verbose)
+        except (OSError, zipfile.BadZipFile) as e:
+            LOG.error(e)
+            return 1
+        for name, error in errors:
+            LOG.error('extract %s failed: %s', name, error)
+        LOG.debug('Used Time: %.2f seconds', time.time() - start_time)
+        return errors and 1 or 0
+
+    def list(self, args):
+        infos = archive.list_zip(args.file, includes=args.include,
+                                 excludes=args.exclude)
+        print('{:>12}  {:<19}  {}'.format('Length', 'Date Time', 'Name'))
+        for info in infos:
+            print('{:>12}  {:04}-{:02}-{:02} {:02}:{:02}:{:02}  {}'.format(
+                info.file_size, *(info.date_time + (info.filename,))))
+        print('{:>12}  {:<19}  {} files'.format(
+            sum(info.file_size for info in infos), '', len(infos)))
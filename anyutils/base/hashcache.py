@@ -0,0 +1,89 @@
+"""Persistent cache of file digests
+
+Digests are saved in a SQLite database and keyed by
+(st_dev, st_ino, st_size, st_mtime_ns), so the files which are not changed
+need not to be read again. The least recently used entries are removed when
+the num of entries exceeds max_entries.
+"""
+import os
+import sqlite3
+import time
+
+from anycode.common import log
+from anyutils import utils
+
+LOG = log.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 200000
+
+SQL_CREATE = [
+    'CREATE TABLE IF NOT EXISTS digests ('
+    '    dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,'
+    '    algorithm TEXT, digest TEXT, atime REAL,'
+    '    PRIMARY KEY (dev, ino, size, mtime_ns, algorithm))',
+    'CREATE INDEX IF NOT EXISTS digests_atime ON digests (atime)',
+]
+SQL_KEY = 'dev = ? AND ino = ? AND size = ? AND mtime_ns = ?'
+
+
+def make_key(stat):
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class HashCache(object):
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or os.path.join(utils.get_cache_dir(),
+                                         'checksum.db')
+        self.max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        for sql in SQL_CREATE:
+            self._conn.execute(sql)
+
+    def get(self, stat, algorithms):
+        """Get the digests of file
+
+        Return:
+            dict of digests, or None if any algorithm is not cached
+        """
+        key = make_key(stat)
+        rows = self._conn.execute(
+            'SELECT algorithm, digest FROM digests WHERE ' + SQL_KEY,
+            key).fetchall()
+        digests = dict(rows)
+        if not all(algorithm in digests for algorithm in algorithms):
+            return None
+        self._conn.execute('UPDATE digests SET atime = ? WHERE ' + SQL_KEY,
+                           (time.time(),) + key)
+        return {algorithm: digests[algorithm] for algorithm in algorithms}
+
+    def put(self, stat, digests):
+        key = make_key(stat)
+        now = time.time()
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [key + (algorithm, digest, now)
+             for algorithm, digest in digests.items()])
+
+    def prune(self):
+        """Remove the least recently used entries exceeding max_entries"""
+        count = self._conn.execute('SELECT COUNT(*) FROM digests').fetchone()
+        overflow = count[0] - self.max_entries
+        if overflow <= 0:
+            return
+        LOG.debug('remove %s entries from cache %s', overflow, self.path)
+        self._conn.execute(
+            'DELETE FROM digests WHERE rowid IN ('
+            '    SELECT rowid FROM digests ORDER BY atime LIMIT ?)',
+            (overflow,))
+
+    def close(self):
+        self.prune()
+        self._conn.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
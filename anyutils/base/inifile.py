@@ -0,0 +1,174 @@
+"""Edit and compare INI files
+
+set_options applies many edits in one streaming pass, the lines which are
+not edited (comments, blank lines and the order of options) are kept as
+they are.
+"""
+import collections
+import os
+import shutil
+import stat
+import tempfile
+
+from anycode.common import log
+from anyutils.base import confindex
+
+LOG = log.getLogger(__name__)
+
+
+def parse_edit(edit):
+    """Parse edit like section.option=value
+
+    The section name may contain dots, the option name is the part after
+    the last dot.
+    Return:
+        (section, option, value)
+    """
+    key, sep, value = edit.partition('=')
+    section, dot, option = key.strip().rpartition('.')
+    if not sep or not dot or not section or not option:
+        raise ValueError('invalid edit {!r}, it should be like '
+                         'section.option=value'.format(edit))
+    return section, option.strip(), value.strip()
+
+
+def parse_edits(lines):
+    """Parse edits, blank lines and comments are ignored
+
+    Return:
+        OrderedDict of {section: OrderedDict of {option: value}}
+    """
+    edits = collections.OrderedDict()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(confindex.COMMENT_PREFIXES):
+            continue
+        section, option, value = parse_edit(line)
+        edits.setdefault(section, collections.OrderedDict())[option] = value
+    return edits
+
+
+def _format_option(option, value):
+    # NOTE: continuation lines of multi-line values must be indented
+    return '{} = {}\n'.format(option, value.replace('\n', '\n    '))
+
+
+def _iter_edited_lines(fp, edits):
+    pending = collections.OrderedDict(
+        (section, collections.OrderedDict(
+            (option.lower(), (option, value))
+            for option, value in options.items()))
+        for section, options in edits.items())
+    section, skipping, blank_lines = None, False, []
+
+    def _flush_section():
+        # add the new options of section after its last option
+        for option, value in pending.pop(section, {}).values():
+            yield _format_option(option, value)
+
+    for line in fp:
+        if skipping and confindex.is_continuation(line):
+            # the empty lines before a continuation are a part of the value
+            blank_lines = []
+            continue
+        if not line.strip():
+            blank_lines.append(line)
+            continue
+        if skipping and confindex.is_comment(line):
+            # comments do not end the value, keep them
+            for blank_line in blank_lines:
+                yield blank_line
+            blank_lines = []
+            yield line if line.endswith('\n') else line + '\n'
+            continue
+        skipping = False
+        name = confindex.parse_section(line)
+        if name is not None:
+            for new_line in _flush_section():
+                yield new_line
+            section = name
+        else:
+            parsed = confindex.parse_option(line)
+            options = pending.get(section, {})
+            if parsed and parsed[0] in options:
+                option, value = options.pop(parsed[0])
+                # keep the name of option as it is written
+                original = line.split('=', 1)[0].split(':', 1)[0].strip()
+                line = _format_option(original, value)
+                skipping = True
+        for blank_line in blank_lines:
+            yield blank_line
+        blank_lines = []
+        if not line.endswith('\n'):
+            line += '\n'
+        yield line
+    for new_line in _flush_section():
+        yield new_line
+    for blank_line in blank_lines:
+        yield blank_line
+    for name, options in pending.items():
+        if not options:
+            continue
+        yield '\n[{}]\n'.format(name)
+        for option, value in options.values():
+            yield _format_option(option, value)
+
+
+def set_options(path, edits):
+    """Apply edits to the file in one streaming pass
+
+    The options in edits are replaced in place, new options are added to the
+    end of their sections, and new sections are added to the end of file.
+    The file is written to a temp file and then replaces the original one,
+    symlinks are followed and the mode and owner of file are kept. If the
+    owner can not be set, the original file is rewritten instead.
+    Param:
+        edits: dict of {section: {option: value}}
+    """
+    path = os.path.realpath(path)
+    file_stat = os.stat(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.{}.'.format(
+        os.path.basename(path)), dir=os.path.dirname(path))
+    try:
+        with open(path) as src, os.fdopen(fd, 'w') as dst:
+            for line in _iter_edited_lines(src, edits):
+                dst.write(line)
+        os.chmod(tmp_path, stat.S_IMODE(file_stat.st_mode))
+        try:
+            os.chown(tmp_path, file_stat.st_uid, file_stat.st_gid)
+        except OSError as e:
+            LOG.debug('chown %s failed: %s, rewrite %s', tmp_path, e, path)
+            with open(tmp_path) as src, open(path, 'w') as dst:
+                shutil.copyfileobj(src, dst)
+            return
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def diff_sections(sections1, sections2):
+    """Compare the options of sections
+
+    Param:
+        sections1, sections2: dict of {section: {option: value}}
+    Return:
+        list of (section, [(option, value1, value2)]), value is None if the
+        option is missing
+    """
+    diffs = []
+    names = list(sections1) + [name for name in sections2
+                               if name not in sections1]
+    for name in names:
+        options1 = sections1.get(name, {})
+        options2 = sections2.get(name, {})
+        changes = []
+        for option in list(options1) + [option for option in options2
+                                        if option not in options1]:
+            value1, value2 = options1.get(option), options2.get(option)
+            if option not in options1 or option not in options2 or \
+               value1 != value2:
+                changes.append((option, value1, value2))
+        if changes:
+            diffs.append((name, changes))
+    return diffs
@@ -0,0 +1,176 @@
+"""JSON backends of json-get
+
+json-get uses the fastest installed one of orjson, simdjson and ujson, and
+the stdlib json if none of them is installed. They differ from the stdlib
+json on some documents: integers beyond 64 bits become floats or errors, and
+NaN and Infinity are rejected. Such documents are parsed by the stdlib json,
+so all backends return the same values and raise json.JSONDecodeError for
+invalid documents. Values are always dumped by the stdlib json, because the
+fast backends can not produce the same text, so only parsing is benchmarked.
+"""
+import importlib
+import json
+import re
+import time
+
+from anycode.common import log
+
+LOG = log.getLogger(__name__)
+
+BACKEND_AUTO = 'auto'
+BACKEND_JSON = 'json'
+# integers of 19 or more digits may exceed 64 bits, only the digits after
+# the start, [, : or , are matched, so the digits in strings are ignored
+# unless a string contains such a sequence
+RE_BIG_INTEGER = re.compile(rb'(?:^|[\[,:])[ \t\n\r]*-?[0-9]{19}')
+# digits are translated to 0, so runs of 19 digits are found by the substring
+# search, which is much faster than the regex
+DIGITS_TABLE = bytes.maketrans(b'123456789', b'0' * 9)
+BIG_DIGITS = b'0' * 19
+
+
+class JsonBackend(object):
+    """The stdlib json"""
+    NAME = BACKEND_JSON
+    MODULE = 'json'
+
+    def __init__(self):
+        self.module = importlib.import_module(self.MODULE)
+
+    @classmethod
+    def is_available(cls):
+        try:
+            importlib.import_module(cls.MODULE)
+            return True
+        except ImportError:
+            return False
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps_line(self, obj):
+        """Dump obj to a line, the same as json.dumps for all backends"""
+        return json.dumps(obj)
+
+
+class FastJsonBackend(JsonBackend):
+    """The backends which fall back to the stdlib json
+
+    NOTE: the fast backends parse big integers as floats or fail, and
+    reject NaN, Infinity and numbers out of the range of double, so these
+    documents are parsed by the stdlib json.
+    """
+
+    def _loads(self, data):
+        """Parse the utf-8 bytes of document"""
+        return self.module.loads(data)
+
+    def loads(self, data):
+        try:
+            raw = data.encode('utf-8')
+        except UnicodeEncodeError:
+            return json.loads(data)
+        if BIG_DIGITS in raw.translate(DIGITS_TABLE) and \
+           RE_BIG_INTEGER.search(raw):
+            return json.loads(data)
+        try:
+            return self._loads(raw)
+        except (ValueError, OverflowError):
+            # raise json.JSONDecodeError if the document is invalid
+            return json.loads(data)
+
+
+class OrjsonBackend(FastJsonBackend):
+    NAME = MODULE = 'orjson'
+
+
+class UjsonBackend(FastJsonBackend):
+    NAME = MODULE = 'ujson'
+
+
+class SimdjsonBackend(FastJsonBackend):
+    NAME = MODULE = 'simdjson'
+
+    def __init__(self):
+        super(SimdjsonBackend, self).__init__()
+        self._parser = self.module.Parser()
+
+    def _loads(self, data):
+        # NOTE: the parser reuses its buffers, so convert to python objects
+        # before the next parse
+        return self._parser.parse(data, recursive=True)
+
+
+# the fastest first
+BACKENDS = [OrjsonBackend, SimdjsonBackend, UjsonBackend, JsonBackend]
+BACKEND_NAMES = [BACKEND_AUTO] + [backend.NAME for backend in BACKENDS]
+_BACKEND_CACHE = {}
+
+
+def get_backend(name=None):
+    """Get the backend by name
+
+    Get the stdlib json if name is None, and the fastest installed backend
+    if name is auto. Raise ValueError if the backend is unknown, and
+    ImportError if it is not installed.
+    """
+    name = name or BACKEND_JSON
+    if name not in _BACKEND_CACHE:
+        if name == BACKEND_AUTO:
+            backend_cls = [backend for backend in BACKENDS
+                           if backend.is_available()][0]
+        else:
+            found = [backend for backend in BACKENDS if backend.NAME == name]
+            if not found:
+                raise ValueError(name)
+            backend_cls = found[0]
+        LOG.debug('json backend %s is %s', name, backend_cls.NAME)
+        _BACKEND_CACHE[name] = backend_cls()
+    return _BACKEND_CACHE[name]
+
+
+def make_corpus(num=2000):
+    """Make documents like the responses of APIs"""
+    # NOTE: only the benchmark needs them, do not slow down json-get
+    import random
+    import string
+    rand = random.Random(0)
+
+    def _word():
+        return ''.join(rand.choice(string.ascii_letters)
+                       for _ in range(rand.randint(3, 12)))
+
+    docs = []
+    for i in range(num):
+        docs.append(json.dumps({
+            'id': i, 'name': _word(), 'enabled': rand.random() > 0.5,
+            'score': rand.random() * 100, 'tags': [_word() for _ in range(5)],
+            'metadata': {_word(): _word() for _ in range(5)},
+            'items': [{'id': j, 'value': rand.randint(0, 1 << 30)}
+                      for j in range(10)],
+        }))
+    return docs
+
+
+def benchmark(docs, backends=None, repeat=3):
+    """Get the parse speed of backends
+
+    Return:
+        list of dict, e.g. [{'backend': 'json', 'loads': <MB/s>}]
+    """
+    size = sum(len(doc) for doc in docs) / 1024.0 / 1024.0
+    results = []
+    for backend_cls in backends or BACKENDS:
+        if not backend_cls.is_available():
+            LOG.info('json backend %s is not installed', backend_cls.NAME)
+            continue
+        backend = backend_cls()
+        loads_time = float('inf')
+        for _ in range(repeat):
+            start_time = time.time()
+            for doc in docs:
+                backend.loads(doc)
+            loads_time = min(loads_time, time.time() - start_time)
+        results.append({'backend': backend.NAME,
+                        'loads': size / max(loads_time, 1e-9)})
+    return results
@@ -0,0 +1,386 @@
+"""Get values of JSON documents by keys like key1.key2.1
+
+JsonStreamReader reads a document incrementally and walks it only once.
+Values which are not on the path of keys are skipped without being built,
+only the matched value is kept in memory, and reading stops as soon as the
+value is found.
+
+extract_lines gets values from JSON lines, blocks of lines are parsed by a
+process pool and the output keeps the order of lines.
+"""
+import collections
+import itertools
+import json
+import os
+import re
+from concurrent import futures
+
+from anycode.common import log
+from anyutils.base import jsonbackend
+
+LOG = log.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_BATCH_LINES = 10000
+FORMAT_TSV = 'tsv'
+FORMAT_JSON = 'json'
+FORMATS = [FORMAT_TSV, FORMAT_JSON]
+
+RE_WHITESPACE = re.compile(r'[ \t\n\r]*')
+RE_STRING_SPECIAL = re.compile(r'["\\]')
+RE_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+RE_CONTAINER_SPECIAL = re.compile(r'["\[\]{}]')
+RE_NUMBER_CHARS = re.compile(r'[-+0-9.eE]*')
+RE_NUMBERS = re.compile(r'[-+0-9.eE \t\n\r,]*')
+LITERALS = {'true': True, 'false': False, 'null': None,
+            'NaN': float('nan'), 'Infinity': float('inf'),
+            '-Infinity': float('-inf')}
+MAX_LITERAL_LENGTH = max(len(literal) for literal in LITERALS)
+RE_SCALAR = re.compile(
+    r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?|{}'.format(
+        '|'.join(re.escape(literal) for literal in LITERALS)))
+
+
+def split_keys(keys):
+    """Split string like key1.key2.1 to a list of keys"""
+    return keys.split('.') if keys else []
+
+
+class JsonStreamReader(object):
+
+    def __init__(self, fp, chunk_size=None):
+        self.fp = fp
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        self.buf = ''
+        self.pos = 0
+        # the start of the value kept in buffer
+        self.mark = None
+        self.eof = False
+
+    def _fill(self):
+        """Read the next chunk and drop the data before pos or mark
+
+        Return:
+            False if reach the end of file
+        """
+        if self.eof:
+            return False
+        if self.mark is None:
+            keep, size = self.pos, self.chunk_size
+        else:
+            # NOTE: read as much as kept, so a large marked value is not
+            # copied once per chunk
+            keep = self.mark
+            size = max(self.chunk_size, len(self.buf) - keep)
+        data = self.fp.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[keep:] + data
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark = 0
+        return True
+
+    def _error(self, message):
+        raise json.JSONDecodeError(message, self.buf, self.pos)
+
+    def _peek(self):
+        """Skip whitespaces and return the next char, '' if end of file"""
+        while True:
+            self.pos = RE_WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            self._error('Expecting {!r}'.format(char))
+        self.pos += 1
+
+    def _find_string_end(self, discard=False):
+        """Find the end of string starts at pos
+
+        Return:
+            the index after the closing quote
+        """
+        offset = 1
+        while True:
+            matched = RE_STRING_SPECIAL.search(self.buf, self.pos + offset)
+            if matched and matched.group() == '"':
+                return matched.end()
+            if matched and matched.end() < len(self.buf):
+                # skip the escaped char
+                offset = matched.end() + 1 - self.pos
+                continue
+            if matched:
+                offset = matched.start() - self.pos
+            else:
+                offset = len(self.buf) - self.pos
+            if discard:
+                # NOTE: skipped string need not to be kept in memory
+                self.pos, offset = self.pos + offset - 1, 1
+            if not self._fill():
+                self._error('Unterminated string starting at')
+
+    def _parse_string(self):
+        end = self._find_string_end()
+        value, _ = json.decoder.scanstring(self.buf[self.pos:end], 1)
+        self.pos = end
+        return value
+
+    def _scan_scalar(self):
+        """Match the number or literal starts at pos without moving pos"""
+        while True:
+            end = len(self.buf)
+            # NOTE: a number or literal may be cut off at the end of buffer
+            is_cut = RE_NUMBER_CHARS.match(self.buf, self.pos).end() == end \
+                or (end - self.pos < MAX_LITERAL_LENGTH and
+                    any(literal.startswith(self.buf[self.pos:])
+                        for literal in LITERALS))
+            if not is_cut or not self._fill():
+                break
+        matched = RE_SCALAR.match(self.buf, self.pos)
+        if not matched:
+            self._error('Expecting value')
+        return matched
+
+    def load_value(self):
+        """Load the next value by json.loads after finding its end
+
+        The value is skipped to find its end, only its text is kept in
+        buffer and it is built by the C scanner of json.
+        """
+        self._peek()
+        self.mark = self.pos
+        try:
+            self.skip_value()
+            text = self.buf[self.mark:self.pos]
+        finally:
+            self.mark = None
+        return json.loads(text)
+
+    def skip_value(self):
+        """Skip the next value without building it"""
+        char = self._peek()
+        if char == '"':
+            self.pos = self._find_string_end(discard=True)
+            return
+        if char not in '{[':
+            self.pos = self._scan_scalar().end()
+            return
+        depth = 0
+        while True:
+            matched = RE_CONTAINER_SPECIAL.search(self.buf, self.pos)
+            if not matched:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    self._error('Unexpected end of document')
+                continue
+            self.pos = matched.start()
+            char = matched.group()
+            if char == '"':
+                matched = RE_STRING.match(self.buf, self.pos)
+                self.pos = matched.end() if matched else \
+                    self._find_string_end(discard=True)
+                continue
+            self.pos += 1
+            depth += 1 if char in '{[' else -1
+            if depth == 0:
+                return
+
+    def _find_key(self, key):
+        if self._peek() == '}':
+            return False
+        while True:
+            if self._peek() != '"':
+                self._error('Expecting property name enclosed in '
+                            'double quotes')
+            name = self._parse_string()
+            self._expect(':')
+            if name == key:
+                return True
+            self.skip_value()
+            char = self._peek()
+            self.pos += 1
+            if char == '}':
+                return False
+            if char != ',':
+                self.pos -= 1
+                self._error("Expecting ',' delimiter")
+
+    def _find_index(self, index):
+        if self._peek() == ']':
+            return False
+        current = 0
+        while True:
+            if current == index:
+                return True
+            # NOTE: skip a run of numbers by counting commas, the numbers
+            # before the last comma are not cut off. They are not validated
+            # like the values in skipped containers
+            end = self.buf.rfind(
+                ',', self.pos, RE_NUMBERS.match(self.buf, self.pos).end()) + 1
+            if end:
+                count = self.buf.count(',', self.pos, end)
+                if count > index - current:
+                    for _ in range(index - current):
+                        self.pos = self.buf.index(',', self.pos) + 1
+                    return True
+                current += count
+                self.pos = end
+                continue
+            self.skip_value()
+            char = self._peek()
+            self.pos += 1
+            if char == ']':
+                return False
+            if char != ',':
+                self.pos -= 1
+                self._error("Expecting ',' delimiter")
+            current += 1
+
+    def get(self, keys):
+        """Walk to the value of keys and return it
+
+        Raise KeyError if key is not found, and ValueError if the index of
+        list is invalid.
+        """
+        for key in keys:
+            char = self._peek()
+            self.pos += 1
+            if char == '{':
+                if not self._find_key(key):
+                    raise KeyError(key)
+            elif char == '[':
+                try:
+                    index = int(key)
+                except ValueError:
+                    raise ValueError(key)
+                if index < 0 or not self._find_index(index):
+                    raise ValueError(key)
+            else:
+                self.pos -= 1
+                if not char:
+                    self._error('Expecting value')
+                raise KeyError(key)
+        return self.load_value()
+
+
+def stream_get(fp, keys, chunk_size=None):
+    """Get the value of keys from file object without loading all of it
+
+    Param:
+        keys: string like key1.key2.1
+    """
+    return JsonStreamReader(fp, chunk_size=chunk_size).get(split_keys(keys))
+
+
+def get_value(obj, keys):
+    """Get the value of keys from a loaded object
+
+    Raise KeyError if key is not found, and ValueError if the index of list
+    is invalid.
+    """
+    for key in keys:
+        if isinstance(obj, list):
+            try:
+                obj = obj[int(key)]
+            except (ValueError, IndexError):
+                raise ValueError(key)
+        elif isinstance(obj, dict) and key in obj:
+            obj = obj[key]
+        else:
+            raise KeyError(key)
+    return obj
+
+
+def _format_tsv_field(value):
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        return json.dumps(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n').replace('\r', '\\r')
+
+
+def _format_json_line(keys_list, values, dumps):
+    # NOTE: a key may be given more than once, so do not build a dict
+    return '{{{}}}'.format(', '.join(
+        '{}: {}'.format(dumps(keys), dumps(value))
+        for keys, value in zip(keys_list, values)))
+
+
+def extract_block(lines, keys_list, output_format=FORMAT_TSV, start=1,
+                  backend=None):
+    """Get the values of keys from JSON lines
+
+    Missing values are null in json format and empty in tsv format.
+    Param:
+        start: the line num of the first line
+        backend: the name of json backend
+    Return:
+        text, errors: errors is a list of (line num, error message)
+    """
+    json_backend = jsonbackend.get_backend(backend)
+    splited_keys = [split_keys(keys) for keys in keys_list]
+    output, errors = [], []
+    for lineno, line in enumerate(lines, start):
+        if not line.strip():
+            continue
+        try:
+            obj = json_backend.loads(line)
+        except ValueError as e:
+            errors.append((lineno, str(e)))
+            continue
+        values = []
+        for keys in splited_keys:
+            try:
+                values.append(get_value(obj, keys))
+            except (KeyError, ValueError):
+                values.append(None)
+        if output_format == FORMAT_JSON:
+            output.append(_format_json_line(keys_list, values,
+                                            json_backend.dumps_line))
+        else:
+            output.append('\t'.join(_format_tsv_field(v) for v in values))
+    output.append('')
+    return '\n'.join(output) if len(output) > 1 else '', errors
+
+
+def _read_blocks(fp, batch):
+    start = 1
+    while True:
+        lines = list(itertools.islice(fp, batch))
+        if not lines:
+            return
+        yield lines, start
+        start += len(lines)
+
+
+def extract_lines(fp, keys_list, output_format=FORMAT_TSV, workers=None,
+                  batch=None, backend=None):
+    """Get the values of keys from JSON lines of file object in parallel
+
+    Yield (text, errors) of each block in the order of lines.
+    """
+    batch = batch or DEFAULT_BATCH_LINES
+    workers = workers or os.cpu_count() or 1
+    blocks = _read_blocks(fp, batch)
+    if workers <= 1:
+        for lines, start in blocks:
+            yield extract_block(lines, keys_list, output_format, start,
+                                backend=backend)
+        return
+    pending = collections.deque()
+    with futures.ProcessPoolExecutor(workers) as executor:
+        for lines, start in blocks:
+            pending.append(executor.submit(extract_block, lines, keys_list,
+                                           output_format, start,
+                                           backend=backend))
+            # NOTE: limit the blocks in memory
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
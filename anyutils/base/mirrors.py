@@ -0,0 +1,128 @@
+"""Probe the speed of pip mirrors
+
+Every mirror is probed by a thread, the probe measures the TCP connect time,
+the time to the first byte of response and the throughput of fetching a
+small page of the simple index.
+"""
+import http.client
+import socket
+import time
+from concurrent import futures
+from urllib import parse
+
+from anycode.common import log
+
+LOG = log.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 5
+DEFAULT_PROBE_PATH = 'pip/'
+# read at most this bytes of the probe page
+DEFAULT_MAX_BYTES = 256 * 1024
+MAX_REDIRECTS = 3
+
+
+class ProbeResult(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.connect = None
+        self.ttfb = None
+        self.speed = None
+        self.elapsed = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<ProbeResult {} elapsed={} error={}>'.format(
+            self.url, self.elapsed, self.error)
+
+
+def check_url(url):
+    """Raise ValueError if url is not a http or https url with valid port"""
+    splited = parse.urlsplit(url)
+    if splited.scheme not in ('http', 'https') or not splited.hostname:
+        raise ValueError('not a http or https url')
+    # NOTE: port raises ValueError if it is not a num in 0-65535
+    splited.port
+
+
+def _get_connection(url, timeout):
+    conn_cls = http.client.HTTPSConnection if url.scheme == 'https' else \
+        http.client.HTTPConnection
+    return conn_cls(url.hostname, url.port, timeout=timeout)
+
+
+def probe(index_url, path=None, timeout=None, max_bytes=None):
+    """Fetch a page of index_url and measure the speed
+
+    Param:
+        path: the path of page relative to index_url, default is pip/
+    Return:
+        ProbeResult, the times are seconds and the speed is bytes/s
+    """
+    timeout = timeout or DEFAULT_TIMEOUT
+    max_bytes = max_bytes or DEFAULT_MAX_BYTES
+    result = ProbeResult(index_url)
+    url = parse.urljoin(index_url.rstrip('/') + '/',
+                        DEFAULT_PROBE_PATH if path is None else path)
+    start_time = time.time()
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            splited = parse.urlsplit(url)
+            conn = _get_connection(splited, timeout)
+            try:
+                connect_start = time.time()
+                conn.connect()
+                result.connect = time.time() - connect_start
+                request_path = splited.path or '/'
+                if splited.query:
+                    request_path += '?' + splited.query
+                request_start = time.time()
+                conn.request('GET', request_path,
+                             headers={'User-Agent': 'any-utils',
+                                      'Accept': 'text/html'})
+                response = conn.getresponse()
+                result.ttfb = time.time() - request_start
+                if response.status in (301, 302, 303, 307, 308) and \
+                   response.getheader('Location'):
+                    url = parse.urljoin(url, response.getheader('Location'))
+                    continue
+                if response.status >= 400:
+                    raise http.client.HTTPException(
+                        'HTTP {} {}'.format(response.status,
+                                            response.reason))
+                read_start = time.time()
+                size = len(response.read(max_bytes))
+                result.speed = size / max(time.time() - read_start, 1e-6)
+                break
+            finally:
+                conn.close()
+        else:
+            raise http.client.HTTPException('too many redirects')
+    except (OSError, ValueError, socket.timeout,
+            http.client.HTTPException) as e:
+        # NOTE: ValueError is raised by the invalid port of redirection
+        result.error = str(e) or e.__class__.__name__
+    result.elapsed = time.time() - start_time
+    return result
+
+
+def probe_all(index_urls, path=None, timeout=None, max_bytes=None):
+    """Probe mirrors concurrently
+
+    Return:
+        list of ProbeResult, the fastest first and the failed ones last
+    """
+    if not index_urls:
+        return []
+    with futures.ThreadPoolExecutor(len(index_urls)) as executor:
+        results = list(executor.map(
+            lambda url: probe(url, path=path, timeout=timeout,
+                              max_bytes=max_bytes),
+            index_urls))
+    for result in results:
+        LOG.debug('%s', result)
+    return sorted(results, key=lambda r: (not r.ok, r.elapsed))
@@ -0,0 +1,134 @@
+"""Generate passwords in bulk
+
+Random bytes are read from os.urandom in large blocks, chars are picked by
+rejection sampling with bytes.translate, so there is no system call for each
+char and the chars are distributed uniformly.
+"""
+import collections
+import os
+import string
+import time
+from concurrent import futures
+
+from anycode.common import log
+
+LOG = log.getLogger(__name__)
+
+LOWER_CHARS = string.ascii_lowercase
+UPPER_CHARS = string.ascii_uppercase
+NUMBER_CHARS = string.digits
+SPECIAL_CHARS = '!#$%&*+-=?@^_~'
+DEFAULT_BLOCK_SIZE = 64 * 1024
+DEFAULT_BATCH = 10000
+
+
+class RandomPool(object):
+    """Random bytes read from os.urandom in blocks"""
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size or DEFAULT_BLOCK_SIZE
+        self._buffer = b''
+        self._pos = 0
+
+    def read(self, size):
+        if self._pos + size > len(self._buffer):
+            self._buffer = self._buffer[self._pos:] + os.urandom(
+                max(size, self.block_size))
+            self._pos = 0
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += size
+        return data
+
+    def randbelow(self, num):
+        """Return a random int in [0, num), num must be <= 256"""
+        limit = 256 - 256 % num
+        while True:
+            value = self.read(1)[0]
+            if value < limit:
+                return value % num
+
+    def choices(self, chars, size):
+        """Return a string of size chars picked from chars uniformly"""
+        num = len(chars)
+        limit = 256 - 256 % num
+        rejected = bytes(range(limit, 256))
+        table = bytes(ord(chars[i % num]) for i in range(256))
+        result = b''
+        while len(result) < size:
+            # NOTE: about limit/256 of random bytes are accepted
+            data = self.read((size - len(result)) * 256 // limit + 16)
+            result += data.translate(table, rejected)
+        return result[:size].decode('ascii')
+
+    def shuffle(self, chars):
+        for i in range(len(chars) - 1, 0, -1):
+            j = self.randbelow(i + 1)
+            chars[i], chars[j] = chars[j], chars[i]
+
+
+class PasswordGenerator(object):
+
+    def __init__(self, lower=8, upper=None, number=None, special=None,
+                 block_size=None):
+        self.counts = [(LOWER_CHARS, lower or 0), (UPPER_CHARS, upper or 0),
+                       (NUMBER_CHARS, number or 0),
+                       (SPECIAL_CHARS, special or 0)]
+        if any(count < 0 for _, count in self.counts):
+            raise ValueError('the num of chars must >= 0')
+        self.length = sum(count for _, count in self.counts)
+        if self.length <= 0:
+            raise ValueError('the length of password must >= 1')
+        if self.length > 256:
+            raise ValueError('the length of password must <= 256')
+        self.pool = RandomPool(block_size=block_size)
+
+    def generate(self, num=1):
+        """Generate num passwords"""
+        counts = [(chars, count) for chars, count in self.counts if count]
+        columns = [(count, self.pool.choices(chars, count * num))
+                   for chars, count in counts]
+        passwords = []
+        for i in range(num):
+            password = []
+            for count, column in columns:
+                password.extend(column[i * count:(i + 1) * count])
+            self.pool.shuffle(password)
+            passwords.append(''.join(password))
+        return passwords
+
+
+def _generate(num, kwargs):
+    return PasswordGenerator(**kwargs).generate(num)
+
+
+def generate_passwords(num, workers=None, batch=None, **kwargs):
+    """Generate num passwords in batches
+
+    Batches are generated by a process pool if workers > 1, and yielded in
+    order as lists of passwords.
+    """
+    if num < 0:
+        raise ValueError('the num of passwords must >= 0')
+    batch = batch or DEFAULT_BATCH
+    sizes = [min(batch, num - start) for start in range(0, num, batch)]
+    if not workers or workers <= 1 or len(sizes) <= 1:
+        generator = PasswordGenerator(**kwargs)
+        for size in sizes:
+            yield generator.generate(size)
+        return
+    pending = collections.deque()
+    with futures.ProcessPoolExecutor(workers) as executor:
+        for size in sizes:
+            pending.append(executor.submit(_generate, size, kwargs))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def benchmark(num, workers=None, **kwargs):
+    """Return passwords per second"""
+    start_time = time.time()
+    for _ in generate_passwords(num, workers=workers, **kwargs):
+        pass
+    return num / max(time.time() - start_time, 1e-9)
@@ -5,12 +5,14 @@ from anycode.common import cliparser
 from anycode.common import log
 from anycode import system
 from anycode import fs
+from anyutils.base import mirrors
 
 LOG = log.getLogger(__name__)
 
 
 SECTION_GLOBAL = 'global'
 OPTION_INDEX_URL = 'index-url'
+OPTION_EXTRA_INDEX_URL = 'extra-index-url'
 SECTION_INSTALL = 'install'
 OPTION_TRUST_HOST = 'trusted-host'
 KNOWN_INDEX_URL = {
@@ -19,6 +21,7 @@ KNOWN_INDEX_URL = {
     'ustc': 'https://pypi.mirrors.ustc.edu.cn/simple/',
     'tsinghua': 'https://pypi.tuna.tsinghua.edu.cn/simple',
 }
+INDEX_URL_AUTO = 'auto'
 
 
 def set_option(parser, section, option, value):
@@ -34,16 +37,60 @@ class SetPip(cliparser.CliBase):
                            help='Set config force.'),
         cliparser.Argument('index_url',
                            help='The index-url of pip, http url or one of '
-                           '{}'.format(list(KNOWN_INDEX_URL.keys()))),
+                           '{}, or {} to use the fastest one'.format(
+                               list(KNOWN_INDEX_URL.keys()), INDEX_URL_AUTO)),
+        cliparser.Argument('-c', '--candidate', action='append',
+                           metavar='URL',
+                           help='The other index-url to probe in {} mode, '
+                                'can be specified multiple times'.format(
+                                    INDEX_URL_AUTO)),
+        cliparser.Argument('-e', '--extra', type=int, default=0,
+                           help='The num of the next fastest index urls '
+                                'set as extra-index-url in {} mode, pip '
+                                'queries all of them, default is 0'.format(
+                                    INDEX_URL_AUTO)),
+        cliparser.Argument('-t', '--timeout', type=float,
+                           default=mirrors.DEFAULT_TIMEOUT,
+                           help='The timeout of probe, default is '
+                                '{} seconds'.format(mirrors.DEFAULT_TIMEOUT)),
     ]
 
+    def probe(self, args):
+        """Probe the index urls, return the fastest and the others"""
+        index_urls = list(KNOWN_INDEX_URL.values()) + (args.candidate or [])
+        results = mirrors.probe_all(index_urls, timeout=args.timeout)
+        for result in results:
+            if result.ok:
+                LOG.info('%-45s connect: %.3fs, ttfb: %.3fs, '
+                         'speed: %.1f KB/s', result.url, result.connect,
+                         result.ttfb, result.speed / 1024)
+            else:
+                LOG.warning('%-45s %s', result.url, result.error)
+        urls = [result.url for result in results if result.ok]
+        return urls and urls[0], urls[1:1 + args.extra]
+
     def __call__(self, args):
         pip_conf = system.get_pip_path()
         fs.make_file(pip_conf)
         parser = configparser.ConfigParser()
         if not parser.has_section(SECTION_GLOBAL):
             parser.add_section(SECTION_GLOBAL)
-        if args.index_url in KNOWN_INDEX_URL:
+        extra_index_urls = []
+        if args.index_url == INDEX_URL_AUTO:
+            if args.extra < 0:
+                LOG.error('The value of --extra EXTRA must >= 0')
+                return 1
+            for candidate in args.candidate or []:
+                try:
+                    mirrors.check_url(candidate)
+                except ValueError as e:
+                    LOG.error('invalid candidate %s: %s', candidate, e)
+                    return 1
+            index_url, extra_index_urls = self.probe(args)
+            if not index_url:
+                LOG.error('all index urls are unreachable')
+                return 1
+        elif args.index_url in KNOWN_INDEX_URL:
             index_url = KNOWN_INDEX_URL.get(args.index_url)
         else:
             index_url = args.index_url
@@ -53,7 +100,14 @@ class SetPip(cliparser.CliBase):
                      'to set force', index_url)
             return
         set_option(parser, SECTION_GLOBAL, OPTION_INDEX_URL, index_url)
-        set_option(parser, SECTION_INSTALL, OPTION_TRUST_HOST, url.netloc)
+        trusted_hosts = [url.netloc]
+        if extra_index_urls:
+            set_option(parser, SECTION_GLOBAL, OPTION_EXTRA_INDEX_URL,
+                       '\n'.join(extra_index_urls))
+            trusted_hosts.extend(urllib_parse.urlsplit(extra).netloc
+                                 for extra in extra_index_urls)
+        set_option(parser, SECTION_INSTALL, OPTION_TRUST_HOST,
+                   '\n'.join(trusted_hosts))
         with open(pip_conf, 'w') as f:
             parser.write(f)
         LOG.info('update success')
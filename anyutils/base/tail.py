@@ -0,0 +1,327 @@
+"""Read lines from the end of file
+
+The file is memory mapped and scanned backwards with rfind in large
+windows, only the pages holding the wanted lines are touched.
+
+Follower prints the appended lines of files after the last lines, it waits
+for inotify events instead of polling on Linux.
+"""
+import contextlib
+import ctypes
+import ctypes.util
+import mmap
+import os
+import select
+import stat
+import struct
+import time
+
+from anycode.common import log
+
+LOG = log.getLogger(__name__)
+
+DEFAULT_WINDOW = 1024 * 1024
+# the max size of appended data read at once
+READ_SIZE = 1024 * 1024
+# check all followed files every CHECK_INTERVALS intervals with inotify
+CHECK_INTERVALS = 5
+
+
+@contextlib.contextmanager
+def open_mmap(path):
+    """Map file to memory
+
+    Raise ValueError if the file is not a regular file or it is empty,
+    e.g. files in /proc, they can not be mapped.
+    """
+    with open(path, 'rb') as f:
+        file_stat = os.fstat(f.fileno())
+        if not stat.S_ISREG(file_stat.st_mode) or not file_stat.st_size:
+            raise ValueError('{} can not be mapped'.format(path))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def iter_reversed_blocks(data, window=None, nums=None, end=None):
+    """Yield blocks of lines in reversed order
+
+    Each block holds the lines of a window, joined to one bytes.
+    Param:
+        data: bytes or mmap
+        nums: the num of lines, all lines if None
+        end: scan backwards from end, default is the length of data
+    Raise ValueError if window is not positive.
+    """
+    window = DEFAULT_WINDOW if window is None else window
+    if window <= 0:
+        raise ValueError('window must > 0, got {}'.format(window))
+    end = len(data) if end is None else end
+    while end > 0 and (nums is None or nums > 0):
+        start = max(0, end - window)
+        if start > 0:
+            # NOTE: move start to the beginning of a line
+            start = data.rfind(b'\n', 0, start) + 1
+        lines = []
+        while end > start and (nums is None or nums > 0):
+            # the last char of line is its own newline
+            line_start = data.rfind(b'\n', start, end - 1) + 1
+            line_start = max(line_start, start)
+            lines.append(data[line_start:end])
+            end = line_start
+            if nums is not None:
+                nums -= 1
+        yield b''.join(lines)
+
+
+def find_tail_offset(data, nums, window=None):
+    """Return the offset of the last nums lines"""
+    offset = len(data)
+    for block in iter_reversed_blocks(data, window=window, nums=nums):
+        offset -= len(block)
+    return offset
+
+
+def write_reversed(path, output, window=None, nums=None):
+    """Write lines of file to the binary output in reversed order
+
+    Raise ValueError if the file can not be mapped.
+    """
+    with open_mmap(path) as mapped:
+        for block in iter_reversed_blocks(mapped, window=window, nums=nums):
+            output.write(block)
+
+
+class Inotify(object):
+    """A minimal inotify wrapper with ctypes, only for Linux"""
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(),
+                          'inotify_add_watch {} failed'.format(path))
+        return wd
+
+    def read(self, timeout=None):
+        """Wait and return events as a list of (wd, mask, name)"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FollowedFile(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.fp = None
+        self.ino = None
+        self.position = 0
+
+    def open(self, nums=None, window=None):
+        """Open the file, return the last nums lines of it
+
+        If nums is None, read from the beginning of file. Only regular files
+        are followed, e.g. opening a FIFO would block until it has a writer.
+        """
+        try:
+            fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError as e:
+            LOG.debug('%s', e)
+            return b''
+        file_stat = os.fstat(fd)
+        if not stat.S_ISREG(file_stat.st_mode):
+            os.close(fd)
+            LOG.debug('%s is not a regular file', self.path)
+            return b''
+        self.fp = os.fdopen(fd, 'rb')
+        self.ino = (file_stat.st_dev, file_stat.st_ino)
+        self.position = 0
+        if nums is None or not file_stat.st_size:
+            return b''
+        self.position = file_stat.st_size
+        with mmap.mmap(self.fp.fileno(), 0,
+                       access=mmap.ACCESS_READ) as mapped:
+            offset = find_tail_offset(mapped, nums, window=window)
+            return mapped[offset:self.position]
+
+    def read(self, size=None):
+        """Read at most size bytes of the appended data
+
+        Param:
+            size: default is READ_SIZE
+        """
+        if not self.fp:
+            return b''
+        file_size = os.fstat(self.fp.fileno()).st_size
+        if file_size < self.position:
+            LOG.warning('%s: file truncated', self.path)
+            self.position = 0
+        self.fp.seek(self.position)
+        data = self.fp.read(size or READ_SIZE)
+        self.position += len(data)
+        return data
+
+    def is_replaced(self):
+        """Return True if the path is rotated to a new file"""
+        try:
+            file_stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (file_stat.st_dev, file_stat.st_ino) != self.ino
+
+    def close(self):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+
+
+class Follower(object):
+    """Print the appended lines of files like tail -F
+
+    Files are watched by inotify on Linux and polled on other systems.
+    Rotated and truncated files are followed by name.
+    """
+    FILE_EVENTS = Inotify.IN_MODIFY | Inotify.IN_ATTRIB | \
+        Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF
+    DIR_EVENTS = Inotify.IN_CREATE | Inotify.IN_MOVED_TO
+
+    def __init__(self, paths, output, interval=1.0):
+        self.files = [FollowedFile(path) for path in paths]
+        self.output = output
+        self.interval = interval
+        self._last_file = None
+        self._inotify = None
+        self._wds = {}
+        self._next_check = None
+
+    def _write(self, followed, data):
+        if not data:
+            return
+        if len(self.files) > 1 and self._last_file is not followed:
+            self.output.write('{}==> {} <==\n'.format(
+                self._last_file and '\n' or '',
+                followed.path).encode('utf-8'))
+        self._last_file = followed
+        self.output.write(data)
+
+    def _watch(self, followed):
+        if not self._inotify or not followed.fp:
+            return
+        try:
+            wd = self._inotify.add_watch(followed.path, self.FILE_EVENTS)
+            self._wds[wd] = [followed]
+        except OSError as e:
+            LOG.warning('%s', e)
+
+    def _write_appended(self, followed):
+        while True:
+            data = followed.read()
+            if not data:
+                break
+            self._write(followed, data)
+
+    def _reopen(self, followed):
+        LOG.warning('%s has been replaced; following new file',
+                    followed.path)
+        self._write_appended(followed)
+        followed.close()
+        self._write(followed, followed.open())
+        self._watch(followed)
+
+    def _check(self, followed):
+        if not followed.fp:
+            self._write(followed, followed.open())
+            self._watch(followed)
+        elif followed.is_replaced():
+            self._reopen(followed)
+        else:
+            self._write_appended(followed)
+
+    def _setup_inotify(self):
+        try:
+            self._inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            LOG.debug('inotify is not supported, poll files: %s', e)
+            return
+        for followed in self.files:
+            self._watch(followed)
+            dir_path = os.path.dirname(os.path.abspath(followed.path))
+            try:
+                wd = self._inotify.add_watch(dir_path, self.DIR_EVENTS)
+                self._wds.setdefault(wd, []).append(followed)
+            except OSError as e:
+                LOG.warning('%s', e)
+
+    def print_tail(self, nums=10, window=None):
+        """Print the last nums lines of files"""
+        for followed in self.files:
+            self._write(followed, followed.open(nums=nums, window=window))
+            if not followed.fp:
+                LOG.warning('cannot open %s for reading', followed.path)
+        self.output.flush()
+
+    def follow(self):
+        """Print the appended lines of files until interrupted"""
+        self._setup_inotify()
+        try:
+            while True:
+                self.wait()
+                self.output.flush()
+        finally:
+            for followed in self.files:
+                followed.close()
+            if self._inotify:
+                self._inotify.close()
+
+    def wait(self):
+        if not self._inotify:
+            time.sleep(self.interval)
+            for followed in self.files:
+                self._check(followed)
+            return
+        # NOTE: also check all files periodically, inotify does not
+        # report the changes made by other hosts of NFS, and a busy file
+        # should not delay the check of others
+        now = time.time()
+        if self._next_check is None:
+            self._next_check = now + self.interval * CHECK_INTERVALS
+        events = self._inotify.read(timeout=max(0, self._next_check - now))
+        if time.time() >= self._next_check:
+            self._next_check = time.time() + self.interval * CHECK_INTERVALS
+            for followed in self.files:
+                self._check(followed)
+            return
+        changed = []
+        for wd, _, name in events:
+            for followed in self._wds.get(wd, []):
+                if name and name != os.path.basename(followed.path):
+                    continue
+                if followed not in changed:
+                    changed.append(followed)
+        for followed in changed:
+            self._check(followed)
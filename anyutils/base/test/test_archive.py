@@ -0,0 +1,344 @@
+import io
+import os
+import random
+import shutil
+import struct
+import subprocess
+import tarfile
+import tempfile
+import unittest
+import zipfile
+import zlib
+from unittest import mock
+
+from anyutils.base import archive
+
+
+def make_tree(root, files):
+    """Create files of {relative path: bytes}, dirs end with /"""
+    for name, data in files.items():
+        path = os.path.join(root, name)
+        if name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def iter_local_headers(data):
+    """Yield (name, flags, method, crc, compress_size, file_size) of local
+    headers like a streaming reader"""
+    for info in zipfile.ZipFile(io.BytesIO(data)).infolist():
+        header = archive.STRUCT_LOCAL_HEADER.unpack_from(data,
+                                                         info.header_offset)
+        name_start = info.header_offset + archive.STRUCT_LOCAL_HEADER.size
+        name = data[name_start:name_start + header[-2]].decode()
+        yield (name, header[2], header[3], header[6], header[7], header[8])
+
+
+class TestCrc32Combine(unittest.TestCase):
+
+    def test_crc32_combine(self):
+        rand = random.Random(0)
+        for length1, length2 in [(0, 0), (0, 10), (10, 0), (1, 1),
+                                 (100, 7), (1000, 4096), (65536, 12345)]:
+            data1 = bytes(rand.getrandbits(8) for _ in range(length1))
+            data2 = bytes(rand.getrandbits(8) for _ in range(length2))
+            self.assertEqual(
+                archive.crc32_combine(zlib.crc32(data1), zlib.crc32(data2),
+                                      length2),
+                zlib.crc32(data1 + data2), (length1, length2))
+
+
+class TestWriteZip(unittest.TestCase):
+    FILES = {
+        'empty.txt': b'',
+        'small.txt': b'hello world\n',
+        'blocks.txt': b''.join(b'line %d\n' % i for i in range(5000)),
+        'photo.jpg': os.urandom(3000),
+        'sub/dir/a.bin': os.urandom(100),
+        'empty_dir/': None,
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_dir, 'src')
+        make_tree(self.src, self.FILES)
+        self.members = list(archive.iter_members(self.src))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_zip(self, **kwargs):
+        output = io.BytesIO()
+        archive.write_zip(output, self.members, **kwargs)
+        return output.getvalue()
+
+    def check_zip(self, data):
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            for name, content in self.FILES.items():
+                arcname = 'src/' + name
+                if content is None:
+                    self.assertTrue(zip_file.getinfo(arcname).is_dir())
+                else:
+                    self.assertEqual(zip_file.read(arcname), content)
+            return zip_file.infolist()
+
+    def test_round_trip(self):
+        for level in (0, 1, 6, 9):
+            for block_size in (None, 1000, 4096):
+                data = self.write_zip(level=level, workers=3,
+                                      block_size=block_size)
+                infos = self.check_zip(data)
+                methods = {info.filename: info.compress_type
+                           for info in infos}
+                self.assertEqual(methods['src/photo.jpg'],
+                                 archive.ZIP_STORED)
+                self.assertEqual(methods['src/blocks.txt'],
+                                 level and archive.ZIP_DEFLATED or
+                                 archive.ZIP_STORED)
+
+    def test_stored_local_headers(self):
+        for level in (0, 6):
+            data = self.write_zip(level=level, block_size=1000)
+            infos = {info.filename: info for info in self.check_zip(data)}
+            for name, flags, method, crc, compress_size, file_size in \
+                    iter_local_headers(data):
+                info = infos[name]
+                if method != archive.ZIP_STORED:
+                    self.assertTrue(flags & archive.FLAG_DATA_DESCRIPTOR)
+                    continue
+                # streaming readers need the sizes of stored members
+                self.assertFalse(flags & archive.FLAG_DATA_DESCRIPTOR, name)
+                self.assertEqual((crc, compress_size, file_size),
+                                 (info.CRC, info.file_size,
+                                  info.file_size), name)
+
+    def test_zip64(self):
+        with mock.patch.object(archive, 'ZIP64_LIMIT', 10):
+            for level in (0, 6):
+                data = self.write_zip(level=level, block_size=1000)
+                infos = self.check_zip(data)
+                for info in infos:
+                    if info.file_size >= 10:
+                        # zip64 extra field in the local header
+                        self.assertIn(b'\x01\x00\x10\x00', data)
+                        self.assertEqual(
+                            archive.STRUCT_LOCAL_HEADER.unpack_from(
+                                data, info.header_offset)[7], 0xFFFFFFFF)
+
+    def test_changed_while_archiving(self):
+        path = os.path.join(self.src, 'photo.jpg')
+        crc32 = archive._file_crc32
+
+        def _file_crc32(*args):
+            crc = crc32(*args)
+            if args[0] == path:
+                with open(path, 'r+b') as f:
+                    f.write(b'changed')
+            return crc
+
+        with mock.patch.object(archive, '_file_crc32', _file_crc32):
+            self.assertRaises(OSError, self.write_zip, workers=1)
+
+
+class TestArchiveDir(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_dir, 'src')
+        make_tree(self.src, {'a/b/c.txt': b'c', 'a/d.txt': b'd',
+                             'empty/': None})
+        os.chmod(os.path.join(self.src, 'a'), 0o750)
+        os.utime(os.path.join(self.src, 'a'), (1000000, 1000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_invalid_level(self):
+        for fmt, level in [('zip', 10), ('zip', -1), ('tar.gz', 12),
+                           ('tar.xz', 10), ('tar.zst', 0), ('tar.zst', 20)]:
+            output = os.path.join(self.tmp_dir, 'out.' + fmt)
+            self.assertRaises(ValueError, archive.archive_dir, self.src,
+                              output=output, fmt=fmt, level=level)
+            self.assertFalse(os.path.exists(output))
+        archive.check_level('tar.zst', 19)
+        archive.check_level('zip', 0)
+
+    def test_tar_dirs(self):
+        for fmt in ('tar.gz', 'tar.xz', 'tar.zst'):
+            if fmt == 'tar.zst' and not shutil.which('zstd'):
+                continue
+            output = os.path.join(self.tmp_dir, 'out.' + fmt)
+            archive.archive_dir(self.src, output=output, fmt=fmt, level=1)
+            if fmt == 'tar.zst':
+                fileobj = io.BytesIO(subprocess.check_output(
+                    ['zstd', '-d', '-c', output]))
+            else:
+                fileobj = open(output, 'rb')
+            with fileobj, tarfile.open(fileobj=fileobj) as tar:
+                members = {member.name: member for member in tar}
+            self.assertEqual(sorted(members), [
+                'src', 'src/a', 'src/a/b', 'src/a/b/c.txt', 'src/a/d.txt',
+                'src/empty'])
+            self.assertTrue(members['src/a'].isdir())
+            self.assertEqual(members['src/a'].mode, 0o750)
+            self.assertEqual(members['src/a'].mtime, 1000000)
+
+    def test_zip_dirs(self):
+        output = archive.archive_dir(self.src, fmt='zip')
+        with zipfile.ZipFile(output) as zip_file:
+            self.assertEqual(sorted(zip_file.namelist()), [
+                'src/a/b/c.txt', 'src/a/d.txt', 'src/empty/'])
+
+
+class TestUpdateZip(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_dir, 'src')
+        make_tree(self.src, {
+            'same.txt': b'same' * 1000,
+            'photo.jpg': os.urandom(2000),
+            'changed.txt': b'old' * 1000,
+        })
+        for name in os.listdir(self.src):
+            os.utime(os.path.join(self.src, name), (1000000, 1000000))
+        self.output = archive.archive_dir(self.src, fmt='zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_raw(self, path):
+        """Return {name: (CRC, compressed data)}"""
+        with open(path, 'rb') as f, zipfile.ZipFile(path) as zip_file:
+            fd = f.fileno()
+            return {info.filename: (info.CRC,
+                                    b''.join(archive._read_raw(fd, info)))
+                    for info in zip_file.infolist()}
+
+    def test_update(self):
+        previous = self.read_raw(self.output)
+        with open(os.path.join(self.src, 'changed.txt'), 'wb') as f:
+            f.write(b'new' * 1000)
+        compressed = []
+        compress_block = archive._compress_block
+
+        def _compress_block(path, *args):
+            compressed.append(os.path.basename(path))
+            return compress_block(path, *args)
+
+        with mock.patch.object(archive, '_compress_block', _compress_block):
+            archive.archive_dir(self.src, update=self.output)
+        self.assertEqual(compressed, ['changed.txt'])
+        current = self.read_raw(self.output)
+        for name in ('src/same.txt', 'src/photo.jpg'):
+            self.assertEqual(current[name], previous[name])
+        self.assertNotEqual(current['src/changed.txt'],
+                            previous['src/changed.txt'])
+        with zipfile.ZipFile(self.output) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.read('src/changed.txt'), b'new' * 1000)
+        # the raw copied stored members have no data descriptors either
+        with open(self.output, 'rb') as f:
+            data = f.read()
+        for name, flags, method, _, _, _ in iter_local_headers(data):
+            if method == archive.ZIP_STORED:
+                self.assertFalse(flags & archive.FLAG_DATA_DESCRIPTOR)
+
+    def test_update_changed_level(self):
+        archive.archive_dir(self.src, update=self.output, level=0)
+        with zipfile.ZipFile(self.output) as zip_file:
+            self.assertEqual({info.compress_type
+                              for info in zip_file.infolist()},
+                             {archive.ZIP_STORED})
+
+    def test_update_bad_zip(self):
+        with open(self.output, 'wb') as f:
+            f.write(b'not a zip file')
+        fds = os.listdir('/proc/self/fd')
+        self.assertRaises(zipfile.BadZipFile, archive.write_zip,
+                          io.BytesIO(), list(archive.iter_members(self.src)),
+                          previous=self.output)
+        self.assertEqual(os.listdir('/proc/self/fd'), fds)
+
+
+class TestExtractZip(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'test.zip')
+        self.dest = os.path.join(self.tmp_dir, 'dest')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_zip(self, members):
+        """Write members of [(name, data, mode)]"""
+        with zipfile.ZipFile(self.path, 'w') as zip_file:
+            for name, data, mode in members:
+                info = zipfile.ZipInfo(name, (2020, 1, 2, 3, 4, 6))
+                info.create_system = 3
+                info.external_attr = mode << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                zip_file.writestr(info, data)
+
+    def test_extract(self):
+        members = [('a.txt', b'a' * 1000, 0o100644),
+                   ('dir/b.sh', b'#!/bin/sh\n', 0o100755),
+                   ('dir/sub/', b'', 0o40700)]
+        self.write_zip(members)
+        for workers in (1, 4):
+            shutil.rmtree(self.dest, ignore_errors=True)
+            self.assertEqual(archive.extract_zip(self.path, self.dest,
+                                                 workers=workers), [])
+            for name, data, mode in members:
+                path = os.path.join(self.dest, name)
+                if not name.endswith('/'):
+                    with open(path, 'rb') as f:
+                        self.assertEqual(f.read(), data)
+                self.assertEqual(os.stat(path).st_mode & 0o7777,
+                                 mode & 0o777)
+
+    def test_mode_bits(self):
+        self.write_zip([('setuid', b'x', 0o104755),
+                        ('setgid', b'x', 0o102755),
+                        ('sticky/', b'', 0o41777)])
+        self.assertEqual(archive.extract_zip(self.path, self.dest), [])
+        for name, mode in [('setuid', 0o755), ('setgid', 0o755),
+                           ('sticky', 0o777)]:
+            self.assertEqual(
+                os.stat(os.path.join(self.dest, name)).st_mode & 0o7777,
+                mode, name)
+
+    def test_path_traversal(self):
+        names = ['../evil.txt', 'a/../../evil.txt', '/abs/evil.txt',
+                 '..\\evil.txt', 'c:/evil.txt']
+        self.write_zip([(name, b'evil', 0o100644) for name in names] +
+                       [('safe/./ok.txt', b'ok', 0o100644)])
+        errors = archive.extract_zip(self.path, self.dest)
+        self.assertEqual(sorted(name for name, _ in errors), sorted(names))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir,
+                                                     'evil.txt')))
+        with open(os.path.join(self.dest, 'safe', 'ok.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'ok')
+
+    def test_bad_crc(self):
+        self.write_zip([('a.txt', b'a' * 1000, 0o100644)])
+        with open(self.path, 'r+b') as f:
+            data = bytearray(f.read())
+            # corrupt the crc32 of the local header and central directory
+            index = data.index(struct.pack('<I', zlib.crc32(b'a' * 1000)))
+            data[index] ^= 0xFF
+            index = data.index(struct.pack('<I', zlib.crc32(b'a' * 1000)))
+            data[index] ^= 0xFF
+            f.seek(0)
+            f.write(data)
+        errors = archive.extract_zip(self.path, self.dest)
+        self.assertEqual([name for name, _ in errors], ['a.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+from anyutils.base import checksum
+from anyutils.base import code
+
+
+def make_args(files, **kwargs):
+    args = argparse.Namespace(
+        files=files, sha1=False, algorithms=None, workers=None, silence=True,
+        buffer=None, no_mmap=False, bench=False, no_cache=True,
+        cache_size=None, verify_cache=0, tree=False, chunk_size=None,
+        checkpoint=False)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+def md5sum(args):
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        result = code.Md5Sum()(args)
+    return result, stdout.getvalue().splitlines()
+
+
+class TestChecksum(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.contents = {}
+        for name, data in [('a.txt', b'a' * 1000), ('b.txt', b'b\n'),
+                           ('sub/c.log', b''), ('sub/d.txt', b'd' * 70000)]:
+            self.make_file(name, data)
+
+    def make_file(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.contents[path] = data
+        return path
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def test_find_files(self):
+        files, missing = checksum.find_files(
+            [self.path('*.txt'), self.path('sub'), self.path('a.txt'),
+             self.path('nope'), self.path('*.nope')])
+        self.assertEqual(files, sorted([self.path('a.txt'),
+                                        self.path('b.txt'),
+                                        self.path('sub/c.log'),
+                                        self.path('sub/d.txt')]))
+        self.assertEqual(missing, [self.path('nope'), self.path('*.nope')])
+
+    def test_hash_files(self):
+        paths = sorted(self.contents) + [self.path('nope')]
+        results = list(checksum.hash_files(paths,
+                                           algorithms=['md5', 'sha256'],
+                                           workers=2))
+        self.assertEqual([result[0] for result in results], paths)
+        for path, digests, error in results[:-1]:
+            self.assertIsNone(error)
+            self.assertEqual(digests, {
+                'md5': hashlib.md5(self.contents[path]).hexdigest(),
+                'sha256': hashlib.sha256(self.contents[path]).hexdigest()})
+        self.assertIsNone(results[-1][1])
+        self.assertTrue(results[-1][2])
+
+    def test_hash_file_mmap(self):
+        path = self.make_file('big', os.urandom(1024 * 1024 + 123))
+        expected = {name: hashlib.new(name, self.contents[path]).hexdigest()
+                    for name in checksum.ALGORITHMS}
+        for buffer_size in [None, 4096, 1000, 10 * 1024 * 1024]:
+            for use_mmap in [True, False]:
+                sizes = []
+                self.assertEqual(
+                    checksum.hash_file(path, algorithms=checksum.ALGORITHMS,
+                                       buffer_size=buffer_size,
+                                       use_mmap=use_mmap,
+                                       callback=sizes.append),
+                    expected)
+                self.assertEqual(sum(sizes), len(self.contents[path]))
+        # empty files can not be mapped
+        self.assertEqual(
+            checksum.hash_file(self.path('sub/c.log'), use_mmap=True),
+            {'md5': hashlib.md5(b'').hexdigest()})
+
+    def test_choose_buffer_size(self):
+        self.assertEqual(checksum.choose_buffer_size(0, 4096),
+                         checksum.MIN_BUFFER_SIZE)
+        self.assertEqual(checksum.choose_buffer_size(1 << 40, 4096),
+                         checksum.MAX_BUFFER_SIZE)
+        self.assertEqual(checksum.choose_buffer_size(64 * 100000, 4096),
+                         102400)
+
+    def test_format_line(self):
+        self.assertEqual(checksum.format_line('a b', 'md5', 'x'), 'x  a b')
+        self.assertEqual(checksum.format_line('a', 'sha256', 'x', tag=True),
+                         'SHA256 (a) = x')
+        self.assertEqual(checksum.format_line('a\nb\\', 'md5', 'x'),
+                         '\\x  a\\nb\\\\')
+        self.assertEqual(checksum.format_line('a', 'md5', 'x', tree=True),
+                         'MD5-TREE (a) = x')
+
+    def test_md5sum_files(self):
+        result, lines = md5sum(make_args([self.path('*.txt'),
+                                          self.path('sub')]))
+        self.assertEqual(result, 0)
+        self.assertEqual(lines, [
+            '{}  {}'.format(hashlib.md5(self.contents[path]).hexdigest(),
+                            path)
+            for path in sorted(self.contents)])
+
+    def test_md5sum_one_glob(self):
+        path = self.make_file('e[1].txt', b'e')
+        result, lines = md5sum(make_args([self.path('*.txt')]))
+        self.assertEqual(result, 0)
+        self.assertEqual(len(lines), 3)
+        self.assertIn('{}  {}'.format(hashlib.md5(b'e').hexdigest(), path),
+                      lines)
+        # an existing file is not a glob
+        result, lines = md5sum(make_args([path]))
+        self.assertEqual(lines,
+                         ['md5sum {}'.format(hashlib.md5(b'e').hexdigest())])
+
+    def test_md5sum_cache(self):
+        cache_home = os.path.join(self.tmp_dir, 'cache')
+        args = make_args([self.path('*.txt')], no_cache=False)
+        with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': cache_home}):
+            expected = md5sum(args)
+            self.assertEqual(expected[0], 0)
+            self.assertTrue(os.path.exists(
+                os.path.join(cache_home, 'anyutils', 'checksum.db')))
+            with mock.patch.object(checksum, 'hash_files',
+                                   return_value=iter([])) as hash_files:
+                self.assertEqual(md5sum(args), expected)
+            self.assertEqual(hash_files.call_args[0][0], [])
+
+    def test_md5sum_cache_dir_not_writable(self):
+        # the cache dir can not be created under a file
+        cache_home = self.path('a.txt')
+        with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': cache_home}):
+            result, lines = md5sum(make_args([self.path('b.txt')],
+                                             no_cache=False, sha1=True))
+        self.assertFalse(result)
+        self.assertEqual(lines[0], 'md5sum {}'.format(
+            hashlib.md5(b'b\n').hexdigest()))
+
+    def test_md5sum_files_tag(self):
+        result, lines = md5sum(make_args(
+            [self.path('a.txt'), self.path('nope')],
+            algorithms='md5,blake2'))
+        self.assertEqual(result, 1)
+        data = self.contents[self.path('a.txt')]
+        self.assertEqual(lines, [
+            'MD5 ({}) = {}'.format(self.path('a.txt'),
+                                   hashlib.md5(data).hexdigest()),
+            'BLAKE2b ({}) = {}'.format(self.path('a.txt'),
+                                       hashlib.blake2b(data).hexdigest())])
+
+
+class TestTreeChecksum(unittest.TestCase):
+    CHUNK_SIZE = 1000
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        patcher = mock.patch.dict('os.environ', {
+            'XDG_CACHE_HOME': os.path.join(self.tmp_dir, 'cache')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.tmp_dir, 'data')
+        self.data = os.urandom(self.CHUNK_SIZE * 3 + 10)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def expected(self, name='md5'):
+        hasher = hashlib.new(name)
+        for offset in range(0, len(self.data), self.CHUNK_SIZE):
+            hasher.update(hashlib.new(
+                name, self.data[offset:offset + self.CHUNK_SIZE]).digest())
+        return hasher.hexdigest()
+
+    def hash_tree(self, **kwargs):
+        return checksum.hash_file_tree(
+            self.path, algorithms=['md5', 'sha1'],
+            chunk_size=self.CHUNK_SIZE, workers=1, **kwargs)
+
+    def checkpoint(self):
+        return checksum.Checkpoint(self.path, os.stat(self.path),
+                                   ['md5', 'sha1'], self.CHUNK_SIZE)
+
+    def test_hash_file_tree(self):
+        self.assertEqual(self.hash_tree(),
+                         {'md5': self.expected(),
+                          'sha1': self.expected('sha1')})
+        # the cache dir is not used without checkpoint
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'cache')))
+
+    def test_checkpoint_saved_when_interrupted(self):
+        hashed = []
+
+        def _callback(size):
+            hashed.append(size)
+            if len(hashed) == 2:
+                raise KeyboardInterrupt()
+
+        self.assertRaises(KeyboardInterrupt, self.hash_tree,
+                          checkpoint=True, callback=_callback)
+        self.assertEqual(len(self.checkpoint().load()), 2)
+        self.assertEqual(self.hash_tree(checkpoint=True),
+                         {'md5': self.expected(),
+                          'sha1': self.expected('sha1')})
+        self.assertFalse(os.path.exists(self.checkpoint().path))
+
+    def test_resume_from_checkpoint(self):
+        state = self.checkpoint()
+        state.chunks = {0: {'md5': '00' * 16, 'sha1': '00' * 20}}
+        state.save()
+        hashed = []
+        digests = self.hash_tree(checkpoint=True, callback=hashed.append)
+        # chunk 0 is not hashed again
+        self.assertEqual(sorted(hashed), [10, 1000, 1000])
+        self.assertNotEqual(digests['md5'], self.expected())
+        self.assertFalse(os.path.exists(state.path))
+
+    def test_checkpoint_of_changed_file(self):
+        state = self.checkpoint()
+        state.chunks = {0: {'md5': '00' * 16, 'sha1': '00' * 20}}
+        state.save()
+        with open(self.path, 'ab') as f:
+            f.write(b'x')
+        self.data += b'x'
+        self.assertEqual(self.hash_tree(checkpoint=True)['md5'],
+                         self.expected())
+
+    def test_checkpoint_cache_dir_not_usable(self):
+        cache_home = os.path.join(self.tmp_dir, 'file')
+        open(cache_home, 'w').close()
+        with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': cache_home}):
+            self.assertEqual(self.hash_tree(checkpoint=True)['md5'],
+                             self.expected())
+
+    def test_md5sum_tree_error(self):
+        other = os.path.join(self.tmp_dir, 'other')
+        with open(other, 'wb') as f:
+            f.write(b'other')
+        hash_file_tree = checksum.hash_file_tree
+
+        def _hash_file_tree(path, **kwargs):
+            if path == self.path:
+                raise PermissionError(13, 'Permission denied', path)
+            return hash_file_tree(path, **kwargs)
+
+        with mock.patch.object(checksum, 'hash_file_tree',
+                               side_effect=_hash_file_tree):
+            result, lines = md5sum(make_args([self.path, other], tree=True,
+                                             chunk_size=self.CHUNK_SIZE))
+        self.assertEqual(result, 1)
+        self.assertEqual(lines, ['MD5-TREE ({}) = {}'.format(
+            other, hashlib.md5(hashlib.md5(b'other').digest()).hexdigest())])
+
+
+class FalsyBar(object):
+    """Like tqdm, a bar with total=0 is falsy"""
+    bars = []
+
+    def __init__(self, total=None, **kwargs):
+        self.total = total
+        self.updates = []
+        self.closed = False
+        self.bars.append(self)
+
+    def __len__(self):
+        return self.total
+
+    def update(self, size):
+        self.updates.append(size)
+
+    def close(self):
+        self.closed = True
+
+
+class TestMd5SumProgress(unittest.TestCase):
+
+    def test_empty_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'empty')
+        open(path, 'w').close()
+        FalsyBar.bars = []
+        with mock.patch.dict('sys.modules',
+                             {'tqdm': types.SimpleNamespace(tqdm=FalsyBar)}), \
+                mock.patch.object(code.progressbar, 'is_support_tqdm', True):
+            result, lines = md5sum(make_args([path], silence=False))
+        self.assertFalse(result)
+        self.assertEqual(lines,
+                         ['md5sum {}'.format(hashlib.md5(b'').hexdigest())])
+        self.assertEqual(len(FalsyBar.bars), 1)
+        self.assertTrue(FalsyBar.bars[0].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import argparse
+import configparser
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from anycode.common import confparser
+from anyutils.base import confeditor
+from anyutils.base import confindex
+
+CONFIG = """# comment
+[DEFAULT]
+base = /opt
+percent = 50%%
+
+[app]
+Name = demo
+path = %(base)s/app
+rate = 10%%
+multi = line1
+    line2
+  # indented comment
+    line3
+; comment between lines
+    line4
+blank = first
+
+    after blank
+
+
+empty =
+flag = yes
+    # trailing comment
+
+[db]
+url = postgres://localhost
+text = café
+"""
+
+
+class TestConfigIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'app.conf')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(CONFIG)
+        self.parser = confparser.ConfigParserWrapper()
+        with open(self.path, encoding='utf-8') as f:
+            self.parser.read(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def conf_get(self, section, option):
+        stdout = io.StringIO()
+        with open(self.path, encoding='utf-8') as f, \
+                contextlib.redirect_stdout(stdout):
+            result = confeditor.ConfigGet()(argparse.Namespace(
+                file=f, section=section, option=option))
+        return result, stdout.getvalue()
+
+    def test_get_raw(self):
+        index = confindex.ConfigIndex(self.path, cache=False)
+        for section in self.parser.sections():
+            for option, value in self.parser.options(
+                    section, ignore_default=True).items():
+                self.assertEqual(index.get_raw(section, option), value,
+                                 (section, option))
+        self.assertEqual(index.get_raw('db', 'base'), '/opt')
+        self.assertRaises(KeyError, index.get_raw, 'db', 'missing')
+        self.assertEqual(index.get_raw('DEFAULT', 'base'), '/opt')
+        self.assertRaises(configparser.NoSectionError, index.get_raw,
+                          'missing', 'base')
+
+    def test_conf_get(self):
+        for section in self.parser.sections():
+            for option, value in self.parser.options(section).items():
+                self.assertEqual(self.conf_get(section, option),
+                                 (None, '{}\n'.format(value)),
+                                 (section, option))
+        self.assertEqual(self.conf_get('app', 'rate'), (None, '10%\n'))
+        self.assertEqual(self.conf_get('app', 'NAME'), (None, 'demo\n'))
+        self.assertEqual(self.conf_get('app', 'missing')[0], 1)
+
+    def test_conf_get_missing_section(self):
+        # the same result with the index and with the full parser
+        with mock.patch.object(confeditor, 'is_indexable',
+                               return_value=False):
+            self.assertEqual(self.conf_get('missing', 'base'), (1, ''))
+        self.assertEqual(self.conf_get('missing', 'base'), (1, ''))
+
+    def test_read_sections(self):
+        for section in self.parser.sections():
+            parser = confeditor.read_sections(self.path, section)
+            self.assertEqual(parser.options(section),
+                             self.parser.options(section))
+        self.assertIsNone(confeditor.read_sections(self.path, 'missing'))
+
+    def test_invalid_utf8(self):
+        with open(self.path, 'ab') as f:
+            f.write(b'[bad]\nkey = \xff\xfe\n')
+        index = confindex.ConfigIndex(self.path, cache=False)
+        self.assertEqual(index.get_raw('bad', 'key'), '��')
+        self.assertIn('key = ��', index.read_sections('bad'))
+
+    def test_cache(self):
+        index = confindex.ConfigIndex(self.path)
+        sections = index.load().sections
+        self.assertTrue(os.path.exists(confindex.get_index_path(self.path)))
+        self.assertEqual(confindex.ConfigIndex(self.path).load().sections,
+                         sections)
+        with open(self.path, 'a') as f:
+            f.write('[new]\nkey = value\n')
+        self.assertEqual(
+            confindex.ConfigIndex(self.path).get_raw('new', 'key'), 'value')
+
+    def test_cache_dir_not_usable(self):
+        cache_home = os.path.join(self.tmp_dir, 'file')
+        open(cache_home, 'w').close()
+        with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': cache_home}):
+            self.assertEqual(
+                confindex.ConfigIndex(self.path).get_raw('app', 'name'),
+                'demo')
+
+
+if __name__ == '__main__':
+    unittest.main()
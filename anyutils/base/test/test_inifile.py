@@ -0,0 +1,145 @@
+import argparse
+import configparser
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from anyutils.base import confeditor
+from anyutils.base import inifile
+
+CONFIG = """# head comment
+[DEFAULT]
+base = /opt
+
+[app]
+Name = demo
+multi = line1
+    line2
+  # kept comment
+    line3
+port = 80
+
+[db]
+url = postgres://localhost
+"""
+
+
+class TestSetOptions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'app.conf')
+        with open(self.path, 'w') as f:
+            f.write(CONFIG)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, path=None):
+        with open(path or self.path) as f:
+            return f.read()
+
+    def set_options(self, *edits, path=None):
+        inifile.set_options(path or self.path,
+                            inifile.parse_edits(list(edits)))
+
+    def test_parse_edits(self):
+        self.assertEqual(
+            inifile.parse_edits(['# comment', '', 'a.b.c = 1', 'x.y=2',
+                                 'a.b.d=']),
+            {'a.b': {'c': '1', 'd': ''}, 'x': {'y': '2'}})
+        for edit in ['novalue', '.a=1', 'a.=1', 'a=1']:
+            self.assertRaises(ValueError, inifile.parse_edit, edit)
+
+    def test_set_options(self):
+        self.set_options('app.name=new', 'app.multi=single', 'app.new=1',
+                         'db.url=mysql://host', 'cache.size=10')
+        self.assertEqual(self.read(), """# head comment
+[DEFAULT]
+base = /opt
+
+[app]
+Name = new
+multi = single
+  # kept comment
+port = 80
+new = 1
+
+[db]
+url = mysql://host
+
+[cache]
+size = 10
+""")
+        parser = configparser.ConfigParser()
+        parser.read(self.path)
+        self.assertEqual(parser['app']['multi'], 'single')
+        self.assertEqual(parser['app']['port'], '80')
+
+    def test_multi_line_value(self):
+        self.set_options('db.url=a')
+        inifile.set_options(self.path, {'db': {'url': 'a\nb'}})
+        parser = configparser.ConfigParser()
+        parser.read(self.path)
+        self.assertEqual(parser['db']['url'], 'a\nb')
+
+    def test_keep_mode(self):
+        os.chmod(self.path, 0o640)
+        self.set_options('app.port=81')
+        self.assertEqual(os.stat(self.path).st_mode & 0o7777, 0o640)
+
+    def test_symlink(self):
+        link = os.path.join(self.tmp_dir, 'link.conf')
+        os.symlink(self.path, link)
+        self.set_options('app.port=81', path=link)
+        self.assertTrue(os.path.islink(link))
+        self.assertIn('port = 81', self.read())
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['app.conf', 'link.conf'])
+
+    @unittest.skipIf(os.geteuid() != 0, 'chown requires root')
+    def test_keep_owner(self):
+        os.chown(self.path, 12345, 23456)
+        self.set_options('app.port=81')
+        file_stat = os.stat(self.path)
+        self.assertEqual((file_stat.st_uid, file_stat.st_gid),
+                         (12345, 23456))
+
+    def test_rewrite_if_chown_failed(self):
+        ino = os.stat(self.path).st_ino
+        with mock.patch('os.chown', side_effect=PermissionError(1, 'EPERM')):
+            self.set_options('app.port=81')
+        self.assertEqual(os.stat(self.path).st_ino, ino)
+        self.assertIn('port = 81', self.read())
+        self.assertEqual(os.listdir(self.tmp_dir), ['app.conf'])
+
+
+class TestDiff(unittest.TestCase):
+
+    def test_diff_sections(self):
+        self.assertEqual(inifile.diff_sections(
+            {'a': {'x': '1', 'y': '2'}, 'b': {'z': '3'}},
+            {'a': {'x': '1', 'y': '3', 'w': '4'}, 'c': {'v': '5'}}),
+            [('a', [('y', '2', '3'), ('w', None, '4')]),
+             ('b', [('z', '3', None)]),
+             ('c', [('v', None, '5')])])
+        self.assertEqual(inifile.diff_sections({'a': {'x': '1'}},
+                                               {'a': {'x': '1'}}), [])
+
+    def test_conf_diff(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            result = confeditor.ConfigDiff()(argparse.Namespace(
+                file1=io.StringIO(CONFIG),
+                file2=io.StringIO(CONFIG.replace('port = 80', 'port = 81'))))
+        self.assertEqual(result, 1)
+        self.assertEqual(stdout.getvalue(),
+                         '[app]\n- port = 80\n+ port = 81\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import math
+import unittest
+
+from anyutils.base import jsonbackend
+from anyutils.base import jsonpath
+
+DOCUMENTS = [
+    '123456789012345678901234567890',
+    '-9223372036854775809',
+    '[18446744073709551616, 1, -1]',
+    '{"id": 12345678901234567890123, "name": "x"}',
+    '[NaN, Infinity, -Infinity]',
+    '[1e400, -1e400, 1e-400]',
+    '[0.1, 1.7976931348623157e308, 5e-324, -0.0, 1E+2]',
+    '{"a": 1, "a": 2}',
+    '"\\u00e9\\ud83d\\ude00 \\" \\\\ /"',
+    '{"nested": [{"x": [true, false, null]}, {}], "s": "\u4e2d"}',
+    '  [] ',
+]
+INVALID_DOCUMENTS = ['', '{', '[1,]', '{"a" 1}', 'nan', "{'a': 1}",
+                     '[1] x']
+
+
+def normalize(value):
+    """Make NaN comparable and keep the types of numbers"""
+    if isinstance(value, float) and math.isnan(value):
+        return 'NaN'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (type(value).__name__, repr(value))
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    return value
+
+
+def get_backends():
+    return [backend_cls() for backend_cls in jsonbackend.BACKENDS
+            if backend_cls.is_available()]
+
+
+class CountingBackend(jsonbackend.FastJsonBackend):
+    """A fast backend which counts the documents parsed by itself"""
+    NAME = 'counting'
+    MODULE = 'json'
+
+    def __init__(self):
+        super(CountingBackend, self).__init__()
+        self.calls = 0
+
+    def _loads(self, data):
+        self.calls += 1
+        return self.module.loads(data)
+
+
+class TestJsonBackend(unittest.TestCase):
+
+    def test_default_backend(self):
+        self.assertEqual(jsonbackend.get_backend().NAME,
+                         jsonbackend.BACKEND_JSON)
+        self.assertRaises(ValueError, jsonbackend.get_backend, 'nope')
+
+    def test_loads(self):
+        for backend in get_backends():
+            for doc in DOCUMENTS:
+                self.assertEqual(normalize(backend.loads(doc)),
+                                 normalize(json.loads(doc)),
+                                 '{} {}'.format(backend.NAME, doc))
+
+    def test_loads_invalid(self):
+        for backend in get_backends():
+            for doc in INVALID_DOCUMENTS:
+                with self.assertRaises(json.JSONDecodeError,
+                                       msg='{} {!r}'.format(backend.NAME,
+                                                            doc)):
+                    backend.loads(doc)
+
+    def test_big_integer_tokens(self):
+        backend = CountingBackend()
+        for doc in ['{"id": "12345678901234567890123"}',
+                    '["a 12345678901234567890123", 1]',
+                    '{"t": 1234567890123456}']:
+            self.assertEqual(backend.loads(doc), json.loads(doc))
+        self.assertEqual(backend.calls, 3)
+        for doc in ['12345678901234567890123', '[1, -12345678901234567890]',
+                    '{"a":\n 12345678901234567890}']:
+            self.assertEqual(backend.loads(doc), json.loads(doc))
+        self.assertEqual(backend.calls, 3)
+
+    def test_dumps_line(self):
+        for backend in get_backends():
+            for doc in DOCUMENTS:
+                value = json.loads(doc)
+                self.assertEqual(backend.dumps_line(value), json.dumps(value))
+
+    def test_extract_block(self):
+        lines = ['{"id": 123456789012345678901234567890, "v": NaN, '
+                 '"s": "\u00e9"}\n', '{"id": 1, "v": [1.5, "x"]}\n']
+        for output_format in jsonpath.FORMATS:
+            expected = jsonpath.extract_block(lines, ['id', 'v', 's'],
+                                              output_format=output_format)
+            for backend in get_backends():
+                self.assertEqual(
+                    jsonpath.extract_block(lines, ['id', 'v', 's'],
+                                           output_format=output_format,
+                                           backend=backend.NAME),
+                    expected)
+        # the same as json.dumps of a dict
+        self.assertEqual(
+            jsonpath.extract_block(lines, ['id', 's'], output_format='json'),
+            ('{"id": 123456789012345678901234567890, "s": "\\u00e9"}\n'
+             '{"id": 1, "s": null}\n', []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import argparse
+import contextlib
+import io
+import json
+import unittest
+
+from anyutils.base import code
+from anyutils.base import jsonpath
+
+CHUNK_SIZES = [1, 2, 3, 5, 7, 16, 64, None]
+DOCUMENT = {
+    'skipped': {'s': 'a "quoted" \\ back\\slash \u00e9\u4e2d\U0001f600',
+                'list': [1, -2.5e-3, True, False, None, {'x': '}]'}],
+                'escapes': '\\"\n\t\u0000\\u'},
+    'numbers': [0, -0, 12345678901234567890123, 1.5, -1e10, 3E+2, 0.25],
+    'literals': [True, False, None],
+    'text': '\u00e9\u4e2d\U0001f600 "x" \\',
+    'empty': [{}, [], ''],
+    'nested': {'a': [{'b': ['c', {'d': 'found'}]}]},
+}
+
+
+def make_fp(text, binary=False):
+    if binary:
+        # NOTE: multibyte chars may be split by the reads of TextIOWrapper
+        return io.TextIOWrapper(io.BytesIO(text.encode('utf-8')),
+                                encoding='utf-8')
+    return io.StringIO(text)
+
+
+class TestJsonStreamReader(unittest.TestCase):
+
+    def stream_get(self, text, keys, chunk_size, binary=False):
+        return jsonpath.stream_get(make_fp(text, binary=binary), keys,
+                                   chunk_size=chunk_size)
+
+    def assert_same(self, text, keys=None):
+        expected = jsonpath.get_value(json.loads(text),
+                                      jsonpath.split_keys(keys))
+        for chunk_size in CHUNK_SIZES:
+            for binary in (False, True):
+                self.assertEqual(
+                    self.stream_get(text, keys, chunk_size, binary=binary),
+                    expected,
+                    'keys={} chunk_size={}'.format(keys, chunk_size))
+
+    def test_parse_document(self):
+        for indent in (None, 2):
+            self.assert_same(json.dumps(DOCUMENT, indent=indent))
+            self.assert_same(json.dumps(DOCUMENT, ensure_ascii=False,
+                                        indent=indent))
+
+    def test_get_keys(self):
+        text = json.dumps(DOCUMENT, ensure_ascii=False)
+        for keys in ['text', 'numbers', 'numbers.2', 'numbers.6',
+                     'literals.2', 'empty.0', 'empty.2', 'nested.a.0.b.1.d',
+                     'skipped.escapes', 'skipped.list.5.x']:
+            self.assert_same(text, keys)
+
+    def test_skip_numbers(self):
+        text = json.dumps({'a': [1, -2.5, 3e+20, 0, True, 7, 8, 9] * 20,
+                           'b': [[1, 2], 3, 'x,y', 4]}, indent=1)
+        for keys in ['a.0', 'a.1', 'a.4', 'a.5', 'a.77', 'a.159', 'b.2',
+                     'b.3']:
+            self.assert_same(text, keys)
+        for chunk_size in CHUNK_SIZES:
+            self.assertRaises(ValueError, self.stream_get, text, 'a.160',
+                              chunk_size)
+
+    def test_scalars(self):
+        for text in ['0', '-12', '123456789012345678901234567890', '1.5e-7',
+                     '-0.0', 'true', 'false', 'null', '"a\\u00e9\\"b"',
+                     '  [1 , 2 ]  ', '["\\\\", "\\\\\\""]']:
+            self.assert_same(text)
+
+    def test_special_numbers(self):
+        for text in ['[NaN]', '[Infinity, -Infinity]', '-Infinity']:
+            expected = repr(json.loads(text))
+            for chunk_size in CHUNK_SIZES:
+                self.assertEqual(
+                    repr(self.stream_get(text, None, chunk_size)), expected,
+                    'text={} chunk_size={}'.format(text, chunk_size))
+
+    def test_missing_keys(self):
+        text = json.dumps(DOCUMENT)
+        for chunk_size in CHUNK_SIZES:
+            self.assertRaises(KeyError, self.stream_get, text, 'nope',
+                              chunk_size)
+            self.assertRaises(KeyError, self.stream_get, text, 'text.a',
+                              chunk_size)
+            self.assertRaises(ValueError, self.stream_get, text,
+                              'numbers.7', chunk_size)
+            self.assertRaises(ValueError, self.stream_get, text,
+                              'numbers.x', chunk_size)
+
+    def test_truncated(self):
+        text = json.dumps(DOCUMENT)
+        # NOTE: reading stops after the value of keys is found
+        found = text.index('"found"') + len('"found"')
+        for end in range(0, len(text), 3):
+            for chunk_size in (1, 5, None):
+                for keys in (None, 'nested.a.0.b.1.d'):
+                    if keys and end >= found:
+                        continue
+                    with self.assertRaises(ValueError,
+                                           msg='text={!r}'.format(
+                                               text[:end])):
+                        self.stream_get(text[:end], keys, chunk_size)
+
+    def test_invalid(self):
+        for text in ['{"a" 1}', '{"a": 1 "b": 2}', '[1 2]', '{1: 2}', 'x',
+                     '"abc']:
+            for chunk_size in (1, None):
+                self.assertRaises(ValueError, self.stream_get, text, None,
+                                  chunk_size)
+
+
+LINES = [
+    '{"id": 1, "name": "a\\tb", "tags": ["x"], "meta": {"k": "\u00e9"}}\n',
+    '\n',
+    '{"id": 2, "name": null, "tags": []}\n',
+    'not json\n',
+    '{"id": 3, "name": "c\\nd", "tags": ["y", "z"]}\n',
+]
+
+
+class TestExtractLines(unittest.TestCase):
+
+    def test_extract_block_tsv(self):
+        text, errors = jsonpath.extract_block(
+            LINES, ['id', 'name', 'tags.0', 'meta'], backend='json')
+        self.assertEqual(text, '1\ta\\tb\tx\t{"k": "\\u00e9"}\n'
+                               '2\t\t\t\n'
+                               '3\tc\\nd\ty\t\n')
+        self.assertEqual([lineno for lineno, _ in errors], [4])
+
+    def test_extract_block_json(self):
+        text, errors = jsonpath.extract_block(
+            LINES, ['id', 'tags.1', 'id'], output_format='json', start=10,
+            backend='json')
+        lines = text.splitlines()
+        self.assertEqual(len(lines), 3)
+        # the duplicated key is kept
+        self.assertEqual(lines[2].count('"id"'), 2)
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'id': 1, 'tags.1': None},
+                          {'id': 2, 'tags.1': None},
+                          {'id': 3, 'tags.1': 'z'}])
+        self.assertEqual([lineno for lineno, _ in errors], [13])
+
+    def test_extract_lines(self):
+        lines = ['{{"id": {}}}\n'.format(i) for i in range(100)]
+        lines[42] = '{\n'
+        for workers in (1, 3):
+            results = list(jsonpath.extract_lines(
+                iter(lines), ['id'], workers=workers, batch=7,
+                backend='json'))
+            self.assertEqual(len(results), 15)
+            self.assertEqual(''.join(text for text, _ in results),
+                             ''.join('{}\n'.format(i) for i in range(100)
+                                     if i != 42))
+            self.assertEqual([error[0] for _, errors in results
+                              for error in errors], [43])
+
+    def test_json_get_ndjson(self):
+        args = argparse.Namespace(
+            infile=io.StringIO(''.join(LINES)), keys=['id', 'name'],
+            lines=False, pretty=False, stream=False, ndjson=True,
+            format='tsv', workers=1, batch=2, backend='json')
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.assertEqual(code.JsonGet()(args), 1)
+        self.assertEqual(stdout.getvalue(), '1\ta\\tb\n2\t\n3\tc\\nd\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
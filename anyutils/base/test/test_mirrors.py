@@ -0,0 +1,132 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http import server
+from unittest import mock
+
+from six.moves import configparser
+
+from anyutils.base import mirrors
+from anyutils.base import setpip
+
+
+class MirrorHandler(server.BaseHTTPRequestHandler):
+    BODY = b'<html><body><a href="pip-1.0.tar.gz">pip</a></body></html>'
+
+    def do_GET(self):
+        if self.path.startswith('/slow/'):
+            time.sleep(0.3)
+        if self.path.startswith('/redirect/'):
+            self.send_response(301)
+            self.send_header('Location',
+                             self.path.replace('/redirect/', '/fast/', 1))
+            self.end_headers()
+            return
+        if self.path.startswith('/badport/'):
+            self.send_response(302)
+            self.send_header('Location', 'http://127.0.0.1:99999/simple')
+            self.end_headers()
+            return
+        if self.path.startswith('/missing/'):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.BODY)))
+        self.end_headers()
+        self.wfile.write(self.BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMirrors(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                MirrorHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.base_url = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def url(self, name):
+        return '{}/{}/simple'.format(self.base_url, name)
+
+    def test_probe(self):
+        result = mirrors.probe(self.url('fast'))
+        self.assertTrue(result.ok)
+        self.assertGreater(result.speed, 0)
+        self.assertLessEqual(result.ttfb, result.elapsed)
+
+    def test_probe_redirect(self):
+        self.assertTrue(mirrors.probe(self.url('redirect')).ok)
+
+    def test_probe_error(self):
+        self.assertIn('404', mirrors.probe(self.url('missing')).error)
+        # NOTE: nothing listens on the port of a closed socket
+        result = mirrors.probe('http://127.0.0.1:1/simple', timeout=1)
+        self.assertFalse(result.ok)
+        self.assertIn('Port', mirrors.probe(self.url('badport')).error)
+
+    def test_probe_all(self):
+        results = mirrors.probe_all([self.url('missing'), self.url('slow'),
+                                     self.url('fast')])
+        self.assertEqual([result.url for result in results],
+                         [self.url('fast'), self.url('slow'),
+                          self.url('missing')])
+
+    def test_check_url(self):
+        mirrors.check_url('https://example.com:8443/simple')
+        for url in ['http://example.com:99999/simple',
+                    'http://example.com:x/simple', 'ftp://example.com/',
+                    'example.com/simple']:
+            self.assertRaises(ValueError, mirrors.check_url, url)
+
+    def set_pip_auto(self, **kwargs):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        pip_conf = os.path.join(tmp_dir, 'pip.conf')
+        known_urls = {'slow': self.url('slow'), 'fast': self.url('fast'),
+                      'missing': self.url('missing')}
+        args = argparse.Namespace(index_url='auto', force=False,
+                                  candidate=None, extra=0, timeout=5)
+        for key, value in kwargs.items():
+            setattr(args, key, value)
+        with mock.patch.object(setpip, 'KNOWN_INDEX_URL', known_urls), \
+                mock.patch.object(setpip.system, 'get_pip_path',
+                                  return_value=pip_conf):
+            result = setpip.SetPip()(args)
+        parser = configparser.ConfigParser()
+        parser.read(pip_conf)
+        return result, parser
+
+    def test_set_pip_auto(self):
+        _, parser = self.set_pip_auto()
+        self.assertEqual(parser.get('global', 'index-url'),
+                         self.url('fast'))
+        self.assertFalse(parser.has_option('global', 'extra-index-url'))
+        _, parser = self.set_pip_auto(extra=2)
+        self.assertEqual(parser.get('global', 'extra-index-url').split(),
+                         [self.url('slow')])
+
+    def test_set_pip_auto_invalid_candidate(self):
+        result, parser = self.set_pip_auto(
+            candidate=[self.url('fast'), 'http://127.0.0.1:99999/simple'])
+        self.assertEqual(result, 1)
+        self.assertFalse(parser.has_section('global'))
+        result, _ = self.set_pip_auto(extra=-1)
+        self.assertEqual(result, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
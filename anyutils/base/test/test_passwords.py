@@ -0,0 +1,112 @@
+import argparse
+import collections
+import contextlib
+import io
+import json
+import unittest
+
+from anyutils.base import code
+from anyutils.base import passwords
+
+CLASSES = [passwords.LOWER_CHARS, passwords.UPPER_CHARS,
+           passwords.NUMBER_CHARS, passwords.SPECIAL_CHARS]
+
+
+def count_classes(password):
+    return [sum(1 for char in password if char in chars)
+            for chars in CLASSES]
+
+
+class TestPasswords(unittest.TestCase):
+
+    def test_generate(self):
+        for counts in [(8, None, None, None), (3, 2, 1, 4), (0, 0, 5, 0),
+                       (100, 60, 60, 36)]:
+            generator = passwords.PasswordGenerator(*counts, block_size=64)
+            results = generator.generate(50)
+            self.assertEqual(len(results), 50)
+            for password in results:
+                self.assertEqual(len(password),
+                                 sum(count or 0 for count in counts))
+                # every char is in one of the classes
+                self.assertEqual(count_classes(password),
+                                 [count or 0 for count in counts])
+
+    def test_invalid_length(self):
+        for counts in [(0, None, None, None), (None, 0, 0, 0),
+                       (200, 57, None, None), (8, -1, None, None)]:
+            self.assertRaises(ValueError, passwords.PasswordGenerator,
+                              *counts)
+        passwords.PasswordGenerator(200, 56)
+
+    def test_chars_are_uniform(self):
+        pool = passwords.RandomPool()
+        for chars in CLASSES:
+            counter = collections.Counter(pool.choices(chars, 300 *
+                                                       len(chars)))
+            self.assertEqual(set(counter), set(chars))
+            # NOTE: far from the expected 300 only if it is not uniform
+            self.assertLess(max(counter.values()), 450)
+            self.assertGreater(min(counter.values()), 170)
+
+    def test_shuffle(self):
+        pool = passwords.RandomPool()
+        positions = collections.Counter()
+        for _ in range(2000):
+            chars = list('abcd')
+            pool.shuffle(chars)
+            self.assertEqual(sorted(chars), list('abcd'))
+            positions[chars.index('a')] += 1
+        self.assertEqual(set(positions), {0, 1, 2, 3})
+        self.assertGreater(min(positions.values()), 400)
+
+    def test_generate_passwords(self):
+        for workers in (None, 2):
+            batches = list(passwords.generate_passwords(
+                25, workers=workers, batch=10, lower=2, number=2))
+            self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+            for batch in batches:
+                for password in batch:
+                    self.assertEqual(count_classes(password), [2, 0, 2, 0])
+
+    def generate_password(self, **kwargs):
+        args = argparse.Namespace(infile=None, lower=8, upper=None,
+                                  number=None, special=None, count=1,
+                                  format='text', workers=None, bench=False)
+        for key, value in kwargs.items():
+            setattr(args, key, value)
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            result = code.GeneratePassword()(args)
+        return result, stdout.getvalue()
+
+    def test_cli_formats(self):
+        _, output = self.generate_password(count=3, upper=2)
+        self.assertEqual([count_classes(line)
+                          for line in output.splitlines()],
+                         [[8, 2, 0, 0]] * 3)
+        _, output = self.generate_password(count=3, format='csv')
+        lines = output.splitlines()
+        self.assertEqual(lines[0], 'password')
+        self.assertEqual([len(line) for line in lines[1:]], [8] * 3)
+        _, output = self.generate_password(count=3, format='json',
+                                           special=1)
+        self.assertEqual([count_classes(password)
+                          for password in json.loads(output)],
+                         [[8, 0, 0, 1]] * 3)
+        result, output = self.generate_password(count=3, lower=0)
+        self.assertEqual(result, 1)
+
+    def test_invalid_count(self):
+        for count in (0, -1):
+            for fmt in ('text', 'json'):
+                result, output = self.generate_password(count=count,
+                                                        format=fmt)
+                self.assertEqual(result, 1)
+                self.assertTrue(output.startswith('Error:'), output)
+        self.assertRaises(ValueError, list,
+                          passwords.generate_passwords(-1, lower=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
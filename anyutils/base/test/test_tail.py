@@ -0,0 +1,187 @@
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from anyutils.base import fs
+from anyutils.base import tail
+
+WINDOWS = [1, 2, 3, 5, 8, 64, None]
+SAMPLES = [
+    b'',
+    b'\n',
+    b'a',
+    b'a\n',
+    b'line1\nline2\nline3\n',
+    b'line1\nline2\nno newline',
+    b'\n\n\nempty lines\n\n',
+    b'a very long line which is longer than windows\nshort\n',
+    b''.join('line {}\n'.format(i).encode() for i in range(100)),
+]
+
+
+def reversed_lines(data):
+    return b''.join(reversed(data.splitlines(True)))
+
+
+class TestReversed(unittest.TestCase):
+
+    def test_iter_reversed_blocks(self):
+        for data in SAMPLES:
+            for window in WINDOWS:
+                self.assertEqual(
+                    b''.join(tail.iter_reversed_blocks(data, window=window)),
+                    reversed_lines(data), (data, window))
+
+    def test_nums(self):
+        for data in SAMPLES:
+            lines = data.splitlines(True)
+            for window in WINDOWS:
+                for nums in range(len(lines) + 2):
+                    self.assertEqual(
+                        b''.join(tail.iter_reversed_blocks(
+                            data, window=window, nums=nums)),
+                        b''.join(reversed(lines[-nums:] if nums else [])),
+                        (data, window, nums))
+
+    def test_find_tail_offset(self):
+        for data in SAMPLES:
+            lines = data.splitlines(True)
+            for window in WINDOWS:
+                for nums in range(1, len(lines) + 2):
+                    offset = tail.find_tail_offset(data, nums, window=window)
+                    self.assertEqual(data[offset:],
+                                     b''.join(lines[-nums:]),
+                                     (data, window, nums))
+
+    def test_invalid_window(self):
+        for window in (0, -1, -1024):
+            self.assertRaises(ValueError, list,
+                              tail.iter_reversed_blocks(b'a\nb\n',
+                                                        window=window))
+
+
+class TestPyTac(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'file.txt')
+        with open(self.path, 'wb') as f:
+            f.write(SAMPLES[-1])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_reversed(self):
+        for window in WINDOWS:
+            output = io.BytesIO()
+            tail.write_reversed(self.path, output, window=window, nums=3)
+            self.assertEqual(output.getvalue(),
+                             b'line 99\nline 98\nline 97\n')
+
+    def test_negative_chunk(self):
+        args = argparse.Namespace(file=self.path, chunk=-1, nums=None)
+        self.assertIsNone(fs.PyTac()(args))
+        args = argparse.Namespace(files=[self.path], chunk=-1, nums=10,
+                                  follow=False, sleep_interval=1.0)
+        self.assertEqual(fs.PyTail()(args), 1)
+
+
+class TestFollower(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'app.log')
+        self.write(b'line1\nline2\nline3\n')
+        self.output = io.BytesIO()
+        self.follower = None
+
+    def tearDown(self):
+        if self.follower:
+            for followed in self.follower.files:
+                followed.close()
+            if self.follower._inotify:
+                self.follower._inotify.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, data, mode='ab'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def start(self, inotify=True, paths=None):
+        self.follower = tail.Follower(paths or [self.path], self.output,
+                                      interval=0.05)
+        self.follower.print_tail(nums=2)
+        if inotify:
+            self.follower._setup_inotify()
+
+    def wait_output(self, expected, timeout=5):
+        deadline = time.time() + timeout
+        while self.output.getvalue() != expected and time.time() < deadline:
+            self.follower.wait()
+        self.assertEqual(self.output.getvalue(), expected)
+
+    def run_cases(self, inotify):
+        self.start(inotify=inotify)
+        self.assertEqual(self.output.getvalue(), b'line2\nline3\n')
+        self.write(b'line4\n')
+        self.wait_output(b'line2\nline3\nline4\n')
+        # truncate
+        self.write(b'new1\n', mode='wb')
+        self.wait_output(b'line2\nline3\nline4\nnew1\n')
+        # rotate
+        self.write(b'new2\n')
+        os.rename(self.path, self.path + '.1')
+        self.write(b'rotated\n', mode='wb')
+        self.wait_output(b'line2\nline3\nline4\nnew1\nnew2\nrotated\n')
+
+    def test_follow_inotify(self):
+        try:
+            tail.Inotify().close()
+        except (OSError, AttributeError):
+            self.skipTest('inotify is not supported')
+        self.run_cases(True)
+
+    def test_follow_poll(self):
+        self.run_cases(False)
+
+    def test_periodic_check(self):
+        # a file which is changed all the time must not delay the check of
+        # files whose changes are not reported by inotify
+        busy = os.path.join(self.tmp_dir, 'busy.log')
+        open(busy, 'w').close()
+        self.start(paths=[busy, self.path])
+        quiet = self.follower.files[1]
+        quiet.position = 0
+        deadline = time.time() + 5
+        while self.output.getvalue().count(b'line1') == 0 and \
+                time.time() < deadline:
+            with open(busy, 'a') as f:
+                f.write('busy\n')
+            self.follower.wait()
+        self.assertIn(b'line1', self.output.getvalue())
+
+    def test_bounded_read(self):
+        followed = tail.FollowedFile(self.path)
+        followed.open()
+        self.assertEqual(followed.read(4), b'line')
+        self.assertEqual(followed.read(), b'1\nline2\nline3\n')
+        self.assertEqual(followed.read(), b'')
+        followed.close()
+
+    def test_fifo(self):
+        fifo = os.path.join(self.tmp_dir, 'fifo')
+        os.mkfifo(fifo)
+        follower = tail.Follower([fifo, self.path], self.output)
+        follower.print_tail(nums=1)
+        self.assertIsNone(follower.files[0].fp)
+        self.assertEqual(self.output.getvalue(),
+                         '==> {} <==\nline3\n'.format(self.path).encode())
+        follower.files[1].close()
+
+
+if __name__ == '__main__':
+    unittest.main()
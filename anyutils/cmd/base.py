@@ -1,21 +1,42 @@
+import collections
 import sys
 
 from anycode.common import cliparser
 from anycode.common import log
-from anyutils.base import fs
-from anyutils.base import setpip
-from anyutils.base import code
-from anyutils.base import confeditor
+from anyutils.cmd import lazy
 
 LOG = log.getLogger(__name__)
 
+# NOTE: the modules of subcommands are imported only when they are used
+COMMANDS = collections.OrderedDict([
+    ('py-tac', 'anyutils.base.fs:PyTac'),
+    ('py-tail', 'anyutils.base.fs:PyTail'),
+    ('zip', 'anyutils.base.fs:PyZip'),
+    ('unzip', 'anyutils.base.fs:PyUnzip'),
+    ('set-pip', 'anyutils.base.setpip:SetPip'),
+    ('json-get', 'anyutils.base.code:JsonGet'),
+    ('json-bench', 'anyutils.base.code:JsonBench'),
+    ('md5sum', 'anyutils.base.code:Md5Sum'),
+    ('conf-list', 'anyutils.base.confeditor:ConfigList'),
+    ('conf-get', 'anyutils.base.confeditor:ConfigGet'),
+    ('conf-set', 'anyutils.base.confeditor:ConfigSet'),
+    ('conf-diff', 'anyutils.base.confeditor:ConfigDiff'),
+    ('generate-password', 'anyutils.base.code:GeneratePassword'),
+])
 
-def main():
+
+def get_cli_parser(argv):
+    """Get the parser, all subcommands are registered if argv is empty"""
     cli_parser = cliparser.SubCliParser('Fluent Python Utils Base')
-    cli_parser.register_clis(fs.PyTac, fs.PyZip, setpip.SetPip,
-                             code.JsonGet, code.Md5Sum,
-                             confeditor.ConfigList,
-                             code.GeneratePassword)
+    lazy.register_clis(cli_parser, COMMANDS, argv)
+    return cli_parser
+
+
+def main():
+    if sys.argv[1:2] == ['--serve']:
+        from anyutils.cmd import server
+        return server.main(sys.argv[2:])
+    cli_parser = get_cli_parser(sys.argv[1:])
     try:
         cli_parser.call()
         return 0
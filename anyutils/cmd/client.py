@@ -0,0 +1,143 @@
+"""A thin client of the any-utils server
+
+The client only imports modules of the standard library. It sends argv,
+cwd, environment variables and its stdin, stdout and stderr to the server
+started by any-utils --serve, the command is run by a forked process of the
+server which writes to the file descriptors directly. The command is run in
+process if the server is not running.
+
+The socket is in a dir which only the user can access, and the client
+checks that the socket and the server are owned by the user before sending
+anything.
+"""
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+import tempfile
+
+ENV_SOCKET = 'ANYUTILS_SOCKET'
+STRUCT_INT = struct.Struct('!i')
+PROG_BASE = 'base'
+PROG_EXT = 'ext'
+
+
+class ServerUnavailable(Exception):
+    """The server is not running or not trusted, nothing has been sent"""
+
+
+def get_socket_dir():
+    """The dir of socket, $XDG_RUNTIME_DIR/anyutils or /tmp/anyutils-<uid>"""
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'anyutils')
+    return os.path.join(tempfile.gettempdir(),
+                        'anyutils-{}'.format(os.getuid()))
+
+
+def get_socket_path():
+    """The path of socket, default is server.sock in get_socket_dir()"""
+    if os.environ.get(ENV_SOCKET):
+        return os.environ[ENV_SOCKET]
+    return os.path.join(get_socket_dir(), 'server.sock')
+
+
+def get_peer_uid(sock):
+    """Return the uid of the process on the other side of Unix socket"""
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def connect(sock, socket_path):
+    """Connect to the server of the user
+
+    Raise ServerUnavailable if the server is not running, or the socket or
+    the server is owned by other user.
+    """
+    try:
+        socket_stat = os.lstat(socket_path)
+        if not stat.S_ISSOCK(socket_stat.st_mode) or \
+           socket_stat.st_uid != os.getuid():
+            raise ServerUnavailable('{} is not a socket of uid {}'.format(
+                socket_path, os.getuid()))
+        sock.connect(socket_path)
+        if get_peer_uid(sock) != os.getuid():
+            raise ServerUnavailable('the server of {} is run by other '
+                                    'user'.format(socket_path))
+    except OSError as e:
+        raise ServerUnavailable(str(e))
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('connection closed')
+        data += chunk
+    return data
+
+
+def call(prog, argv, socket_path=None):
+    """Run the command by the server and return the exit code
+
+    Raise ServerUnavailable if the server can not be connected, the other
+    errors are raised after the request is sent.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connect(sock, socket_path or get_socket_path())
+        request = json.dumps({'prog': prog, 'argv': argv,
+                              'cwd': os.getcwd(),
+                              'env': dict(os.environ)}).encode('utf-8')
+        sys.stdout.flush()
+        socket.send_fds(sock, [STRUCT_INT.pack(len(request))],
+                        [sys.stdin.fileno(), sys.stdout.fileno(),
+                         sys.stderr.fileno()])
+        sock.sendall(request)
+        try:
+            pid = STRUCT_INT.unpack(recv_exactly(sock, STRUCT_INT.size))[0]
+        except EOFError:
+            return 1
+        while True:
+            try:
+                return STRUCT_INT.unpack(
+                    recv_exactly(sock, STRUCT_INT.size))[0]
+            except KeyboardInterrupt:
+                # NOTE: the command is run by the process of server
+                os.kill(pid, signal.SIGINT)
+            except EOFError:
+                return 1
+    finally:
+        sock.close()
+
+
+def _main(prog):
+    try:
+        return call(prog, sys.argv[1:])
+    except ServerUnavailable:
+        pass
+    except (OSError, ValueError) as e:
+        # NOTE: the command may be run by the server, do not run it again
+        print('any-utils client: {}'.format(e), file=sys.stderr)
+        return 1
+    if prog == PROG_EXT:
+        from anyutils.cmd import ext
+        return ext.main()
+    from anyutils.cmd import base
+    return base.main()
+
+
+def main():
+    sys.exit(_main(PROG_BASE))
+
+
+def ext_main():
+    sys.exit(_main(PROG_EXT))
+
+
+if __name__ == '__main__':
+    main()
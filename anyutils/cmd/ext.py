@@ -1,24 +1,35 @@
 import sys
 
-from stevedore import extension
-
 from anycode.common import cliparser
 from anycode.common import log
+from anyutils.cmd import lazy
+from anyutils.cmd import manifest
 
 LOG = log.getLogger(__name__)
 
+NAMESPACE = 'anyutils.extensions'
 
-def main():
+
+def get_cli_parser(argv):
+    """Get the parser, all subcommands are registered if argv is empty"""
     cli_parser = cliparser.SubCliParser('Fluent Python Utils Extensions')
+    commands = manifest.load_manifest(NAMESPACE)
+    args = [arg for arg in argv if not arg.startswith('-')]
+    if args and args[0] not in commands:
+        LOG.debug('%s is not in the cached manifest, rebuild it', args[0])
+        commands = manifest.load_manifest(NAMESPACE, rebuild=True)
+    try:
+        lazy.register_clis(cli_parser, commands, argv)
+    except (ImportError, AttributeError) as e:
+        LOG.debug('the cached manifest is invalid, rebuild it: %s', e)
+        cli_parser = cliparser.SubCliParser('Fluent Python Utils Extensions')
+        commands = manifest.load_manifest(NAMESPACE, rebuild=True)
+        lazy.register_clis(cli_parser, commands, argv)
+    return cli_parser
+
 
-    ext_manager = extension.ExtensionManager(
-        namespace='anyutils.extensions',
-        invoke_on_load=True,
-    )
-    for ext in ext_manager.extensions:
-        sub_commands = ext.obj
-        LOG.debug('register sub commands for extension %s', ext.name)
-        cli_parser.register_clis(*sub_commands)
+def main():
+    cli_parser = get_cli_parser(sys.argv[1:])
     try:
         cli_parser.call()
         return 0
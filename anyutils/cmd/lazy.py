@@ -0,0 +1,38 @@
+"""Register the subcommands lazily
+
+Subcommands are registered by the dotted path of their classes, only the
+module of the subcommand chosen in argv is imported. All of them are
+imported if no known subcommand is given, e.g. for the help message.
+"""
+
+
+def import_cli(path):
+    """Import the cli class by path like package.module:ClassName"""
+    module_name, _, class_name = path.partition(':')
+    # NOTE: use __import__ rather than importlib.import_module, the imports
+    # of importlib are not reported by python -X importtime
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+
+def find_command(argv, commands):
+    """Return the subcommand name in argv, None if it is not known
+
+    The subcommand is the first argument which is not an option.
+    """
+    for arg in argv:
+        if arg.startswith('-'):
+            continue
+        return arg if arg in commands else None
+    return None
+
+
+def register_clis(cli_parser, commands, argv):
+    """Register the subcommand in argv, or all subcommands if not found
+
+    Param:
+        commands: dict of {name: path of cli class}
+    """
+    name = find_command(argv, commands)
+    paths = [commands[name]] if name else list(commands.values())
+    cli_parser.register_clis(*[import_cli(path) for path in paths])
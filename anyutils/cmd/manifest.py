@@ -0,0 +1,123 @@
+"""Cached manifest of the subcommands of extensions
+
+Loading extensions by stevedore imports all of the extension modules, so
+the manifest which maps the subcommand names to their classes is built once
+and cached. It is rebuilt when the site-packages dirs are changed, e.g.
+distributions are installed or removed, or the entry points of editable
+installs are changed.
+"""
+import hashlib
+import json
+import os
+import sys
+
+from anycode.common import log
+from anyutils import utils
+
+LOG = log.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+SITE_DIRS = ('site-packages', 'dist-packages')
+SITE_SUFFIXES = ('.pth', '.egg-link')
+METADATA_SUFFIXES = ('.egg-info', '.dist-info')
+
+
+def _iter_mtimes(path, site):
+    """Yield [name, mtime] of the files in path which change the commands
+
+    Param:
+        site: path is a site-packages dir, the .pth and .egg-link files of
+              editable installs are in it, otherwise path may be the source
+              dir of an editable install which has the metadata dirs
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if site and entry.name.endswith(SITE_SUFFIXES):
+                file_path = entry.path
+            elif not site and entry.name.endswith(METADATA_SUFFIXES):
+                file_path = os.path.join(entry.path, 'entry_points.txt')
+            else:
+                continue
+            try:
+                yield [file_path, os.stat(file_path).st_mtime_ns]
+            except OSError:
+                continue
+
+
+def get_fingerprint():
+    """Return the fingerprint of installed distributions
+
+    pip adds or removes the metadata dirs of distributions in site-packages,
+    so the mtime of site-packages dirs is changed. The entry points of
+    editable installs are in their source dirs, which are added to sys.path
+    by .pth files, so the mtimes of .pth files and entry_points.txt in the
+    other dirs of sys.path are also included.
+    """
+    paths = []
+    for path in sys.path:
+        site = os.path.basename(path.rstrip(os.sep)) in SITE_DIRS
+        try:
+            if site:
+                paths.append([path, os.stat(path).st_mtime_ns])
+            paths.extend(_iter_mtimes(path or os.curdir, site))
+        except OSError:
+            continue
+    return hashlib.sha1(json.dumps(
+        [MANIFEST_VERSION, sys.version, paths]).encode('utf-8')).hexdigest()
+
+
+def get_manifest_path(namespace):
+    key = hashlib.sha1('{}:{}'.format(sys.executable, namespace).encode(
+        'utf-8')).hexdigest()
+    return os.path.join(utils.get_cache_dir('manifests'),
+                        '{}.json'.format(key))
+
+
+def build_manifest(namespace):
+    """Load all extensions by stevedore, return {name: path of cli class}"""
+    # NOTE: stevedore is only needed to build the manifest
+    from stevedore import extension
+
+    ext_manager = extension.ExtensionManager(namespace=namespace,
+                                             invoke_on_load=True)
+    commands = {}
+    for ext in ext_manager.extensions:
+        LOG.debug('register sub commands for extension %s', ext.name)
+        for cli in ext.obj:
+            commands[cli.NAME] = '{}:{}'.format(cli.__module__,
+                                                cli.__name__)
+    return commands
+
+
+def load_manifest(namespace, rebuild=False):
+    """Load the manifest from cache, build it if it is stale
+
+    Return:
+        dict of {subcommand name: path of cli class}, sorted by name
+    """
+    try:
+        path = get_manifest_path(namespace)
+    except OSError as e:
+        LOG.warning('cache dir is not usable, manifest is not cached: %s', e)
+        return dict(sorted(build_manifest(namespace).items()))
+    fingerprint = get_fingerprint()
+    if not rebuild:
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            if cached.get('fingerprint') == fingerprint:
+                return dict(sorted(cached['commands'].items()))
+            LOG.debug('manifest %s is stale', path)
+        except (IOError, OSError, ValueError) as e:
+            LOG.debug('load manifest failed: %s', e)
+    commands = build_manifest(namespace)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'commands': commands}, f)
+        os.replace(tmp_path, path)
+    except (IOError, OSError) as e:
+        LOG.warning('save manifest to %s failed: %s', path, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return dict(sorted(commands.items()))
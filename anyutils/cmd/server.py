@@ -0,0 +1,151 @@
+"""Run the commands of any-utils in a long-lived server
+
+The server imports the modules of all commands and builds the parsers once,
+then listens on a Unix socket. For each request it forks a process, which
+takes over the stdin, stdout and stderr of client (passed by SCM_RIGHTS),
+runs the command, and sends the exit code back to the client.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+
+from anycode.common import log
+from anyutils.cmd import client
+
+LOG = log.getLogger(__name__)
+
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+def _get_parsers():
+    from anyutils.cmd import base
+    from anyutils.cmd import ext
+
+    parsers = {client.PROG_BASE: base.get_cli_parser([])}
+    try:
+        parsers[client.PROG_EXT] = ext.get_cli_parser([])
+    except ImportError as e:
+        LOG.warning('extensions are not loaded: %s', e)
+    return parsers
+
+
+def make_socket_dir(socket_dir):
+    """Create the dir of socket which only the user can access
+
+    Raise OSError if the dir exists but it is not safe.
+    """
+    try:
+        os.mkdir(socket_dir, 0o700)
+    except FileExistsError:
+        pass
+    dir_stat = os.lstat(socket_dir)
+    if not stat.S_ISDIR(dir_stat.st_mode) or \
+       dir_stat.st_uid != os.getuid() or dir_stat.st_mode & 0o077:
+        raise PermissionError('{} must be a dir of uid {} with mode '
+                              '0700'.format(socket_dir, os.getuid()))
+
+
+def _run(cli_parser, prog, argv):
+    sys.argv = ['any-utils' if prog == client.PROG_BASE else
+                'any-utils-ext'] + argv
+    try:
+        cli_parser.call()
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        LOG.error("user interrupt")
+        return 1
+    except Exception as e:
+        LOG.exception(e)
+        return 1
+
+
+def handle(conn, listener, parsers):
+    """Handle a request in the forked process, never return"""
+    code = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        listener.close()
+        data, fds, _, _ = socket.recv_fds(conn, client.STRUCT_INT.size, 3)
+        size = client.STRUCT_INT.unpack(data)[0]
+        if len(fds) != 3 or size > MAX_REQUEST_SIZE:
+            raise ValueError('invalid request')
+        request = json.loads(client.recv_exactly(conn, size).decode('utf-8'))
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        conn.sendall(client.STRUCT_INT.pack(os.getpid()))
+        cli_parser = parsers.get(request['prog'])
+        if cli_parser is None:
+            LOG.error('unknown program %s', request['prog'])
+        else:
+            code = _run(cli_parser, request['prog'], request['argv'])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall(client.STRUCT_INT.pack(code))
+    except BaseException as e:
+        LOG.debug('handle request failed: %s', e)
+    finally:
+        os._exit(code)
+
+
+def serve(socket_path=None):
+    """Listen on the Unix socket and run commands until interrupted"""
+    if not socket_path and not os.environ.get(client.ENV_SOCKET):
+        make_socket_dir(client.get_socket_dir())
+    socket_path = socket_path or client.get_socket_path()
+    parsers = _get_parsers()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(128)
+    # NOTE: the children are reaped by the kernel
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    LOG.info('serving on %s', socket_path)
+    try:
+        while True:
+            conn, _ = listener.accept()
+            try:
+                if client.get_peer_uid(conn) != os.getuid():
+                    LOG.warning('refuse the request from other user')
+                    continue
+                sys.stdout.flush()
+                sys.stderr.flush()
+                if os.fork() == 0:
+                    handle(conn, listener, parsers)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        LOG.info('server stopped')
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='any-utils --serve')
+    parser.add_argument('--socket', default=None,
+                        help='The path of Unix socket, default is '
+                             '{}'.format(client.get_socket_path()))
+    args = parser.parse_args(argv)
+    serve(socket_path=args.socket)
+    return 0
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from anyutils.cmd import manifest
+
+COMMANDS = {'b-cmd': 'pkg.mod:B', 'a-cmd': 'pkg.mod:A'}
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.site = os.path.join(self.tmp_dir, 'site-packages')
+        self.src = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(os.path.join(self.src, 'demo.egg-info'))
+        os.makedirs(self.site)
+        self.entry_points = os.path.join(self.src, 'demo.egg-info',
+                                         'entry_points.txt')
+        self.pth = os.path.join(self.site, 'demo.pth')
+        for path in [self.entry_points, self.pth]:
+            with open(path, 'w') as f:
+                f.write('x\n')
+        patchers = [
+            mock.patch('sys.path', [self.site, self.src]),
+            mock.patch.dict('os.environ', {
+                'XDG_CACHE_HOME': os.path.join(self.tmp_dir, 'cache')}),
+            mock.patch.object(manifest, 'build_manifest',
+                              return_value=dict(COMMANDS)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def touch(self, path):
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+
+    def test_cached(self):
+        self.assertEqual(list(manifest.load_manifest('ns')),
+                         ['a-cmd', 'b-cmd'])
+        self.assertEqual(manifest.load_manifest('ns'), COMMANDS)
+        self.assertEqual(manifest.build_manifest.call_count, 1)
+        manifest.load_manifest('ns', rebuild=True)
+        self.assertEqual(manifest.build_manifest.call_count, 2)
+        # the namespaces are cached separately
+        manifest.load_manifest('other')
+        self.assertEqual(manifest.build_manifest.call_count, 3)
+
+    def test_invalidate(self):
+        manifest.load_manifest('ns')
+        for path in [self.site, self.pth, self.entry_points]:
+            fingerprint = manifest.get_fingerprint()
+            self.touch(path)
+            self.assertNotEqual(manifest.get_fingerprint(), fingerprint,
+                                path)
+        manifest.load_manifest('ns')
+        self.assertEqual(manifest.build_manifest.call_count, 2)
+
+    def test_stable_fingerprint(self):
+        fingerprint = manifest.get_fingerprint()
+        # the other files of source dirs are not in the fingerprint
+        with open(os.path.join(self.src, 'module.py'), 'w') as f:
+            f.write('x = 1\n')
+        self.assertEqual(manifest.get_fingerprint(), fingerprint)
+
+    def test_broken_cache(self):
+        manifest.load_manifest('ns')
+        with open(manifest.get_manifest_path('ns'), 'w') as f:
+            f.write('{broken')
+        self.assertEqual(manifest.load_manifest('ns'), COMMANDS)
+        self.assertEqual(manifest.build_manifest.call_count, 2)
+
+    def test_cache_dir_not_usable(self):
+        cache_home = os.path.join(self.tmp_dir, 'file')
+        open(cache_home, 'w').close()
+        with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': cache_home}):
+            self.assertEqual(manifest.load_manifest('ns'), COMMANDS)
+            self.assertEqual(manifest.load_manifest('ns'), COMMANDS)
+        self.assertEqual(manifest.build_manifest.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
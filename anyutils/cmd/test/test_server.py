@@ -0,0 +1,176 @@
+import hashlib
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from anyutils.cmd import client
+from anyutils.cmd import server
+
+
+def wait_for(path, timeout=30):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() > deadline:
+            raise RuntimeError('{} is not created'.format(path))
+        time.sleep(0.05)
+
+
+class TestServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.runtime_dir = os.path.join(cls.tmp_dir, 'runtime')
+        os.mkdir(cls.runtime_dir, 0o700)
+        env = dict(os.environ, XDG_RUNTIME_DIR=cls.runtime_dir,
+                   PYTHONPATH=os.pathsep.join(sys.path))
+        env.pop(client.ENV_SOCKET, None)
+        cls.server = subprocess.Popen(
+            [sys.executable, '-c',
+             'from anyutils.cmd import server; server.serve()'], env=env)
+        with mock.patch.dict('os.environ',
+                             {'XDG_RUNTIME_DIR': cls.runtime_dir}):
+            cls.socket_path = client.get_socket_path()
+        wait_for(cls.socket_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        self.path = os.path.join(self.tmp_dir, 'data.txt')
+        with open(self.path, 'wb') as f:
+            f.write(b'hello\n')
+        self.output = os.path.join(self.tmp_dir, 'output.txt')
+
+    def call(self, argv, **kwargs):
+        """Call the server, return (exit code, stdout of the command)"""
+        with open(os.devnull) as stdin, open(self.output, 'w') as stdout, \
+                mock.patch('sys.stdin', stdin), \
+                mock.patch('sys.stdout', stdout):
+            code = client.call(client.PROG_BASE, argv,
+                               socket_path=self.socket_path, **kwargs)
+        with open(self.output) as f:
+            return code, f.read()
+
+    def test_socket_dir(self):
+        socket_dir = os.path.dirname(self.socket_path)
+        self.assertEqual(socket_dir,
+                         os.path.join(self.runtime_dir, 'anyutils'))
+        dir_stat = os.stat(socket_dir)
+        self.assertEqual(dir_stat.st_mode & 0o777, 0o700)
+        self.assertEqual(dir_stat.st_uid, os.getuid())
+
+    def test_run_command(self):
+        # the output is written by the server to the passed stdout
+        code, output = self.call(['md5sum', self.path])
+        self.assertEqual(code, 0)
+        self.assertIn(hashlib.md5(b'hello\n').hexdigest(), output)
+
+    def test_cwd_and_exit_code(self):
+        with mock.patch('os.getcwd', return_value=self.tmp_dir):
+            code, output = self.call(['md5sum', 'data.txt'])
+        self.assertEqual(code, 0)
+        self.assertIn(hashlib.md5(b'hello\n').hexdigest(), output)
+        code, _ = self.call(['no-such-command'])
+        self.assertEqual(code, 2)
+
+    def test_untrusted_server(self):
+        with mock.patch.object(client, 'get_peer_uid',
+                               return_value=os.getuid() + 1):
+            self.assertRaises(client.ServerUnavailable, self.call,
+                              ['md5sum', self.path])
+        with open(self.output) as f:
+            self.assertEqual(f.read(), '')
+
+    @unittest.skipIf(os.geteuid() != 0, 'chown requires root')
+    def test_socket_of_other_user(self):
+        socket_dir = os.path.join(self.tmp_dir, 'other')
+        os.mkdir(socket_dir)
+        socket_path = os.path.join(socket_dir, 'server.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(socket_path)
+        listener.listen(1)
+        os.chown(socket_path, 12345, 12345)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        self.assertRaises(client.ServerUnavailable, client.connect, sock,
+                          socket_path)
+
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.socket_path = os.path.join(self.tmp_dir, 'server.sock')
+
+    def test_make_socket_dir(self):
+        socket_dir = os.path.join(self.tmp_dir, 'anyutils')
+        server.make_socket_dir(socket_dir)
+        self.assertEqual(os.stat(socket_dir).st_mode & 0o777, 0o700)
+        server.make_socket_dir(socket_dir)
+        os.chmod(socket_dir, 0o777)
+        self.assertRaises(OSError, server.make_socket_dir, socket_dir)
+        link = os.path.join(self.tmp_dir, 'link')
+        os.symlink(self.tmp_dir, link)
+        self.assertRaises(OSError, server.make_socket_dir, link)
+
+    def test_default_socket_path(self):
+        with mock.patch.dict('os.environ', {'XDG_RUNTIME_DIR': ''}):
+            os.environ.pop(client.ENV_SOCKET, None)
+            self.assertEqual(client.get_socket_path(), os.path.join(
+                tempfile.gettempdir(), 'anyutils-{}'.format(os.getuid()),
+                'server.sock'))
+
+    def test_fallback_if_not_running(self):
+        with mock.patch.dict('os.environ',
+                             {client.ENV_SOCKET: self.socket_path}), \
+                mock.patch('anyutils.cmd.base.main',
+                           return_value=5) as main:
+            self.assertEqual(client._main(client.PROG_BASE), 5)
+        main.assert_called_once_with()
+
+    def test_no_fallback_after_sent(self):
+        # a server which closes the connection after reading the request
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(self.socket_path)
+        listener.listen(1)
+        requests = []
+
+        def _serve():
+            conn, _ = listener.accept()
+            with conn:
+                data, fds, _, _ = socket.recv_fds(conn, 4, 3)
+                for fd in fds:
+                    os.close(fd)
+                requests.append(data)
+
+        thread = threading.Thread(target=_serve)
+        thread.start()
+        with open(os.devnull) as stdin, \
+                open(os.path.join(self.tmp_dir, 'stdout'), 'w') as stdout, \
+                mock.patch('sys.stdin', stdin), \
+                mock.patch('sys.stdout', stdout), \
+                mock.patch.dict('os.environ',
+                                {client.ENV_SOCKET: self.socket_path}), \
+                mock.patch('anyutils.cmd.base.main') as main:
+            self.assertEqual(client._main(client.PROG_BASE), 1)
+        thread.join()
+        self.assertEqual(len(requests), 1)
+        main.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import subprocess
+import sys
+import unittest
+
+from anyutils.cmd import base
+from anyutils.cmd import lazy
+
+
+def get_imported_modules(*argv):
+    """Run any-utils with -X importtime, return the imported modules"""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'anyutils.cmd.base'] +
+        list(argv), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        modules.add(line.rsplit('|', 1)[-1].strip())
+    return modules
+
+
+class TestLazy(unittest.TestCase):
+
+    def test_find_command(self):
+        self.assertEqual(lazy.find_command(['-d', 'md5sum', 'a'],
+                                           base.COMMANDS), 'md5sum')
+        self.assertIsNone(lazy.find_command(['-h'], base.COMMANDS))
+        self.assertIsNone(lazy.find_command(['nope', 'md5sum'],
+                                            base.COMMANDS))
+
+    def test_import_cli(self):
+        for name, path in base.COMMANDS.items():
+            self.assertEqual(lazy.import_cli(path).NAME, name)
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import_only_chosen_module(self):
+        modules = get_imported_modules('json-get', '--help')
+        self.assertIn('anyutils.base.code', modules)
+        for module in ['anyutils.base.fs', 'anyutils.base.archive',
+                       'anyutils.base.setpip', 'anyutils.base.mirrors',
+                       'anyutils.base.confeditor', 'anyutils.base.tail']:
+            self.assertNotIn(module, modules)
+
+    def test_json_get_without_md5sum_modules(self):
+        script = ('import sys\n'
+                  'from anyutils.cmd import base\n'
+                  'sys.argv = ["any-utils", "json-get", "-k", "a"]\n'
+                  'base.main()\n'
+                  'print(" ".join(sorted(sys.modules)))\n')
+        process = subprocess.run(
+            [sys.executable, '-c', script], input='{"a": [1]}',
+            stdout=subprocess.PIPE, universal_newlines=True)
+        lines = process.stdout.splitlines()
+        self.assertEqual(lines[0], '[1]')
+        modules = lines[-1].split()
+        self.assertIn('anyutils.base.jsonpath', modules)
+        for module in ['sqlite3', 'anyutils.base.hashcache',
+                       'anyutils.base.checksum', 'anyutils.base.passwords',
+                       'csv']:
+            self.assertNotIn(module, modules)
+
+    def test_import_all_for_help(self):
+        modules = get_imported_modules('--help')
+        for path in base.COMMANDS.values():
+            self.assertIn(path.partition(':')[0], modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,373 @@
+"""Chunked, pipelined and resumable SFTP transfers
+
+A large file is split into chunks which are transferred by several SFTP
+channels of one connection in parallel. Each channel has a large window and
+its reads and writes are pipelined. Each chunk is verified by md5, the md5
+of remote chunk is computed by dd and md5sum on the host.
+
+The data is written to <path>.anypart and the completed chunks are recorded
+in a state file, an interrupted transfer is resumed from them as long as
+the source file is not changed. Files not larger than a chunk are
+transferred by one channel as they are.
+"""
+import hashlib
+import json
+import os
+import queue
+import shlex
+import threading
+import time
+from concurrent import futures
+
+import paramiko
+
+from anycode.common import log
+from anyutils import utils
+from anyutils.extensions import sshcp
+
+LOG = log.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_CHANNELS = 4
+# the window of paramiko channels is 2MiB by default, it limits the
+# throughput of links with large latency
+WINDOW_SIZE = 32 * 1024 * 1024
+# the size of SFTP read/write requests, larger requests are split by servers
+BLOCK_SIZE = 32 * 1024
+# the size of data read from local file at once
+READ_SIZE = 1024 * 1024
+PART_SUFFIX = '.anypart'
+STATE_SUFFIX = '.anystate'
+
+
+def get_chunks(size, chunk_size):
+    """Return list of (index, offset, length)"""
+    return [(index, offset, min(chunk_size, size - offset))
+            for index, offset in enumerate(range(0, size, chunk_size))]
+
+
+def load_state(path, source):
+    """Return the set of completed chunks if the source is not changed"""
+    if path is None:
+        return set()
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return set()
+    if state.get('source') != source:
+        LOG.debug('source of %s is changed, ignore it', path)
+        return set()
+    return set(state.get('done', []))
+
+
+def save_state(path, source, done):
+    if path is None:
+        return
+    tmp_path = '{}.{}'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'source': source, 'done': sorted(done)}, f)
+    os.replace(tmp_path, path)
+
+
+def _is_remote_file(sftp, path):
+    try:
+        sftp.stat(path)
+        return True
+    except IOError:
+        return False
+
+
+def remove_file(path):
+    if path is None:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ChunkedTransfer(object):
+    """Transfer files by the SFTP channels of transport
+
+    Param:
+        transport: the transport of an authenticated connection
+        chunk_size: the size of chunks, default is 16MiB
+        channels: the num of parallel SFTP channels, default is 4
+    Raise ValueError if chunk_size or channels is not positive.
+    """
+
+    def __init__(self, transport, chunk_size=None, channels=None):
+        self.transport = transport
+        self.chunk_size = DEFAULT_CHUNK_SIZE if chunk_size is None else \
+            chunk_size
+        self.channels = DEFAULT_CHANNELS if channels is None else channels
+        if self.chunk_size <= 0 or self.channels <= 0:
+            raise ValueError('chunk size and channels must > 0, got {} '
+                             'and {}'.format(self.chunk_size, self.channels))
+        self._sftps = queue.Queue()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def _open_sftp(self):
+        sftp = paramiko.SFTPClient.from_transport(
+            self.transport, window_size=WINDOW_SIZE)
+        self._opened.append(sftp)
+        return sftp
+
+    def get_sftp(self):
+        """Get an idle SFTP client, a new channel is opened if there is not"""
+        try:
+            return self._sftps.get_nowait()
+        except queue.Empty:
+            return self._open_sftp()
+
+    def put_sftp(self, sftp):
+        self._sftps.put(sftp)
+
+    def close(self):
+        for sftp in self._opened:
+            sftp.close()
+        self._opened = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def upload_path(self, local, remote):
+        """Upload file or dir to remote like sshcp.sftp_put"""
+        sftp = self.get_sftp()
+        self.put_sftp(sftp)
+        # NOTE: sftp_put uses the client only when no file is transferring
+        sshcp.sftp_put(sftp, local, remote, put=self.upload)
+
+    def download_path(self, remote, local_dir):
+        """Download remote file or dir into local_dir like sshcp.sftp_get"""
+        sftp = self.get_sftp()
+        self.put_sftp(sftp)
+        sshcp.sftp_get(sftp, remote, local_dir, get=self.download)
+
+    def remote_md5(self, path, index):
+        """Compute the md5 of a chunk of remote file on the host"""
+        command = 'dd if={} bs={} skip={} count=1 2>/dev/null | md5sum'.format(
+            shlex.quote(path), self.chunk_size, index)
+        outputs = sshcp.iter_cmd_output(self.transport, command)
+        data = []
+        while True:
+            try:
+                is_stderr, output = next(outputs)
+            except StopIteration as e:
+                status = e.value
+                break
+            if not is_stderr:
+                data.append(output)
+        md5 = b''.join(data).decode('utf-8', 'replace').split(' ')[0]
+        if status or len(md5) != 32:
+            raise IOError('compute md5 of {} failed, dd and md5sum are '
+                          'required on the host'.format(path))
+        return md5
+
+    def _run_chunks(self, chunks, func):
+        """Run func(sftp, index, offset, length) with parallel channels"""
+        if not chunks:
+            return
+        with futures.ThreadPoolExecutor(min(self.channels,
+                                            len(chunks))) as executor:
+
+            def _run(chunk):
+                sftp = self.get_sftp()
+                try:
+                    func(sftp, *chunk)
+                finally:
+                    self.put_sftp(sftp)
+
+            for chunk_futures in [executor.submit(_run, chunk)
+                                  for chunk in chunks]:
+                chunk_futures.result()
+
+    def _transfer(self, size, source, state_path, done, func):
+        chunks = get_chunks(size, self.chunk_size)
+        if done:
+            LOG.info('resume from %s of %s chunks', len(done), len(chunks))
+        else:
+            save_state(state_path, source, done)
+
+        def _transfer_chunk(sftp, index, offset, length):
+            func(sftp, index, offset, length)
+            with self._lock:
+                done.add(index)
+                save_state(state_path, source, done)
+
+        start_time = time.time()
+        self._run_chunks([chunk for chunk in chunks if chunk[0] not in done],
+                         _transfer_chunk)
+        LOG.debug('transfer %s bytes in %.2f seconds', size,
+                  time.time() - start_time)
+
+    def _check_md5(self, path, index, md5):
+        remote_md5 = self.remote_md5(path, index)
+        if md5 != remote_md5:
+            raise IOError('md5 of chunk {} of {} mismatched, {} != {}'.format(
+                index, path, md5, remote_md5))
+
+    def get_upload_state_path(self, remote):
+        """Return the path of state file, None if the cache dir is unusable"""
+        try:
+            cache_dir = utils.get_cache_dir('sftpchunk')
+        except OSError as e:
+            LOG.warning('cache dir is unusable, upload can not be resumed: '
+                        '%s', e)
+            return None
+        return os.path.join(cache_dir, '{}.json'.format(
+            hashlib.md5('{}@{}:{}'.format(
+                self.transport.get_username(),
+                ':'.join(map(str, self.transport.getpeername()[:2])),
+                remote).encode()).hexdigest()))
+
+    def upload(self, local, remote):
+        """Upload local file to remote path"""
+        size = os.path.getsize(local)
+        if size <= self.chunk_size:
+            sftp = self.get_sftp()
+            try:
+                sftp.put(local, remote)
+            finally:
+                self.put_sftp(sftp)
+            return
+        part = remote + PART_SUFFIX
+        local_stat = os.stat(local)
+        source = [size, local_stat.st_mtime_ns]
+        state_path = self.get_upload_state_path(remote)
+        sftp = self.get_sftp()
+        try:
+            done = _is_remote_file(sftp, part) and \
+                load_state(state_path, source) or set()
+            if not done:
+                with sftp.open(part, 'w') as f:
+                    f.truncate(size)
+        finally:
+            self.put_sftp(sftp)
+
+        def _upload_chunk(sftp, index, offset, length):
+            md5 = hashlib.md5()
+            with open(local, 'rb') as src, sftp.open(part, 'r+') as dst:
+                dst.set_pipelined(True)
+                src.seek(offset)
+                dst.seek(offset)
+                while length > 0:
+                    data = src.read(min(READ_SIZE, length))
+                    if not data:
+                        raise IOError('{} is truncated'.format(local))
+                    md5.update(data)
+                    dst.write(data)
+                    length -= len(data)
+            self._check_md5(part, index, md5.hexdigest())
+
+        self._transfer(size, source, state_path, done, _upload_chunk)
+        sftp = self.get_sftp()
+        try:
+            part_size = sftp.stat(part).st_size
+            if part_size != size:
+                raise IOError('size of {} is {}, but {} is expected'.format(
+                    part, part_size, size))
+            try:
+                sftp.posix_rename(part, remote)
+            except IOError:
+                # the posix-rename extension is not supported
+                if _is_remote_file(sftp, remote):
+                    sftp.remove(remote)
+                sftp.rename(part, remote)
+            sftp.chmod(remote, local_stat.st_mode & 0o7777)
+        finally:
+            self.put_sftp(sftp)
+        remove_file(state_path)
+
+    def download(self, remote, local):
+        """Download remote file to local path"""
+        sftp = self.get_sftp()
+        try:
+            attr = sftp.stat(remote)
+            if attr.st_size <= self.chunk_size:
+                sftp.get(remote, local)
+                return
+        finally:
+            self.put_sftp(sftp)
+        size = attr.st_size
+        source = [size, attr.st_mtime]
+        part = local + PART_SUFFIX
+        state_path = local + STATE_SUFFIX
+        done = os.path.exists(part) and \
+            load_state(state_path, source) or set()
+        with open(part, 'r+b' if done else 'wb') as f:
+            f.truncate(size)
+            fd = f.fileno()
+
+            def _download_chunk(sftp, index, offset, length):
+                md5 = hashlib.md5()
+                with sftp.open(remote, 'r') as src:
+                    # readv sends all of the read requests before waiting
+                    # for the responses
+                    blocks = [(block_offset,
+                               min(BLOCK_SIZE, offset + length - block_offset))
+                              for block_offset in range(offset,
+                                                        offset + length,
+                                                        BLOCK_SIZE)]
+                    for (block_offset, _), data in zip(blocks,
+                                                       src.readv(blocks)):
+                        md5.update(data)
+                        os.pwrite(fd, data, block_offset)
+                self._check_md5(remote, index, md5.hexdigest())
+
+            self._transfer(size, source, state_path, done, _download_chunk)
+            os.fsync(fd)
+        os.replace(part, local)
+        if attr.st_mode is not None:
+            os.chmod(local, attr.st_mode & 0o7777)
+        remove_file(state_path)
+
+
+@sshcp.make_result
+def upload_to_host(scp_request, chunk_size=None, channels=None):
+    LOG.debug('upload to host %s by chunks', scp_request.host)
+    client = sshcp.connect(scp_request)
+    try:
+        with ChunkedTransfer(client.get_transport(), chunk_size=chunk_size,
+                             channels=channels) as transfer:
+            transfer.upload_path(scp_request.local, scp_request.remote)
+    finally:
+        client.close()
+    return 'success'
+
+
+@sshcp.make_result
+def download_from_host(scp_request, chunk_size=None, channels=None):
+    LOG.debug('download from host %s by chunks', scp_request.host)
+    client = sshcp.connect(scp_request)
+    try:
+        with ChunkedTransfer(client.get_transport(), chunk_size=chunk_size,
+                             channels=channels) as transfer:
+            transfer.download_path(scp_request.remote, scp_request.local)
+    finally:
+        client.close()
+    return 'success'
+
+
+@sshcp.show_results
+def transfer_on_hosts(action, scp_requests, worker=None, chunk_size=None,
+                      channels=None):
+    """Upload or download by chunks on hosts
+
+    Param:
+        action: upload or download
+    """
+    func = upload_to_host if action == 'upload' else download_from_host
+    worker = worker or len(scp_requests)
+    LOG.info('%s on %s hosts by chunks, worker is %s', action,
+             len(scp_requests), worker)
+    with futures.ThreadPoolExecutor(worker) as executor:
+        return list(executor.map(
+            lambda request: func(request, chunk_size=chunk_size,
+                                 channels=channels),
+            scp_requests))
@@ -0,0 +1,256 @@
+"""Run ssh commands and transfers on many hosts with asyncio
+
+All hosts are driven by one event loop, the num of concurrent sessions is
+limited by a semaphore and each host has a timeout. asyncssh is used if it
+is installed, otherwise paramiko is called by a thread pool whose size is
+the concurrency, so there are never more threads than concurrent sessions.
+The threads of timed out hosts can not be cancelled, their connections are
+closed to stop them, and their sessions are counted until the threads
+complete.
+"""
+import asyncio
+import os
+import socket
+import threading
+import time
+from concurrent import futures
+
+import paramiko
+
+from anycode.common import log
+from anyutils.extensions import sshcp
+
+LOG = log.getLogger(__name__)
+
+ENGINE_THREAD = 'thread'
+ENGINE_ASYNCIO = 'asyncio'
+ENGINES = [ENGINE_THREAD, ENGINE_ASYNCIO]
+DEFAULT_CONCURRENCY = 200
+
+ACTION_RUN = 'run'
+ACTION_UPLOAD = 'upload'
+ACTION_DOWNLOAD = 'download'
+
+
+def is_support_asyncssh():
+    try:
+        import asyncssh                  # noqa
+        return True
+    except ImportError:
+        return False
+
+
+class Session(object):
+    """The connection of a call in thread, it is closed to stop the thread"""
+
+    def __init__(self, request):
+        self.request = request
+        self.client = None
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def connect(self):
+        client = sshcp.connect(self.request)
+        with self._lock:
+            if self.closed:
+                client.close()
+                raise paramiko.SSHException('session is closed')
+            self.client = client
+        return client
+
+    def close(self):
+        """Close the connection, the thread fails on its next read"""
+        with self._lock:
+            self.closed = True
+            if self.client:
+                self.client.close()
+
+
+class ParamikoBackend(object):
+    """Call paramiko in a thread pool"""
+    NAME = 'paramiko'
+
+    def __init__(self, concurrency, get_pty=False):
+        self.executor = futures.ThreadPoolExecutor(concurrency)
+        self.get_pty = get_pty
+
+    def _run(self, session):
+        request = session.request
+        client = session.connect()
+        try:
+            outputs = sshcp.iter_cmd_output(
+                client.get_transport(), request.command,
+                get_pty=self.get_pty, timeout=request.timeout)
+            data = []
+            while True:
+                try:
+                    data.append(next(outputs)[1])
+                except StopIteration as e:
+                    return e.value, b''.join(data).decode('utf-8', 'replace')
+        finally:
+            client.close()
+
+    def _upload(self, session):
+        request = session.request
+        client = session.connect()
+        try:
+            with client.open_sftp() as sftp:
+                sshcp.sftp_put(sftp, request.local, request.remote)
+        finally:
+            client.close()
+        return 0, 'success'
+
+    def _download(self, session):
+        request = session.request
+        client = session.connect()
+        try:
+            with client.open_sftp() as sftp:
+                sshcp.sftp_get(sftp, request.remote, request.local)
+        finally:
+            client.close()
+        return 0, 'success'
+
+    async def call(self, action, request):
+        func = {ACTION_RUN: self._run, ACTION_UPLOAD: self._upload,
+                ACTION_DOWNLOAD: self._download}[action]
+        session = Session(request)
+        future = self.executor.submit(func, session)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # NOTE: the thread can not be cancelled, close its connection to
+            # stop it, and complete after it so that the session is counted
+            # until then
+            if not future.cancel():
+                session.close()
+                await asyncio.wait([asyncio.wrap_future(future)])
+            raise
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class AsyncsshBackend(object):
+    NAME = 'asyncssh'
+
+    def __init__(self, concurrency, get_pty=False):
+        import asyncssh
+        self.asyncssh = asyncssh
+        self.get_pty = get_pty
+
+    def _connect(self, request):
+        return self.asyncssh.connect(
+            request.host, port=int(request.port or 22),
+            username=request.user, password=request.password or None,
+            known_hosts=None,
+            connect_timeout=request.timeout or sshcp.ssh.DEFAULT_TIMEOUT)
+
+    async def call(self, action, request):
+        async with self._connect(request) as conn:
+            if action == ACTION_RUN:
+                result = await conn.run(
+                    request.command, check=False,
+                    term_type=self.get_pty and 'xterm' or None)
+                return result.exit_status, '{}{}'.format(
+                    result.stdout or '', result.stderr or '')
+            async with conn.start_sftp_client() as sftp:
+                if action == ACTION_UPLOAD:
+                    await sftp.put(request.local, remotepath=request.remote,
+                                   recurse=True)
+                else:
+                    if not os.path.exists(request.local):
+                        os.makedirs(request.local)
+                    await sftp.get(request.remote, localpath=request.local,
+                                   recurse=True)
+            return 0, 'success'
+
+    def close(self):
+        pass
+
+
+def get_backend(concurrency, backend=None, get_pty=False):
+    """Get the backend, asyncssh is preferred if backend is None"""
+    if backend == AsyncsshBackend.NAME or \
+       (backend is None and is_support_asyncssh()):
+        return AsyncsshBackend(concurrency, get_pty=get_pty)
+    return ParamikoBackend(concurrency, get_pty=get_pty)
+
+
+async def _call_on_host(backend, semaphore, action, request, host_timeout):
+    """Return {'host': host, 'output': output, 'ok': bool}"""
+    error = None
+    await semaphore.acquire()
+    task = asyncio.ensure_future(backend.call(action, request))
+    # NOTE: release the session once the call is completed, it may be
+    # later than the timeout
+    task.add_done_callback(lambda _: semaphore.release())
+    try:
+        status, output = await asyncio.wait_for(asyncio.shield(task),
+                                                host_timeout)
+        if status:
+            error = 'exit status {}'.format(status)
+    except asyncio.TimeoutError:
+        task.cancel()
+        output, error = '', 'Timeout({} seconds)'.format(host_timeout)
+    except socket.timeout:
+        output, error = '', 'Connect timeout'
+    except paramiko.ssh_exception.AuthenticationException:
+        output = ''
+        error = 'Auth failed, password is correct? (-p <PASSWORD>)'
+    except Exception as e:
+        output, error = '', str(e) or e.__class__.__name__
+    if error:
+        output = '{}{}ERROR: {}'.format(
+            output, output and not output.endswith('\n') and '\n' or '',
+            error)
+    return {'host': request.host, 'output': output, 'ok': not error}
+
+
+async def _call_on_hosts(action, requests, concurrency, host_timeout,
+                         callback, backend, get_pty):
+    semaphore = asyncio.Semaphore(concurrency)
+    backend = get_backend(concurrency, backend=backend, get_pty=get_pty)
+    LOG.debug('ssh backend is %s', backend.NAME)
+    try:
+        tasks = [_call_on_host(backend, semaphore, action, request,
+                               host_timeout)
+                 for request in requests]
+        failed = 0
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            if not result['ok']:
+                failed += 1
+            callback(result)
+        return failed
+    finally:
+        backend.close()
+
+
+def print_result(result):
+    print('===== {} ====='.format(result['host']))
+    print(result['output'])
+
+
+def call_on_hosts(action, requests, concurrency=None, host_timeout=None,
+                  callback=None, backend=None, get_pty=False):
+    """Run action on hosts, callback is called once a host completes
+
+    Param:
+        action: run, upload or download
+        concurrency: the max num of concurrent sessions
+        host_timeout: the timeout of each host, including connecting
+        backend: asyncssh or paramiko, default is asyncssh if it is installed
+        get_pty: run commands with pty
+    Return:
+        the num of failed hosts
+    """
+    start_time = time.time()
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    LOG.info('%s on %s hosts, concurrency is %s', action, len(requests),
+             concurrency)
+    failed = asyncio.run(_call_on_hosts(
+        action, requests, concurrency, host_timeout, callback or print_result,
+        backend, get_pty))
+    LOG.info('Spend %.2f seconds total, %s of %s hosts failed',
+             time.time() - start_time, failed, len(requests))
+    return failed
@@ -0,0 +1,235 @@
+"""Run a list of steps on hosts over pooled connections
+
+A steps file is a YAML or JSON list of steps, e.g.
+
+    - action: upload
+      local: app.tar.gz
+      remote: /tmp
+    - action: run
+      command: tar -xzf /tmp/app.tar.gz -C /opt
+    - action: download
+      remote: /opt/app/version.txt
+      local: ./versions
+
+All of the steps of a host use the same connection. By default each host
+runs its steps as a pipeline and goes to the next step as soon as its
+previous step is completed, with --barrier a step starts after the previous
+step is completed on all hosts. The steps after a failed step are skipped.
+"""
+import json
+import os
+import threading
+import time
+from concurrent import futures
+
+from anycode.common import cliparser
+from anycode.common import log
+from anycode.pysshpass import ssh
+from anyutils.extensions import sshcp
+from anyutils.extensions import sshpool
+
+LOG = log.getLogger(__name__)
+
+ACTION_RUN = 'run'
+ACTION_UPLOAD = 'upload'
+ACTION_DOWNLOAD = 'download'
+# the required keys of actions
+ACTIONS = {
+    ACTION_RUN: ['command'],
+    ACTION_UPLOAD: ['local', 'remote'],
+    ACTION_DOWNLOAD: ['remote', 'local'],
+}
+YAML_EXTENSIONS = ('.yaml', '.yml')
+
+
+def _load_yaml(f):
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError('PyYAML is not installed, please install it or '
+                         'use JSON steps')
+    try:
+        return yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        raise ValueError(str(e))
+
+
+def load_steps(path):
+    """Load and check steps, raise ValueError if they are invalid
+
+    The file is parsed as YAML if its extension is .yaml or .yml, otherwise
+    as JSON.
+    """
+    with open(path) as f:
+        if path.lower().endswith(YAML_EXTENSIONS):
+            steps = _load_yaml(f)
+        else:
+            steps = json.load(f)
+    if not isinstance(steps, list) or not steps:
+        raise ValueError('steps must be a non-empty list')
+    for index, step in enumerate(steps, 1):
+        if not isinstance(step, dict) or step.get('action') not in ACTIONS:
+            raise ValueError('step {}: action must be one of {}'.format(
+                index, list(ACTIONS)))
+        missing = [key for key in ACTIONS[step['action']]
+                   if not step.get(key)]
+        if missing:
+            raise ValueError('step {}: {} is required'.format(
+                index, ', '.join(missing)))
+        if step['action'] == ACTION_UPLOAD and \
+           not os.path.exists(step['local']):
+            raise ValueError('step {}: local file {} not found'.format(
+                index, step['local']))
+    return steps
+
+
+def run_step(pool, request, step, get_pty=False):
+    """Run step on the host of request
+
+    Return:
+        (True if it succeeds, output)
+    """
+    try:
+        if step['action'] == ACTION_RUN:
+            status, output = pool.run(request, step['command'],
+                                      get_pty=get_pty)
+            if status:
+                output += '{}ERROR: exit status {}'.format(
+                    output and not output.endswith('\n') and '\n' or '',
+                    status)
+            return not status, output
+        if step['action'] == ACTION_UPLOAD:
+            pool.upload(request, step['local'], step['remote'])
+        else:
+            # save to <local>/<host> like scp-get
+            pool.download(request, step['remote'],
+                          os.path.join(step['local'], request.host))
+        return True, 'success'
+    except Exception as e:
+        LOG.debug('step %s failed on %s: %s', step, request.host, e)
+        return False, 'ERROR: {}'.format(str(e) or e.__class__.__name__)
+
+
+def get_step_name(step):
+    if step.get('name'):
+        return step['name']
+    if step['action'] == ACTION_RUN:
+        return 'run: {}'.format(step['command'])
+    return '{}: {}'.format(step['action'], step.get('local') or
+                           step.get('remote'))
+
+
+def print_result(request, index, step, ok, output):
+    print('===== {} [{}] {} ====='.format(request.host, index,
+                                          get_step_name(step)))
+    print(output)
+
+
+def run_pipeline(pool, request, steps, callback, get_pty=False):
+    """Run steps on the host one by one, stop at the first failed step
+
+    Return:
+        True if all of the steps succeed
+    """
+    for index, step in enumerate(steps, 1):
+        ok, output = run_step(pool, request, step, get_pty=get_pty)
+        callback(request, index, step, ok, output)
+        if not ok:
+            return False
+    return True
+
+
+def _run_with_barrier(pool, executor, requests, steps, callback, get_pty):
+    alive = list(requests)
+    for index, step in enumerate(steps, 1):
+        LOG.info('step %s/%s %s on %s hosts', index, len(steps),
+                 get_step_name(step), len(alive))
+        results = executor.map(
+            lambda request: run_step(pool, request, step, get_pty=get_pty),
+            alive)
+        succeeded = []
+        for request, (ok, output) in zip(alive, results):
+            callback(request, index, step, ok, output)
+            if ok:
+                succeeded.append(request)
+        alive = succeeded
+        if not alive:
+            break
+    return len(requests) - len(alive)
+
+
+def run_batch(requests, steps, worker=None, get_pty=False, callback=None,
+              barrier=False):
+    """Run steps on hosts
+
+    Param:
+        callback: called with (request, index, step, ok, output) after each
+                  step of each host, the calls are serialized
+        barrier: if it is True, a step starts after the previous step is
+                 completed on all hosts, otherwise the hosts run their steps
+                 independently
+    Return:
+        the num of failed hosts
+    """
+    callback = callback or print_result
+    worker = worker or len(requests)
+    start_time = time.time()
+    lock = threading.Lock()
+
+    def _callback(*args):
+        with lock:
+            callback(*args)
+
+    with sshpool.ConnectionPool() as pool, \
+            futures.ThreadPoolExecutor(worker) as executor:
+        if barrier:
+            failed = _run_with_barrier(pool, executor, requests, steps,
+                                       callback, get_pty)
+        else:
+            LOG.info('run %s steps on %s hosts', len(steps), len(requests))
+            failed = list(executor.map(
+                lambda request: run_pipeline(pool, request, steps, _callback,
+                                             get_pty=get_pty),
+                requests)).count(False)
+    LOG.info('Spend %.2f seconds total, %s of %s hosts failed',
+             time.time() - start_time, failed, len(requests))
+    return failed
+
+
+class SSHBatch(cliparser.CliBase):
+    NAME = 'ssh-batch'
+    ARGUMENTS = [
+        cliparser.Argument('host',
+                           help='The host to connect, string or file. '
+                                'String like: root@host1 , File like: '
+                                'root@host1 port=80 password=PASSWORD'),
+        cliparser.Argument('steps',
+                           help='The YAML or JSON file of steps, e.g. '
+                                '[{"action": "run", "command": "uptime"}, '
+                                '{"action": "upload", "local": "a.txt", '
+                                '"remote": "/tmp"}, {"action": "download", '
+                                '"remote": "/tmp/a.txt", "local": "./"}]'),
+        cliparser.Argument('--barrier', action='store_true',
+                           help='Start a step after the previous step is '
+                                'completed on all hosts'),
+    ] + sshcp.BASE_SSH_ARGUMENTS
+
+    def __call__(self, args):
+        try:
+            steps = load_steps(args.steps)
+        except (IOError, ValueError) as e:
+            LOG.error('load steps from %s failed: %s', args.steps, e)
+            return 1
+        requests = []
+        for user, host, _, opts in sshcp.get_connect_info(args):
+            requests.append(ssh.CmdRequest(
+                None, host, user=user or args.user,
+                password=opts.get('password', args.password),
+                port=opts.get('port', args.port), timeout=args.timeout))
+        failed = run_batch(requests, steps, worker=args.worker,
+                           get_pty=args.get_pty, barrier=args.barrier)
+        return failed and 1 or 0
+
+
+def list_sub_commands():
+    return [SSHBatch]
@@ -1,7 +1,15 @@
+import argparse
+import getpass
 import os
+import posixpath
 import re
+import select
 import socket
+import stat
+import sys
 import paramiko
+import tempfile
+import threading
 import time
 from concurrent import futures
 
@@ -12,6 +20,20 @@ from anycode.pysshpass import ssh
 LOG = log.getLogger(__name__)
 
 RE_CONNECTION = re.compile(r'((.*)@){0,1}([^:]+)(:(.*)){0,1}')
+
+
+def positive_int(value):
+    """The type of arguments which must be integers >= 1"""
+    try:
+        num = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid int value: {!r}'.format(value))
+    if num <= 0:
+        raise argparse.ArgumentTypeError('must >= 1, got {}'.format(num))
+    return num
+
+
 BASE_SSH_ARGUMENTS = [
     cliparser.Argument('-T', '--get_pty', action='store_true',
                        help='if set, use pty'),
@@ -27,8 +49,36 @@ BASE_SSH_ARGUMENTS = [
                        help='The password for login, default is "". It will be'
                             ' overwrited if set password=<PASSWORD> in file.'),
     cliparser.Argument('-w', '--worker', type=int,
-                       help='Execute worker, use hosts num if not set'),
+                       help='Execute worker, use hosts num if not set. It '
+                            'is the max num of concurrent sessions for '
+                            'asyncio engine, default is 200'),
+]
+ENGINE_ARGUMENTS = [
+    cliparser.Argument('--engine', default='thread',
+                       choices=['thread', 'asyncio'],
+                       help='thread: a thread for each host; asyncio: all '
+                            'hosts in one event loop, default is thread'),
+    cliparser.Argument('--host-timeout', type=float,
+                       help='The timeout of each host for asyncio engine'),
 ]
+CHUNK_ARGUMENTS = [
+    cliparser.Argument('--chunked', action='store_true',
+                       help='Transfer large files by chunks over parallel '
+                            'SFTP channels, the chunks are verified by md5 '
+                            'and an interrupted transfer is resumed. dd and '
+                            'md5sum are required on the hosts'),
+    cliparser.Argument('--chunk-size', type=positive_int, default=16,
+                       help='The size (MiB) of chunks, default is 16'),
+    cliparser.Argument('--channels', type=positive_int, default=4,
+                       help='The num of parallel SFTP channels of each host, '
+                            'default is 4. Each channel may open another '
+                            'session to verify chunks, the MaxSessions of '
+                            'sshd is 10 by default'),
+]
+
+
+DEFAULT_MAX_OUTPUT = 1024 * 1024
+READ_SIZE = 32 * 1024
 
 
 def is_support_tqdm():
@@ -145,6 +195,283 @@ def run_cmd_on_hosts(cmd_requests, worker=None):
     return results
 
 
+def connect(request):
+    """Connect and login to the host of request, return SSHClient"""
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(request.host, port=int(request.port or 22),
+                   username=request.user, password=request.password or None,
+                   timeout=request.timeout or ssh.DEFAULT_TIMEOUT,
+                   banner_timeout=request.timeout or ssh.DEFAULT_TIMEOUT)
+    return client
+
+
+def iter_cmd_output(transport, command, get_pty=False, timeout=None):
+    """Run command by a new channel of transport, yield the output
+
+    Yield (True, data) for stderr and (False, data) for stdout, the exit
+    status of command is returned at last.
+    """
+    channel = transport.open_session(timeout=timeout)
+    try:
+        if get_pty:
+            channel.get_pty()
+        channel.exec_command(command)
+        # NOTE: the exit status may arrive before the output, so read until
+        # EOF rather than the exit status
+        while not (channel.eof_received or channel.closed):
+            if channel.recv_ready():
+                yield False, channel.recv(READ_SIZE)
+            elif channel.recv_stderr_ready():
+                yield True, channel.recv_stderr(READ_SIZE)
+            else:
+                select.select([channel], [], [], 1)
+        # the data before EOF is buffered, recv returns b'' after it
+        for data in iter(lambda: channel.recv(READ_SIZE), b''):
+            yield False, data
+        for data in iter(lambda: channel.recv_stderr(READ_SIZE), b''):
+            yield True, data
+        return channel.recv_exit_status()
+    finally:
+        channel.close()
+
+
+def _is_remote_dir(sftp, path):
+    try:
+        return stat.S_ISDIR(sftp.stat(path).st_mode)
+    except IOError:
+        return False
+
+
+def sftp_put(sftp, local, remote, put=None):
+    """Upload file or dir to remote
+
+    If remote is a dir, local is uploaded into it.
+    Param:
+        put: the function to upload a file, default is sftp.put
+    """
+    put = put or sftp.put
+    if _is_remote_dir(sftp, remote):
+        remote = posixpath.join(remote, os.path.basename(
+            os.path.abspath(local)))
+    if not os.path.isdir(local):
+        put(local, remote)
+        return
+    for root, dirs, files in os.walk(local):
+        relpath = os.path.relpath(root, local)
+        remote_root = remote if relpath == '.' else \
+            posixpath.join(remote, *relpath.split(os.sep))
+        if not _is_remote_dir(sftp, remote_root):
+            sftp.mkdir(remote_root)
+        for name in files:
+            put(os.path.join(root, name), posixpath.join(remote_root, name))
+
+
+def sftp_get(sftp, remote, local_dir, get=None):
+    """Download remote file or dir into local_dir
+
+    Param:
+        get: the function to download a file, default is sftp.get
+    """
+    get = get or sftp.get
+    if not os.path.exists(local_dir):
+        os.makedirs(local_dir)
+    local = os.path.join(local_dir, posixpath.basename(remote.rstrip('/')))
+    if not _is_remote_dir(sftp, remote):
+        get(remote, local)
+        return
+    if not os.path.exists(local):
+        os.makedirs(local)
+    for attr in sftp.listdir_attr(remote):
+        path = posixpath.join(remote, attr.filename)
+        if stat.S_ISDIR(attr.st_mode):
+            sftp_get(sftp, path, local, get=get)
+        else:
+            get(path, os.path.join(local, attr.filename))
+
+
+class HostOutput(object):
+    """The output of a host, it is printed by StreamPrinter"""
+
+    def __init__(self, printer, host, name=None):
+        self.printer = printer
+        self.host = host
+        self.name = name or host
+        self.size = 0
+        self._buffer = []
+        self._partial = {}
+        self._spill_file = None
+        self.spill_path = None
+
+    def write(self, data, is_stderr=False):
+        if self.printer.prefix:
+            lines = (self._partial.pop(is_stderr, b'') + data).split(b'\n')
+            partial = lines.pop()
+            if len(partial) >= self.printer.max_output:
+                # NOTE: a long line without newline is printed in pieces
+                # once it reaches max_output bytes, so it is not kept in
+                # memory
+                lines.append(partial)
+            elif partial:
+                self._partial[is_stderr] = partial
+            self.printer.print_lines(self.host, lines)
+            return
+        if self._spill_file is None and \
+           self.size + len(data) > self.printer.max_output:
+            self._spill()
+        if self._spill_file:
+            self._spill_file.write(data)
+        else:
+            self._buffer.append(data)
+        self.size += len(data)
+
+    def getvalue(self):
+        return b''.join(self._buffer)
+
+    def _spill(self):
+        self.spill_path = os.path.join(self.printer.get_spill_dir(),
+                                       '{}.out'.format(self.name))
+        self._spill_file = open(self.spill_path, 'wb')
+        for data in self._buffer:
+            self._spill_file.write(data)
+        self._buffer = []
+
+    def close(self, status=None, error=None):
+        if self._spill_file:
+            self._spill_file.close()
+        if self.printer.prefix:
+            self.printer.print_lines(self.host, list(self._partial.values()))
+            if error or status:
+                self.printer.print_lines(self.host, [
+                    'ERROR: {}'.format(error or 'exit status {}'.format(
+                        status)).encode('utf-8')])
+            return
+        self.printer.print_block(self, status=status, error=error)
+
+
+class StreamPrinter(object):
+    """Print the output of hosts as soon as they are received
+
+    If prefix is True, lines are printed with the host prefix once they are
+    received, otherwise the output of host is printed once the command
+    completes. The output more than max_output bytes of a host is saved to
+    the file <spill_dir>/<user>@<host>_<port>.out.
+    """
+
+    def __init__(self, prefix=False, max_output=None, spill_dir=None,
+                 stream=None):
+        self.prefix = prefix
+        self.max_output = max_output or DEFAULT_MAX_OUTPUT
+        self.spill_dir = spill_dir
+        self.stream = stream or sys.stdout.buffer
+        self._lock = threading.Lock()
+
+    def get_spill_dir(self):
+        with self._lock:
+            if not self.spill_dir:
+                self.spill_dir = tempfile.mkdtemp(prefix='anyutils-ssh-')
+            elif not os.path.exists(self.spill_dir):
+                os.makedirs(self.spill_dir)
+        return self.spill_dir
+
+    def open(self, host, name=None):
+        """Open the output of host
+
+        Param:
+            name: the name of spill file, default is the host
+        """
+        return HostOutput(self, host, name=name)
+
+    def print_lines(self, host, lines):
+        prefix = '{}: '.format(host).encode('utf-8')
+        data = b''.join(prefix + line.rstrip(b'\r') + b'\n'
+                        for line in lines)
+        with self._lock:
+            self.stream.write(data)
+            self.stream.flush()
+
+    def print_block(self, output, status=None, error=None):
+        with self._lock:
+            self.stream.write('===== {} =====\n'.format(
+                output.host).encode('utf-8'))
+            if output.spill_path:
+                self.stream.write(
+                    'output is too large ({} bytes), saved to {}\n'.format(
+                        output.size, output.spill_path).encode('utf-8'))
+            else:
+                data = output.getvalue()
+                self.stream.write(data)
+                if data and not data.endswith(b'\n'):
+                    self.stream.write(b'\n')
+            if error or status:
+                self.stream.write('ERROR: {}\n'.format(
+                    error or 'exit status {}'.format(status)).encode(
+                        'utf-8'))
+            self.stream.flush()
+
+
+def stream_cmd_on_host(cmd_request, printer, get_pty=False):
+    """Run command on host, print the output by printer while running
+
+    Return:
+        True if the command succeeds
+    """
+    # NOTE: a host may be connected with different users or ports
+    output = printer.open(cmd_request.host, name='{}@{}_{}'.format(
+        cmd_request.user or getpass.getuser(), cmd_request.host,
+        cmd_request.port or 22))
+    status, error = None, None
+    try:
+        client = connect(cmd_request)
+        try:
+            outputs = iter_cmd_output(client.get_transport(),
+                                      cmd_request.command, get_pty=get_pty,
+                                      timeout=cmd_request.timeout)
+            while True:
+                try:
+                    is_stderr, data = next(outputs)
+                except StopIteration as e:
+                    status = e.value
+                    break
+                output.write(data, is_stderr=is_stderr)
+        finally:
+            client.close()
+    except socket.timeout:
+        error = 'Connect timeout'
+    except paramiko.ssh_exception.AuthenticationException:
+        error = 'Auth failed, password is correct? (-p <PASSWORD>)'
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+    output.close(status=status, error=error)
+    return not error and not status
+
+
+def stream_cmd_on_hosts(cmd_requests, worker=None, prefix=False,
+                        max_output=None, spill_dir=None, get_pty=False):
+    """Run command on hosts and print the output of each host at once
+
+    The output is not collected, only the num of failed hosts is counted.
+    """
+    start_time = time.time()
+    worker = worker or len(cmd_requests)
+    LOG.info('run cmd on %s hosts, worker is %s', len(cmd_requests), worker)
+    printer = StreamPrinter(prefix=prefix, max_output=max_output,
+                            spill_dir=spill_dir)
+    failed = 0
+    with futures.ThreadPoolExecutor(worker) as executor:
+        tasks = [executor.submit(stream_cmd_on_host, request, printer,
+                                 get_pty=get_pty)
+                 for request in cmd_requests]
+        for task in futures.as_completed(tasks):
+            if not task.result():
+                failed += 1
+    if printer.spill_dir:
+        LOG.info('large outputs are saved to %s', printer.spill_dir)
+    LOG.info('Spend %.2f seconds total, %s of %s hosts failed',
+             time.time() - start_time, failed, len(cmd_requests))
+    return failed
+
+
 @show_results
 def download_from_hosts(scp_requests, worker=None):
     worker = worker or len(scp_requests)
@@ -191,8 +518,24 @@ class SSHCmd(cliparser.CliBase):
                            help='The host to connect, string or file. '
                                 'String like: root@host1 , File like: '
                                 'root@host1 port=80 password=PASSWORD'),
-        cliparser.Argument('command', help='The command to execute')
-    ] + BASE_SSH_ARGUMENTS
+        cliparser.Argument('command', help='The command to execute'),
+        cliparser.Argument('--stream', action='store_true',
+                           help='Print the output of each host once it '
+                                'completes'),
+        cliparser.Argument('--prefix', action='store_true',
+                           help='Print the output lines with host prefix '
+                                'once they are received'),
+        cliparser.Argument('--max-output', type=int,
+                           default=DEFAULT_MAX_OUTPUT,
+                           help='The max bytes of output of each host to '
+                                'keep in memory in stream mode, the output '
+                                'is saved to the spill dir if it is '
+                                'larger, default is {}'.format(
+                                    DEFAULT_MAX_OUTPUT)),
+        cliparser.Argument('--spill-dir',
+                           help='The dir to save large outputs, default is '
+                                'a temp dir'),
+    ] + BASE_SSH_ARGUMENTS + ENGINE_ARGUMENTS
 
     def __call__(self, args):
         requests = []
@@ -203,10 +546,43 @@ class SSHCmd(cliparser.CliBase):
                                  port=opts.get('port', args.port),
                                  timeout=args.timeout)
             requests.append(req)
-
+        if args.engine == 'asyncio':
+            # NOTE: the asyncio engine prints the output of each host once
+            # it completes, and keeps it in memory
+            if args.stream or args.prefix or args.spill_dir or \
+               args.max_output != DEFAULT_MAX_OUTPUT:
+                LOG.error('--stream, --prefix, --max-output and --spill-dir '
+                          'are not supported by the asyncio engine')
+                return 1
+            return call_on_hosts_async('run', requests, args)
+        if args.stream or args.prefix:
+            failed = stream_cmd_on_hosts(
+                requests, worker=args.worker, prefix=args.prefix,
+                max_output=args.max_output, spill_dir=args.spill_dir,
+                get_pty=args.get_pty)
+            return failed and 1 or 0
         run_cmd_on_hosts(requests, worker=args.worker)
 
 
+def transfer_chunked(action, requests, args):
+    # NOTE: import here, sftpchunk imports this module
+    from anyutils.extensions import sftpchunk
+    sftpchunk.transfer_on_hosts(action, requests, worker=args.worker,
+                                chunk_size=args.chunk_size * 1024 * 1024,
+                                channels=args.channels)
+
+
+def call_on_hosts_async(action, requests, args):
+    # NOTE: import the engine only when it is used
+    from anyutils.extensions import sshasync
+
+    failed = sshasync.call_on_hosts(action, requests,
+                                    concurrency=args.worker,
+                                    host_timeout=args.host_timeout,
+                                    get_pty=args.get_pty)
+    return failed and 1 or 0
+
+
 def get_connect_info(args):
     if os.path.isfile(args.host):
         connect_info = parse_connect_info_from_file(args.host)
@@ -224,7 +600,7 @@ class ScpGet(cliparser.CliBase):
         cliparser.Argument('--remote', help='Remote file path'),
         cliparser.Argument('--local', default='./',
                            help='The local path to save, defualt is ./ .')
-    ] + BASE_SSH_ARGUMENTS
+    ] + BASE_SSH_ARGUMENTS + ENGINE_ARGUMENTS + CHUNK_ARGUMENTS
 
     def __call__(self, args):
         requests = []
@@ -240,6 +616,10 @@ class ScpGet(cliparser.CliBase):
                                  port=opts.get('port', args.port),
                                  timeout=args.timeout)
             requests.append(req)
+        if args.chunked:
+            return transfer_chunked('download', requests, args)
+        if args.engine == 'asyncio':
+            return call_on_hosts_async('download', requests, args)
         download_from_hosts(requests, worker=args.worker)
 
 
@@ -251,7 +631,7 @@ class ScpPut(cliparser.CliBase):
                            help='The remote host to connect, string or file'),
         cliparser.Argument('--remote', default='./',
                            help='The remote path to save.'),
-    ] + BASE_SSH_ARGUMENTS
+    ] + BASE_SSH_ARGUMENTS + ENGINE_ARGUMENTS + CHUNK_ARGUMENTS
 
     def __call__(self, args):
         if not os.path.exists(args.local):
@@ -266,6 +646,10 @@ class ScpPut(cliparser.CliBase):
                                  port=opts.get('port', args.port),
                                  timeout=args.timeout)
             requests.append(req)
+        if args.chunked:
+            return transfer_chunked('upload', requests, args)
+        if args.engine == 'asyncio':
+            return call_on_hosts_async('upload', requests, args)
         upload_to_hosts(requests, worker=args.worker)
 
 
@@ -0,0 +1,93 @@
+"""Pool of authenticated SSH connections
+
+Connections are keyed by (user, host, port). Commands and SFTP sessions are
+opened as new channels of the existing connection, so the TCP connection,
+key exchange and authentication are done only once for each host.
+"""
+import threading
+
+from anycode.common import log
+from anyutils.extensions import sshcp
+
+LOG = log.getLogger(__name__)
+
+
+def make_key(request):
+    return request.user, request.host, int(request.port or 22)
+
+
+class ConnectionPool(object):
+
+    def __init__(self):
+        self._clients = {}
+        self._sftps = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _get_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.RLock())
+
+    def get_transport(self, request):
+        """Get the transport of host, connect if it is not connected"""
+        key = make_key(request)
+        with self._get_lock(key):
+            client = self._clients.get(key)
+            if client and client.get_transport() and \
+               client.get_transport().is_active():
+                return client.get_transport()
+            if client:
+                LOG.debug('connection to %s is closed, reconnect', key)
+                client.close()
+                self._sftps.pop(key, None)
+            LOG.debug('connect to %s', key)
+            client = sshcp.connect(request)
+            self._clients[key] = client
+            return client.get_transport()
+
+    def get_sftp(self, request):
+        """Get the SFTP client of host, it is opened once for each host"""
+        transport = self.get_transport(request)
+        key = make_key(request)
+        with self._get_lock(key):
+            sftp = self._sftps.get(key)
+            if sftp is None or sftp.get_channel().closed:
+                sftp = transport.open_sftp_client()
+                self._sftps[key] = sftp
+            return sftp
+
+    def run(self, request, command=None, get_pty=False):
+        """Run command by a new channel, return (exit status, output)"""
+        outputs = sshcp.iter_cmd_output(
+            self.get_transport(request), command or request.command,
+            get_pty=get_pty, timeout=request.timeout)
+        data = []
+        while True:
+            try:
+                data.append(next(outputs)[1])
+            except StopIteration as e:
+                return e.value, b''.join(data).decode('utf-8', 'replace')
+
+    def upload(self, request, local, remote):
+        # NOTE: the SFTP client is shared, requests of it are not thread safe
+        with self._get_lock(make_key(request)):
+            sshcp.sftp_put(self.get_sftp(request), local, remote)
+
+    def download(self, request, remote, local_dir):
+        with self._get_lock(make_key(request)):
+            sshcp.sftp_get(self.get_sftp(request), remote, local_dir)
+
+    def close(self):
+        with self._lock:
+            for sftp in self._sftps.values():
+                sftp.close()
+            for client in self._clients.values():
+                client.close()
+            self._sftps.clear()
+            self._clients.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,186 @@
+"""An in-process SSH server for tests
+
+Commands are run by the local shell, and the SFTP subsystem serves the
+local file system. Any user can login with PASSWORD.
+"""
+import os
+import socket
+import subprocess
+import threading
+import time
+
+import paramiko
+
+PASSWORD = 'secret'
+
+
+class ServerInterface(paramiko.ServerInterface):
+    # send the exit status before the output, like sshd may do when the
+    # output is still in the pipe after the command exits
+    early_exit_status = False
+
+    def __init__(self):
+        self.commands = {}
+
+    def check_auth_password(self, username, password):
+        if password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        thread = threading.Thread(target=self._run, args=(channel, command))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _run(self, channel, command):
+        # NOTE: the reply of exec request is sent after this thread starts,
+        # the client fails if the channel is closed before the reply
+        time.sleep(0.1)
+        process = subprocess.Popen(command, shell=True,
+                                   stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        if self.early_exit_status:
+            channel.send_exit_status(process.wait())
+            time.sleep(0.5)
+
+        def _copy_stderr():
+            for data in iter(lambda: process.stderr.read1(32768), b''):
+                channel.sendall_stderr(data)
+
+        stderr_thread = threading.Thread(target=_copy_stderr)
+        stderr_thread.start()
+        for data in iter(lambda: process.stdout.read1(32768), b''):
+            channel.sendall(data)
+        stderr_thread.join()
+        try:
+            if not self.early_exit_status:
+                channel.send_exit_status(process.wait())
+            channel.close()
+        except EOFError:
+            # the client may close the connection before the command ends
+            pass
+
+
+class SFTPHandle(paramiko.SFTPHandle):
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class SFTPServerInterface(paramiko.SFTPServerInterface):
+
+    def _call(self, func, *args):
+        try:
+            return func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def list_folder(self, path):
+        def _list():
+            return [paramiko.SFTPAttributes.from_stat(
+                os.lstat(os.path.join(path, name)), name)
+                for name in os.listdir(path)]
+        return self._call(_list)
+
+    def stat(self, path):
+        return self._call(
+            lambda: paramiko.SFTPAttributes.from_stat(os.stat(path)))
+
+    def lstat(self, path):
+        return self._call(
+            lambda: paramiko.SFTPAttributes.from_stat(os.lstat(path)))
+
+    def open(self, path, flags, attr):
+        def _open():
+            fd = os.open(path, flags, 0o644)
+            if flags & os.O_WRONLY:
+                mode = 'ab' if flags & os.O_APPEND else 'wb'
+            elif flags & os.O_RDWR:
+                mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+            else:
+                mode = 'rb'
+            fobj = os.fdopen(fd, mode)
+            handle = SFTPHandle(flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = fobj
+            return handle
+        return self._call(_open)
+
+    def remove(self, path):
+        return self._call(lambda: os.remove(path) or paramiko.SFTP_OK)
+
+    def rename(self, oldpath, newpath):
+        return self._call(
+            lambda: os.rename(oldpath, newpath) or paramiko.SFTP_OK)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(
+            lambda: os.replace(oldpath, newpath) or paramiko.SFTP_OK)
+
+    def mkdir(self, path, attr):
+        return self._call(lambda: os.mkdir(path) or paramiko.SFTP_OK)
+
+    def rmdir(self, path):
+        return self._call(lambda: os.rmdir(path) or paramiko.SFTP_OK)
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+
+class SSHServer(object):
+    """Listen on a random port of 127.0.0.1 in a thread"""
+
+    def __init__(self):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+        self.connections = 0
+        self._transports = []
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer,
+                                            SFTPServerInterface)
+            transport.start_server(server=ServerInterface())
+            self._transports.append(transport)
+
+    def stop(self):
+        self.sock.close()
+        for transport in self._transports:
+            transport.close()
@@ -0,0 +1,127 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from anycode.pysshpass import ssh
+from anyutils.extensions import sftpchunk
+from anyutils.extensions import sshcp
+from anyutils.extensions.test import sshserver
+
+CHUNK_SIZE = 64 * 1024
+
+
+class TestSftpChunk(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = sshserver.SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmp_dir, 'cache')
+        self.addCleanup(os.environ.pop, 'XDG_CACHE_HOME')
+        self.client = sshcp.connect(ssh.CmdRequest(
+            None, '127.0.0.1', user='test', password=sshserver.PASSWORD,
+            port=self.server.port, timeout=10))
+        self.addCleanup(self.client.close)
+        self.data = os.urandom(CHUNK_SIZE * 3 + 100)
+        self.src = self.make_file('src', self.data)
+
+    def make_file(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def transfer(self):
+        return sftpchunk.ChunkedTransfer(self.client.get_transport(),
+                                         chunk_size=CHUNK_SIZE, channels=3)
+
+    def test_get_chunks(self):
+        self.assertEqual(sftpchunk.get_chunks(10, 4),
+                         [(0, 0, 4), (1, 4, 4), (2, 8, 2)])
+        self.assertEqual(sftpchunk.get_chunks(0, 4), [])
+
+    def test_upload_download(self):
+        remote = os.path.join(self.tmp_dir, 'remote')
+        with self.transfer() as transfer:
+            transfer.upload(self.src, remote)
+            transfer.download(remote, os.path.join(self.tmp_dir, 'local'))
+        self.assertEqual(self.read_file(remote), self.data)
+        self.assertEqual(self.read_file(os.path.join(self.tmp_dir, 'local')),
+                         self.data)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['cache', 'local', 'remote', 'src'])
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'cache',
+                                                 'anyutils', 'sftpchunk')),
+                         [])
+
+    def test_invalid_options(self):
+        transport = self.client.get_transport()
+        for kwargs in ({'chunk_size': -1024}, {'chunk_size': 0},
+                       {'channels': 0}, {'channels': -1}):
+            self.assertRaises(ValueError, sftpchunk.ChunkedTransfer,
+                              transport, **kwargs)
+        self.assertEqual(sshcp.positive_int('3'), 3)
+        for value in ('0', '-1', 'x'):
+            self.assertRaises(argparse.ArgumentTypeError,
+                              sshcp.positive_int, value)
+
+    def test_upload_size_mismatch(self):
+        remote = os.path.join(self.tmp_dir, 'remote')
+
+        def _transfer(size, source, state_path, done, func):
+            # NOTE: the server is local, the part is truncated as if a
+            # chunk is lost
+            os.truncate(remote + sftpchunk.PART_SUFFIX, size - 1)
+
+        with self.transfer() as transfer, \
+                mock.patch.object(transfer, '_transfer', _transfer):
+            self.assertRaises(IOError, transfer.upload, self.src, remote)
+        self.assertFalse(os.path.exists(remote))
+
+    def test_upload_without_cache_dir(self):
+        # the cache dir can not be created, the upload is not resumable
+        cache_home = self.make_file('cache', b'')
+        os.environ['XDG_CACHE_HOME'] = cache_home
+        remote = os.path.join(self.tmp_dir, 'remote')
+        with self.transfer() as transfer:
+            self.assertIsNone(transfer.get_upload_state_path(remote))
+            transfer.upload(self.src, remote)
+        self.assertEqual(self.read_file(remote), self.data)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['cache', 'remote', 'src'])
+
+    def test_resume_download(self):
+        local = os.path.join(self.tmp_dir, 'local')
+        # chunk 0 is recorded as completed, it is not transferred again
+        self.make_file('local' + sftpchunk.PART_SUFFIX,
+                       b'x' * CHUNK_SIZE + b'\0' * (len(self.data) -
+                                                    CHUNK_SIZE))
+        sftpchunk.save_state(
+            local + sftpchunk.STATE_SUFFIX,
+            [len(self.data), int(os.stat(self.src).st_mtime)], {0})
+        with self.transfer() as transfer:
+            transfer.download(self.src, local)
+        self.assertEqual(self.read_file(local),
+                         b'x' * CHUNK_SIZE + self.data[CHUNK_SIZE:])
+        self.assertFalse(os.path.exists(local + sftpchunk.STATE_SUFFIX))
+
+    def test_check_md5(self):
+        with self.transfer() as transfer:
+            transfer._check_md5(self.src, 1, sftpchunk.hashlib.md5(
+                self.data[CHUNK_SIZE:CHUNK_SIZE * 2]).hexdigest())
+            self.assertRaises(IOError, transfer._check_md5, self.src, 1,
+                              '0' * 32)
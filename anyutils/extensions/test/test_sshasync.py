@@ -0,0 +1,183 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from anycode.pysshpass import ssh
+from anyutils.extensions import sshasync
+from anyutils.extensions import sshcp
+from anyutils.extensions.test import sshserver
+
+
+class TestSSHAsync(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = sshserver.SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def cmd_request(self, command, password=sshserver.PASSWORD):
+        return ssh.CmdRequest(command, '127.0.0.1', user='test',
+                              password=password, port=self.server.port,
+                              timeout=10)
+
+    def scp_request(self, local, remote):
+        return ssh.ScpRequest(local, remote, '127.0.0.1', user='test',
+                              password=sshserver.PASSWORD,
+                              port=self.server.port, timeout=10)
+
+    def call(self, action, requests, **kwargs):
+        results = []
+        failed = sshasync.call_on_hosts(
+            action, requests, callback=results.append,
+            backend=sshasync.ParamikoBackend.NAME, **kwargs)
+        return failed, results
+
+    def test_run(self):
+        requests = [self.cmd_request('echo hello {}'.format(i))
+                    for i in range(20)]
+        failed, results = self.call(sshasync.ACTION_RUN, requests,
+                                    concurrency=5)
+        self.assertEqual(failed, 0)
+        self.assertEqual(sorted(result['output'] for result in results),
+                         sorted('hello {}\n'.format(i) for i in range(20)))
+
+    def test_concurrency(self):
+        # each command sleeps 0.5 seconds, 6 hosts with 3 sessions take
+        # at least 2 rounds
+        counter = os.path.join(self.tmp_dir, 'counter')
+        command = 'echo >> {0}; sleep 0.5; wc -l < {0}'.format(counter)
+        failed, results = self.call(
+            sshasync.ACTION_RUN, [self.cmd_request(command)] * 6,
+            concurrency=3)
+        self.assertEqual(failed, 0)
+        self.assertLessEqual(min(int(result['output']) for result in results),
+                             3)
+
+    def test_errors(self):
+        failed, results = self.call(
+            sshasync.ACTION_RUN,
+            [self.cmd_request('exit 3'),
+             self.cmd_request('true', password='wrong'),
+             self.cmd_request('sleep 5')],
+            host_timeout=2)
+        self.assertEqual(failed, 3)
+        outputs = ' '.join(result['output'] for result in results)
+        self.assertIn('exit status 3', outputs)
+        self.assertIn('Auth failed', outputs)
+        self.assertIn('Timeout', outputs)
+
+    def test_upload_and_download(self):
+        local = os.path.join(self.tmp_dir, 'local')
+        os.makedirs(os.path.join(local, 'sub'))
+        with open(os.path.join(local, 'sub', 'a.txt'), 'w') as f:
+            f.write('hello')
+        remote = os.path.join(self.tmp_dir, 'remote')
+        os.makedirs(remote)
+        failed, _ = self.call(sshasync.ACTION_UPLOAD,
+                              [self.scp_request(local, remote)])
+        self.assertEqual(failed, 0)
+        with open(os.path.join(remote, 'local', 'sub', 'a.txt')) as f:
+            self.assertEqual(f.read(), 'hello')
+
+        download = os.path.join(self.tmp_dir, 'download')
+        failed, _ = self.call(
+            sshasync.ACTION_DOWNLOAD,
+            [self.scp_request(download, os.path.join(remote, 'local'))])
+        self.assertEqual(failed, 0)
+        with open(os.path.join(download, 'local', 'sub', 'a.txt')) as f:
+            self.assertEqual(f.read(), 'hello')
+
+    def test_timed_out_thread_holds_session(self):
+        # the thread of a timed out host keeps running, the other hosts
+        # must not wait for it after their timers start
+        running, max_running = [], []
+
+        def _run(backend, session):
+            request = session.request
+            running.append(request)
+            max_running.append(len(running))
+            time.sleep(float(request.command))
+            running.remove(request)
+            return 0, 'ok'
+
+        with mock.patch.object(sshasync.ParamikoBackend, '_run', _run):
+            failed, results = self.call(
+                sshasync.ACTION_RUN,
+                [self.cmd_request(seconds)
+                 for seconds in ['2.5', '0.1', '0.1', '0.1']],
+                concurrency=1, host_timeout=1)
+        self.assertEqual(failed, 1)
+        self.assertEqual(sorted(result['output'] for result in results),
+                         ['ERROR: Timeout(1 seconds)', 'ok', 'ok', 'ok'])
+        self.assertEqual(max(max_running), 1)
+
+    def get_workers(self):
+        return [thread for thread in threading.enumerate()
+                if thread.name.startswith('ThreadPoolExecutor')]
+
+    def test_timeout_closes_connection(self):
+        # the connection of the timed out host is closed, so its thread
+        # stops and the next host gets the session at once
+        workers = self.get_workers()
+        start_time = time.time()
+        failed, results = self.call(
+            sshasync.ACTION_RUN,
+            [self.cmd_request('sleep 8'), self.cmd_request('echo ok')],
+            concurrency=1, host_timeout=1)
+        self.assertLess(time.time() - start_time, 4)
+        self.assertEqual(failed, 1)
+        self.assertEqual(sorted(result['output'] for result in results),
+                         ['ERROR: Timeout(1 seconds)', 'ok\n'])
+        # NOTE: the worker threads are joined when python exits
+        while time.time() - start_time < 4 and \
+                len(self.get_workers()) > len(workers):
+            time.sleep(0.1)
+        self.assertEqual(self.get_workers(), workers)
+
+    def test_get_pty(self):
+        calls = []
+        iter_cmd_output = sshasync.sshcp.iter_cmd_output
+
+        def _iter_cmd_output(*args, **kwargs):
+            calls.append(kwargs['get_pty'])
+            return iter_cmd_output(*args, **kwargs)
+
+        with mock.patch.object(sshasync.sshcp, 'iter_cmd_output',
+                               _iter_cmd_output):
+            for get_pty in (False, True):
+                self.call(sshasync.ACTION_RUN, [self.cmd_request('true')],
+                          get_pty=get_pty)
+        self.assertEqual(calls, [False, True])
+
+    def test_reject_stream_options(self):
+        base = dict(host='127.0.0.1', command='true', user='test',
+                    password=sshserver.PASSWORD, port=self.server.port,
+                    timeout=10, worker=None, get_pty=False, stream=False,
+                    prefix=False, max_output=sshcp.DEFAULT_MAX_OUTPUT,
+                    spill_dir=None, engine='asyncio', host_timeout=None)
+        for options in [{'stream': True}, {'prefix': True},
+                        {'max_output': 10}, {'spill_dir': self.tmp_dir}]:
+            args = argparse.Namespace(**dict(base, **options))
+            with mock.patch.object(sshasync, 'call_on_hosts') as call:
+                self.assertEqual(sshcp.SSHCmd()(args), 1)
+            call.assert_not_called()
+        with mock.patch.object(sshasync, 'call_on_hosts',
+                               return_value=0) as call:
+            self.assertEqual(sshcp.SSHCmd()(argparse.Namespace(**base)), 0)
+        self.assertEqual(call.call_args[1]['get_pty'], False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from anycode.pysshpass import ssh
+from anyutils.extensions import sshbatch
+from anyutils.extensions import sshpool
+from anyutils.extensions.test import sshserver
+
+
+class TestSSHBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = sshserver.SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def cmd_request(self, host='127.0.0.1', password=sshserver.PASSWORD):
+        return ssh.CmdRequest(None, host, user='test',
+                              password=password, port=self.server.port,
+                              timeout=10)
+
+    def test_pool_reuse(self):
+        request = self.cmd_request()
+        with sshpool.ConnectionPool() as pool:
+            transport = pool.get_transport(request)
+            for i in range(3):
+                self.assertEqual(pool.run(request, 'echo {}'.format(i)),
+                                 (0, '{}\n'.format(i)))
+            self.assertIs(pool.get_transport(request), transport)
+            self.assertEqual(pool.run(request, 'exit 3')[0], 3)
+
+    def test_load_steps(self):
+        path = os.path.join(self.tmp_dir, 'steps.json')
+        for steps in ([], [{'action': 'run'}],
+                      [{'action': 'upload', 'local': path + '.not_exists',
+                        'remote': '/tmp'}]):
+            with open(path, 'w') as f:
+                json.dump(steps, f)
+            self.assertRaises(ValueError, sshbatch.load_steps, path)
+
+    def test_load_yaml_steps(self):
+        path = os.path.join(self.tmp_dir, 'steps.yaml')
+        with open(path, 'w') as f:
+            f.write('- action: run\n'
+                    '  command: uptime\n'
+                    '- action: download\n'
+                    '  remote: /tmp/a.txt\n'
+                    '  local: ./\n')
+        self.assertEqual(sshbatch.load_steps(path),
+                         [{'action': 'run', 'command': 'uptime'},
+                          {'action': 'download', 'remote': '/tmp/a.txt',
+                           'local': './'}])
+
+    def run_order(self, barrier):
+        """Return the (host, index) of steps in the order of completion"""
+        lock = os.path.join(tempfile.mkdtemp(dir=self.tmp_dir), 'lock')
+        # the first host creates the lock, the other one sleeps
+        steps = [{'action': 'run',
+                  'command': 'mkdir {} 2>/dev/null || sleep 1'.format(lock)},
+                 {'action': 'run', 'command': 'true'}]
+        results = []
+        failed = sshbatch.run_batch(
+            [self.cmd_request(), self.cmd_request(host='localhost')], steps,
+            barrier=barrier,
+            callback=lambda request, index, step, ok, output:
+                results.append((request.host, index)))
+        self.assertEqual(failed, 0)
+        return results
+
+    def test_run_pipeline(self):
+        # the fast host completes step 2 while the slow host is on step 1
+        results = self.run_order(barrier=False)
+        fast, slow = results[0][0], results[-1][0]
+        self.assertNotEqual(fast, slow)
+        self.assertEqual(results, [(fast, 1), (fast, 2), (slow, 1),
+                                   (slow, 2)])
+        results = self.run_order(barrier=True)
+        self.assertEqual([index for _, index in results], [1, 1, 2, 2])
+
+    def test_run_batch(self):
+        for barrier in (False, True):
+            self._test_run_batch(barrier)
+
+    def _test_run_batch(self, barrier):
+        local = os.path.join(self.tmp_dir, 'a.txt')
+        with open(local, 'w') as f:
+            f.write('hello')
+        remote_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        download_dir = os.path.join(self.tmp_dir, 'download')
+        remote = os.path.join(remote_dir, 'a.txt')
+        steps = [{'action': 'upload', 'local': local, 'remote': remote_dir},
+                 {'action': 'run', 'command': 'cat {}'.format(remote)},
+                 {'action': 'download', 'remote': remote,
+                  'local': download_dir}]
+        results = []
+        failed = sshbatch.run_batch(
+            [self.cmd_request(),
+             self.cmd_request(host='localhost', password='wrong')],
+            steps, barrier=barrier,
+            callback=lambda request, index, step, ok, output:
+                results.append((request.password, index, ok, output)))
+        self.assertEqual(failed, 1)
+        # the host failed in step 1 is skipped in the following steps
+        self.assertEqual(sorted(results)[:3],
+                         [(sshserver.PASSWORD, 1, True, 'success'),
+                          (sshserver.PASSWORD, 2, True, 'hello'),
+                          (sshserver.PASSWORD, 3, True, 'success')])
+        with open(os.path.join(download_dir, '127.0.0.1', 'a.txt')) as f:
+            self.assertEqual(f.read(), 'hello')
+        self.assertEqual([r[:3] for r in results if r[0] == 'wrong'],
+                         [('wrong', 1, False)])
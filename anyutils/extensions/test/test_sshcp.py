@@ -0,0 +1,106 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from anycode.pysshpass import ssh
+from anyutils.extensions import sshcp
+from anyutils.extensions.test import sshserver
+
+
+def run(transport, command, **kwargs):
+    """Return (exit status, stdout, stderr) of command"""
+    outputs = sshcp.iter_cmd_output(transport, command, **kwargs)
+    data = {False: [], True: []}
+    while True:
+        try:
+            is_stderr, output = next(outputs)
+        except StopIteration as e:
+            return e.value, b''.join(data[False]), b''.join(data[True])
+        data[is_stderr].append(output)
+
+
+class TestSSHCmd(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = sshserver.SSHServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def cmd_request(self, command, user='test'):
+        return ssh.CmdRequest(command, '127.0.0.1', user=user,
+                              password=sshserver.PASSWORD,
+                              port=self.server.port, timeout=10)
+
+    def connect(self):
+        client = sshcp.connect(self.cmd_request(None))
+        self.addCleanup(client.close)
+        return client.get_transport()
+
+    def test_iter_cmd_output(self):
+        transport = self.connect()
+        self.assertEqual(run(transport, 'printf out; printf err >&2; exit 3'),
+                         (3, b'out', b'err'))
+        self.assertEqual(run(transport, 'true'), (0, b'', b''))
+        status, stdout, stderr = run(
+            transport, 'head -c 3000000 /dev/zero; head -c 500000 '
+                       '/dev/zero >&2')
+        self.assertEqual((status, len(stdout), len(stderr)),
+                         (0, 3000000, 500000))
+
+    def test_output_after_exit_status(self):
+        transport = self.connect()
+        with mock.patch.object(sshserver.ServerInterface,
+                               'early_exit_status', True):
+            self.assertEqual(run(transport, 'printf out; printf err >&2'),
+                             (0, b'out', b'err'))
+
+    def test_spill_files(self):
+        printer = sshcp.StreamPrinter(max_output=10, spill_dir=self.tmp_dir,
+                                      stream=io.BytesIO())
+        for user in ('alice', 'bob'):
+            self.assertTrue(sshcp.stream_cmd_on_host(
+                self.cmd_request('echo output of {}'.format(user),
+                                 user=user), printer))
+        for user in ('alice', 'bob'):
+            path = os.path.join(self.tmp_dir, '{}@127.0.0.1_{}.out'.format(
+                user, self.server.port))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(),
+                                 'output of {}\n'.format(user).encode())
+        self.assertIn(b'output is too large', printer.stream.getvalue())
+
+    def test_stream_prefix(self):
+        printer = sshcp.StreamPrinter(prefix=True, stream=io.BytesIO())
+        self.assertFalse(sshcp.stream_cmd_on_host(
+            self.cmd_request('printf "a\\nb"; exit 2'), printer))
+        self.assertEqual(printer.stream.getvalue(),
+                         b'127.0.0.1: a\n127.0.0.1: b\n'
+                         b'127.0.0.1: ERROR: exit status 2\n')
+
+    def test_stream_prefix_long_line(self):
+        printer = sshcp.StreamPrinter(prefix=True, max_output=10,
+                                      stream=io.BytesIO())
+        output = printer.open('host')
+        for _ in range(7):
+            output.write(b'x' * 4)
+            self.assertLess(sum(len(partial) for partial in
+                                output._partial.values()), 10)
+        output.write(b'y\nz')
+        output.close()
+        self.assertEqual(printer.stream.getvalue(),
+                         b'host: ' + b'x' * 12 + b'\nhost: ' + b'x' * 12 +
+                         b'\nhost: xxxxy\nhost: z\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
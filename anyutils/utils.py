@@ -0,0 +1,30 @@
+import os
+
+
+def get_cache_dir(*paths):
+    """Get the cache dir of anyutils, it will be created if not exists
+
+    The dir is $XDG_CACHE_HOME/anyutils, default is ~/.cache/anyutils
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    cache_dir = os.path.join(cache_home, 'anyutils', *paths)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+class LazyArguments(object):
+    """The ARGUMENTS of a cli class which are built at the first use
+
+    func returns the list of arguments, the modules needed by them are
+    imported in func, so they are not imported if the cli is not chosen.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.arguments = None
+
+    def __get__(self, obj, owner=None):
+        if self.arguments is None:
+            self.arguments = self.func()
+        return self.arguments